@@ -1,12 +1,33 @@
+import csv
+import io
+import json
 import os
+import re
 import sqlite3
+import tempfile
+import time
+import zlib
+from concurrent.futures import TimeoutError as FutureTimeout
 from datetime import datetime, date, timedelta
 from functools import wraps
 from werkzeug.utils import secure_filename
 from flask import (
     Flask, render_template, request, redirect,
-    url_for, session, flash, make_response
+    url_for, session, flash, make_response, g,
+    Response, stream_with_context, send_file, jsonify, abort
 )
+from openpyxl import Workbook
+
+from db import pooled_conn, release_conn, data_version, es_bloqueo, caja_estado_dia_unico, SQLITE_TRIGRAM
+import caja_escritor
+import imagenes
+import importar
+import inventario
+import metricas
+import perfil
+import reportes_pdf
+import respuestas_cache
+import static_assets
 
 CATEGORIAS_MAQUINAS = [
     "Helado soft", "Helado artesanal", "Granizadora", "Milkshake",
@@ -23,14 +44,16 @@ UNIDADES = ["unidad", "caja", "paquete", "kit", "bolsa", "litro", "kilogramo"]
 app = Flask(__name__)
 app.secret_key = "miken_prototipo_secret"
 
-DB_NAME = "miken.db"
-
-
 UPLOAD_FOLDER = os.path.join(app.root_path, "static", "uploads")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 ALLOWED_EXTS = {"png", "jpg", "jpeg", "webp"}
 
+# /static con cache largo + variantes .gz/.br; static_url() en plantillas
+static_assets.init_app(app)
+# renditions de imágenes (thumb/form/full) + imagen_url()/imagen_srcset() en plantillas
+imagenes.init_app(app)
+
 
 # --------------------
 # UTILIDADES
@@ -39,19 +62,16 @@ def allowed_file(filename: str) -> bool:
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTS
 
 def db_conn():
-    conn = sqlite3.connect(
-        DB_NAME,
-        timeout=30,
-        check_same_thread=False
-    )
-    conn.row_factory = sqlite3.Row
+    # Una conexión por hilo (pool en db.py), ligada al app context de Flask.
+    # Los PRAGMA ya se aplicaron al abrirla; aquí solo se reutiliza.
+    if "db" not in g:
+        g.db = pooled_conn()
+    return g.db
 
-    conn.execute("PRAGMA foreign_keys=ON;")
-    conn.execute("PRAGMA journal_mode=WAL;")
-    conn.execute("PRAGMA synchronous=NORMAL;")
-    conn.execute("PRAGMA busy_timeout=30000;")
 
-    return conn
+@app.teardown_appcontext
+def db_release(exc):
+    release_conn(g.pop("db", None))
 
 
 def login_required(view):
@@ -63,12 +83,127 @@ def login_required(view):
     return wrapped
 
 
+# Páginas renderizadas en memoria (respuestas_cache.py); se invalidan solas cuando
+# cambia la versión de sus tablas (triggers de data_versions en db.py)
+vistas_cache = respuestas_cache.RespuestaCache()
+
+
+def cache_vista(*tablas):
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            # con mensajes flash pendientes la página sale distinta: ni se usa ni se guarda
+            if request.method != "GET" or "_flashes" in session:
+                return view(*args, **kwargs)
+
+            clave = (request.path, request.query_string, session.get("username"), today_str())
+            versiones = data_version(db_conn().cursor(), *tablas)
+            hit = vistas_cache.get(clave, versiones)
+            if hit is not None:
+                body, content_type = hit
+                return Response(body, content_type=content_type)
+
+            resp = make_response(view(*args, **kwargs))
+            if resp.status_code == 200 and not resp.is_streamed:
+                vistas_cache.set(clave, versiones, (resp.get_data(), resp.content_type))
+            return resp
+        return wrapped
+    return decorator
+
+
+@app.route("/__cache")
+@login_required
+def cache_stats():
+    return jsonify(vistas_cache.stats())
+
+
+# --------------------
+# PERFIL DE CONSULTAS (perfil.py)
+# --------------------
+@app.before_request
+def perfil_iniciar():
+    if request.endpoint != "static":
+        perfil.iniciar(request.endpoint or "(404)")
+
+
+@app.after_request
+def perfil_server_timing(response):
+    p = perfil.actual()
+    if p is not None:
+        response.headers["Server-Timing"] = perfil.server_timing(p)
+        if response.is_streamed:
+            # el cuerpo (CSV) se genera después del teardown: el perfil se
+            # cierra cuando el servidor termina de enviarlo, así esas lecturas cuentan
+            p.diferido = True
+            response.call_on_close(lambda: perfil.terminar(pooled_conn, al_cerrar=True))
+    return response
+
+
+@app.teardown_request
+def perfil_terminar(exc):
+    perfil.terminar(pooled_conn)
+
+
+@app.route("/__perf", methods=["GET", "POST"])
+@login_required
+def perf():
+    # solo con debug: expone SQL y planes de consulta
+    if not app.debug:
+        abort(404)
+    if request.method == "POST":
+        perfil.reiniciar()
+        return redirect(url_for("perf"))
+    return render_template("perf.html", r=perfil.resumen(), lenta_ms=perfil.LENTA_MS, title="MIKEN - Perfil")
+
+
+# --------------------
+# MÉTRICAS (metricas.py)
+# --------------------
+@app.before_request
+def metricas_iniciar():
+    g.t0 = time.perf_counter()
+
+
+@app.after_request
+def metricas_request(response):
+    endpoint = request.endpoint or "(404)"
+    metricas.sumar("miken_requests_total", endpoint=endpoint, method=request.method, status=response.status_code)
+    metricas.observar("miken_request_segundos", time.perf_counter() - g.t0, endpoint=endpoint)
+    if request.content_length and request.mimetype == "multipart/form-data":
+        metricas.sumar("miken_subidas_bytes_total", request.content_length, endpoint=endpoint)
+    return response
+
+
+@metricas.colector
+def _metricas_cache():
+    s = vistas_cache.stats()
+    series = [("miken_cache_vistas_total", {"resultado": r}, s[r])
+              for r in ("hits", "misses", "invalidadas", "expiradas", "descartadas")]
+    series.append(("miken_cache_vistas_entradas", {}, s["entradas"]))
+    return series
+
+
+@app.route("/metrics")
+def metrics():
+    # sin login: lo lee Prometheus (solo nombres de endpoints y números)
+    return Response(metricas.exposicion(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.after_request
 def no_cache(response):
-    response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, private, max-age=0"
-    response.headers["Pragma"] = "no-cache"
-    response.headers["Expires"] = "0"
-    response.headers["Vary"] = "Cookie"
+    # /static maneja su propio cache (static_assets.py)
+    if request.endpoint == "static":
+        return response
+
+    # HTML con sesión: que el botón "atrás" no muestre páginas privadas después del logout
+    if "username" in session and response.mimetype == "text/html":
+        response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, private, max-age=0"
+        response.headers["Pragma"] = "no-cache"
+        response.headers["Expires"] = "0"
+    elif "username" in session:
+        # descargas (CSV/Excel/PDF): solo en el navegador del usuario, revalidando
+        response.headers.setdefault("Cache-Control", "private, no-cache")
+    response.vary.add("Cookie")
     return response
 
 
@@ -88,6 +223,199 @@ def parse_date_yyyy_mm_dd(s: str, fallback: str):
         return fallback
 
 
+def normalize_fecha(s: str, fallback: str):
+    """Lleva una fecha/hora escrita a mano a 'YYYY-MM-DD HH:MM:SS' (formato de now_str)."""
+    s = s.strip().replace("T", " ")
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(s, fmt).strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            continue
+    return fallback
+
+
+def rango_fecha_sql(start: str, end: str):
+    """
+    Filtro por días [start, end] sobre 'fecha' sin envolver la columna en date():
+    fecha >= 'start' AND fecha < 'end + 1 día'. Así usa idx_caja_mov_fecha.
+    Devuelve (sql, params).
+    """
+    end_excl = (datetime.strptime(end, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+    return "fecha >= ? AND fecha < ?", [start, end_excl]
+
+
+# --------------------
+# PAGINACIÓN POR CURSOR (keyset)
+# --------------------
+TOTAL_CACHE_TTL = 30  # segundos
+# acotado (LRU): cada búsqueda distinta es una clave
+_total_cache = respuestas_cache.RespuestaCache(max_entradas=512, ttl=TOTAL_CACHE_TTL)
+
+
+def parse_cursor(raw: str):
+    """Los cursores son ids (?after=<id> / ?before=<id>); cualquier otra cosa se ignora."""
+    try:
+        return int(raw) if raw else None
+    except ValueError:
+        return None
+
+
+def cursor_key(cur, table: str, cols, row_id, params=()):
+    """
+    Valores de las columnas de orden para la fila `row_id` (búsqueda por PK).
+    `table` puede ser una subconsulta "(SELECT ...)" con sus `params`.
+    """
+    if row_id is None:
+        return None
+    cur.execute(f"SELECT {', '.join(cols)} FROM {table} WHERE id=?", tuple(params) + (row_id,))
+    row = cur.fetchone()
+    return tuple(row) if row else None
+
+
+def keyset_page(cur, select_sql, where, params, cols, desc, after, before, per_page):
+    """
+    Página de `per_page` filas ordenadas por `cols` (todas ASC o todas DESC; la última es id).
+    after/before son las claves (tupla de valores de cols) de la última/primera fila visible.
+    En vez de OFFSET se compara (cols) contra la clave, así la página 10.000 cuesta lo mismo
+    que la primera.
+    Devuelve (filas, hay_anterior, hay_siguiente).
+    """
+    tupla = "(" + ", ".join(cols) + ")"
+    marcas = "(" + ", ".join("?" * len(cols)) + ")"
+    conds = [where] if where else []
+    params = list(params)
+
+    hacia_atras = before is not None
+    if hacia_atras:
+        conds.append(f"{tupla} {'>' if desc else '<'} {marcas}")
+        params += list(before)
+    elif after is not None:
+        conds.append(f"{tupla} {'<' if desc else '>'} {marcas}")
+        params += list(after)
+
+    sentido = "DESC" if desc != hacia_atras else "ASC"
+    where_sql = ("WHERE " + " AND ".join(conds)) if conds else ""
+    cur.execute(f"""
+        {select_sql}
+        {where_sql}
+        ORDER BY {", ".join(f"{c} {sentido}" for c in cols)}
+        LIMIT ?
+    """, tuple(params + [per_page + 1]))
+    rows = cur.fetchall()
+
+    hay_mas = len(rows) > per_page
+    rows = rows[:per_page]
+    if hacia_atras:
+        rows.reverse()
+        return rows, hay_mas, True
+    return rows, after is not None, hay_mas
+
+
+def cached_count(cur, from_where_sql, params):
+    """COUNT(*) cacheado unos segundos: el total es informativo y no se recalcula en cada página."""
+    key = (from_where_sql, tuple(params))
+    total = _total_cache.get(key, ())
+    if total is not None:
+        return total
+
+    cur.execute(f"SELECT COUNT(*) AS c {from_where_sql}", tuple(params))
+    total = cur.fetchone()["c"]
+    _total_cache.set(key, (), total)
+    return total
+
+
+def page_cursors(rows, hay_anterior, hay_siguiente):
+    prev_cursor = rows[0]["id"] if (rows and hay_anterior) else None
+    next_cursor = rows[-1]["id"] if (rows and hay_siguiente) else None
+    return prev_cursor, next_cursor
+
+
+def page_number(after, before):
+    # Solo para mostrar "Página N": sin cursor siempre es la primera
+    if after is None and before is None:
+        return 1
+    try:
+        return max(1, int(request.args.get("page", "1")))
+    except ValueError:
+        return 1
+
+
+def fts_query(q: str) -> str:
+    """
+    Texto del buscador -> consulta FTS5: cada palabra como prefijo, todas obligatorias.
+    'maq soft' -> '"maq"* "soft"*'. Los acentos los ignora el tokenizer.
+    """
+    palabras = re.findall(r"\w+", q)
+    return " ".join(f'"{p}"*' for p in palabras)
+
+
+def sku_query(q: str) -> str:
+    """Fragmento de sku para productos_sku_fts (trigram): 3+ caracteres, como frase."""
+    q = q.strip()
+    if not SQLITE_TRIGRAM or len(q) < 3:
+        return ""
+    return '"' + q.replace('"', '""') + '"'
+
+
+def paginar_productos(cols, where, params, orden, desc, q, per_page):
+    """
+    Listado paginado de productos, con o sin búsqueda.
+    Sin búsqueda: orden `orden` sobre productos.
+    Con búsqueda: palabras por prefijo en sku/nombre/categoría (productos_fts) o un
+    fragmento del sku (productos_sku_fts), ordenado por relevancia (rank, id).
+    Devuelve (productos, total, prev_cursor, next_cursor).
+    """
+    cur = db_conn().cursor()
+    after_id = parse_cursor(request.args.get("after", "").strip())
+    before_id = parse_cursor(request.args.get("before", "").strip())
+    match, match_sku = fts_query(q), sku_query(q)
+
+    if q.strip() and not (match or match_sku):
+        return [], 0, None, None  # solo signos ('-', '%'): nada que buscar, no el listado completo
+
+    if match or match_sku:
+        # ids: para el COUNT (sin rank, que es lo caro); con score: para ordenar la página.
+        # Un producto que coincide por las dos vías aparece una vez (el sku solo suma
+        # los que las palabras no encontraron)
+        palabras = "SELECT rowid AS id{} FROM productos_fts WHERE productos_fts MATCH ?"
+        fragmento = "SELECT rowid AS id{} FROM productos_sku_fts WHERE productos_sku_fts MATCH ?"
+        if match and match_sku:
+            ids = f"{palabras.format('')} UNION {fragmento.format('')}"
+            con_score = (f"{palabras.format(', rank AS score')} UNION ALL "
+                         f"{fragmento.format(', rank AS score')} AND rowid NOT IN ({palabras.format('')})")
+            ids_params, score_params = [match, match_sku], [match, match_sku, match]
+        else:
+            unica = palabras if match else fragmento
+            ids, con_score = unica.format(""), unica.format(", rank AS score")
+            ids_params = score_params = [match or match_sku]
+
+        # CROSS JOIN fija el orden: primero el MATCH y luego productos por PK. Con JOIN
+        # el planificador puede recorrer productos por tipo y hacer un MATCH por fila.
+        base = f"FROM ({ids}) m CROSS JOIN productos p ON p.id = m.id WHERE {where}"
+        base_params = ids_params + list(params)
+        key_params = score_params + list(params)
+        fuente = (f"(SELECT {', '.join('p.' + c for c in cols)}, m.score AS score "
+                  f"FROM ({con_score}) m CROSS JOIN productos p ON p.id = m.id WHERE {where})")
+        orden, desc = ["score", "id"], False
+        select_sql, where, params = f"SELECT * FROM {fuente} AS r", "", key_params
+    else:
+        base = f"FROM productos WHERE {where}"
+        base_params = list(params)
+        fuente, select_sql = "productos", f"SELECT {', '.join(cols)} FROM productos"
+        key_params = ()
+
+    total = cached_count(cur, base, base_params)
+
+    productos, hay_anterior, hay_siguiente = keyset_page(
+        cur, select_sql, where, params, orden, desc,
+        cursor_key(cur, fuente, orden, after_id, key_params),
+        cursor_key(cur, fuente, orden, before_id, key_params),
+        per_page
+    )
+    prev_cursor, next_cursor = page_cursors(productos, hay_anterior, hay_siguiente)
+    return productos, total, prev_cursor, next_cursor
+
+
 # --------------------
 # LOGIN / LOGOUT (DEMO)
 # --------------------
@@ -124,16 +452,6 @@ def login():
 
 
 
-
-@app.after_request
-def no_cache(response):
-    response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, private, max-age=0"
-    response.headers["Pragma"] = "no-cache"
-    response.headers["Expires"] = "0"
-    response.headers["Vary"] = "Cookie"
-    return response
-
-
 @app.route("/logout")
 def logout():
     session.clear()
@@ -149,49 +467,85 @@ def logout():
 # --------------------
 # DASHBOARD (Sprint 4 UI)
 # --------------------
+class DashboardStats:
+    """
+    KPIs del dashboard en dos consultas:
+      - productos(): un solo recorrido de productos con SUM(CASE ...) condicionales
+        (stock bajo incluido: ya se leen todos los activos)
+      - caja(dia): estado del día + totales de efectivo (caja_saldos) en una sola consulta
+    stock_bajo() es para quien solo necesita esos contadores (eventos de stock bajo):
+    sale del índice parcial sin recorrer productos.
+    """
+
+    def __init__(self, cur):
+        self.cur = cur
+
+    def productos(self) -> dict:
+        self.cur.execute("""
+            SELECT
+              COUNT(*) AS total_productos,
+              COALESCE(SUM(CASE WHEN tipo='maquina' THEN 1 ELSE 0 END),0) AS maquinas_total,
+              COALESCE(SUM(CASE WHEN tipo='maquina'
+                                 AND LOWER(COALESCE(categoria,'')) LIKE '%revision%' THEN 1 ELSE 0 END),0) AS maquinas_revision,
+              COALESCE(SUM(CASE WHEN tipo='insumo' AND stock_actual <= stock_min THEN 1 ELSE 0 END),0) AS bajo_insumos,
+              COALESCE(SUM(CASE WHEN tipo='maquina' AND stock_actual <= stock_min THEN 1 ELSE 0 END),0) AS bajo_maquinas
+            FROM productos
+            WHERE activo=1
+        """)
+        return dict(self.cur.fetchone())
+
+    def stock_bajo(self) -> dict:
+        # sale del índice parcial idx_productos_stock_bajo (solo los productos en stock bajo)
+        self.cur.execute("""
+            SELECT
+              COALESCE(SUM(tipo='insumo'),0) AS bajo_insumos,
+              COALESCE(SUM(tipo='maquina'),0) AS bajo_maquinas
+            FROM productos
+            WHERE activo=1 AND stock_actual <= stock_min
+        """)
+        return dict(self.cur.fetchone())
+
+    def caja(self, dia: str) -> dict:
+        self.cur.execute("""
+            SELECT
+              e.abierta AS abierta,
+              e.efectivo_inicial AS efectivo_inicial,
+              COALESCE(s.ingresos, 0) AS ing,
+              COALESCE(s.egresos, 0) AS egr
+            FROM (SELECT ? AS dia) d
+            LEFT JOIN caja_estado e ON e.dia = d.dia
+            LEFT JOIN caja_saldos s ON s.dia = d.dia AND s.metodo='efectivo'
+        """, (dia,))
+        t = self.cur.fetchone()
+
+        existe = t["abierta"] is not None
+        efectivo_inicial = float(t["efectivo_inicial"]) if existe else 0.0
+        return {
+            "caja_abierta": 1 if (existe and int(t["abierta"]) == 1) else 0,
+            "efectivo_inicial": efectivo_inicial,
+            "saldo_caja": efectivo_inicial + float(t["ing"]) - float(t["egr"]),
+        }
+
+
 @app.route("/dashboard")
 @login_required
+@cache_vista("productos", "caja_movimientos", "caja_estado")
 def dashboard():
     conn = db_conn()
     cur = conn.cursor()
+    stats = DashboardStats(cur)
 
-    # ====== KPIs TOP ======
-    # Total productos activos (insumos + maquinas)
-    cur.execute("SELECT COUNT(*) AS c FROM productos WHERE activo=1")
-    total_productos = cur.fetchone()["c"]
-
-    # Bajo stock por tipo
-    cur.execute("""
-        SELECT COUNT(*) AS c
-        FROM productos
-        WHERE activo=1 AND tipo='insumo' AND stock_actual <= stock_min
-    """)
-    bajo_insumos = cur.fetchone()["c"]
-
-    cur.execute("""
-        SELECT COUNT(*) AS c
-        FROM productos
-        WHERE activo=1 AND tipo='maquina' AND stock_actual <= stock_min
-    """)
-    bajo_maquinas = cur.fetchone()["c"]
+    # ====== KPIs TOP + Estado operativo (un solo recorrido de productos) ======
+    kpis = stats.productos()
+    total_productos = kpis["total_productos"]
+    bajo_insumos = kpis["bajo_insumos"]
+    bajo_maquinas = kpis["bajo_maquinas"]
 
     # ====== Caja chica (solo visual en dashboard) ======
-    dia = today_str()
-    cur.execute("SELECT * FROM caja_estado WHERE dia=?", (dia,))
-    caja_estado = cur.fetchone()
-    caja_abierta = 1 if (caja_estado and int(caja_estado["abierta"]) == 1) else 0
-
     # saldo efectivo estimado hoy (si caja existe)
-    efectivo_inicial = float(caja_estado["efectivo_inicial"]) if caja_estado else 0.0
-    cur.execute("""
-        SELECT
-          COALESCE(SUM(CASE WHEN tipo_mov='ingreso' THEN monto ELSE 0 END),0) AS ing,
-          COALESCE(SUM(CASE WHEN tipo_mov='egreso' THEN monto ELSE 0 END),0) AS egr
-        FROM caja_movimientos
-        WHERE dia=? AND metodo='efectivo'
-    """, (dia,))
-    t = cur.fetchone()
-    saldo_caja = efectivo_inicial + float(t["ing"]) - float(t["egr"])
+    caja = stats.caja(today_str())
+    caja_abierta = caja["caja_abierta"]
+    saldo_caja = caja["saldo_caja"]
 
     # ====== Existencias Insumos (tabla tipo app) ======
     # Traemos insumos ordenados por categoria/nombre (máx 30 para el panel)
@@ -211,20 +565,8 @@ def dashboard():
     # - Total máquinas = tipo='maquina' activas
     # - En revisión = maquinas cuya categoria contiene 'revision' (puedes usar "En revisión", "Revision", etc.)
     # - Operativas = total - en revisión
-    cur.execute("""
-        SELECT COUNT(*) AS c
-        FROM productos
-        WHERE activo=1 AND tipo='maquina'
-    """)
-    maquinas_total = cur.fetchone()["c"]
-
-    cur.execute("""
-        SELECT COUNT(*) AS c
-        FROM productos
-        WHERE activo=1 AND tipo='maquina'
-          AND LOWER(COALESCE(categoria,'')) LIKE '%revision%'
-    """)
-    maquinas_revision = cur.fetchone()["c"]
+    maquinas_total = kpis["maquinas_total"]
+    maquinas_revision = kpis["maquinas_revision"]
 
     maquinas_operativas = max(0, maquinas_total - maquinas_revision)
     pct_operativas = 0
@@ -249,82 +591,281 @@ def dashboard():
         maquinas_total=maquinas_total,
         maquinas_operativas=maquinas_operativas,
         maquinas_revision=maquinas_revision,
-        pct_operativas=pct_operativas,
-        ultimo_reporte=now_str()
+        pct_operativas=pct_operativas
     )
 
 
 # --------------------
-# REPORTES (descarga simple CSV)
+# REPORTES (descarga CSV en streaming)
 # --------------------
-@app.route("/reportes/ventas.csv")
-@login_required
-def reporte_ventas_csv():
+CSV_BATCH = 1000
+
+
+def stream_csv(sql: str, params, encabezado, filename: str):
+    """
+    Respuesta CSV que se genera mientras se envía: el cursor se lee en lotes
+    (fetchmany) y cada lote sale por la red, así la memoria no crece con el reporte.
+    csv.writer se encarga de las comillas (ya no se pierden las comas de los textos).
+    Si el cliente acepta gzip, se comprime al vuelo.
+    """
+    usar_gzip = "gzip" in request.headers.get("Accept-Encoding", "")
+
+    def lotes():
+        cur = db_conn().cursor()
+        cur.execute(sql, tuple(params))
+
+        buf = io.StringIO()
+        w = csv.writer(buf)
+        w.writerow(encabezado)
+        while True:
+            rows = cur.fetchmany(CSV_BATCH)
+            if not rows:
+                break
+            w.writerows(rows)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate(0)
+
+        resto = buf.getvalue()
+        if resto:
+            yield resto
+
+    def comprimir(textos):
+        z = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> formato gzip
+        for t in textos:
+            data = z.compress(t.encode("utf-8"))
+            if data:
+                yield data
+        yield z.flush()
+
+    cuerpo = comprimir(lotes()) if usar_gzip else lotes()
+    resp = Response(stream_with_context(cuerpo), mimetype="text/csv")
+    resp.headers["Content-Type"] = "text/csv; charset=utf-8"
+    resp.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    if usar_gzip:
+        resp.headers["Content-Encoding"] = "gzip"
+    resp.vary.add("Accept-Encoding")
+    return resp
+
+
+XLSX_SPOOL_MAX = 8 * 1024 * 1024  # hasta 8 MB en memoria, luego a disco
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def send_xlsx(hoja: str, sql: str, params, encabezado, filename: str, convertir=None):
+    """
+    Excel con openpyxl en modo write_only: las filas se escriben a medida que salen
+    del cursor (fetchmany) y el libro se guarda en un SpooledTemporaryFile, así
+    la memoria queda acotada aunque el reporte tenga cientos de miles de filas.
+    `convertir(row)` devuelve la fila con tipos de Excel (números, fechas).
     """
-    Como aún no hay tabla de "ventas", este reporte toma:
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(hoja)
+    ws.append(encabezado)
+
+    cur = db_conn().cursor()
+    cur.execute(sql, tuple(params))
+    while True:
+        rows = cur.fetchmany(CSV_BATCH)
+        if not rows:
+            break
+        for r in rows:
+            ws.append(convertir(r) if convertir else list(r))
+
+    out = tempfile.SpooledTemporaryFile(max_size=XLSX_SPOOL_MAX)
+    wb.save(out)
+    out.seek(0)
+    return send_file(out, mimetype=XLSX_MIMETYPE, as_attachment=True, download_name=filename)
+
+
+def _ventas_sql():
+    """
+    Como aún no hay tabla de "ventas", los reportes de ventas toman:
     - caja_movimientos donde tipo_mov='ingreso'
     - y motivo contiene "venta" (puedes registrar así tus ventas por ahora)
+    Filtro opcional ?start=YYYY-MM-DD&end=YYYY-MM-DD. Devuelve (where, params).
     """
-    conn = db_conn()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT fecha, dia, monto, motivo, metodo, referencia
-        FROM caja_movimientos
-        WHERE tipo_mov='ingreso'
-          AND LOWER(COALESCE(motivo,'')) LIKE '%venta%'
-        ORDER BY datetime(fecha) DESC, id DESC
-    """)
-    rows = cur.fetchall()
-    conn.close()
+    where = "tipo_mov='ingreso' AND LOWER(COALESCE(motivo,'')) LIKE '%venta%'"
+    params = []
 
-    lines = ["fecha,dia,monto,motivo,metodo,referencia"]
-    for r in rows:
-        fecha = (r["fecha"] or "").replace(",", " ")
-        dia = (r["dia"] or "").replace(",", " ")
-        monto = str(r["monto"] if r["monto"] is not None else 0)
-        motivo = (r["motivo"] or "").replace(",", " ")
-        metodo = (r["metodo"] or "").replace(",", " ")
-        referencia = (r["referencia"] or "").replace(",", " ")
-        lines.append(f"{fecha},{dia},{monto},{motivo},{metodo},{referencia}")
-
-    csv_data = "\n".join(lines)
-    resp = make_response(csv_data)
-    resp.headers["Content-Type"] = "text/csv; charset=utf-8"
-    resp.headers["Content-Disposition"] = "attachment; filename=reporte_ventas.csv"
-    return resp
+    start = parse_date_yyyy_mm_dd(request.args.get("start", "").strip(), "")
+    end = parse_date_yyyy_mm_dd(request.args.get("end", "").strip(), "")
+    if start or end:
+        rango_sql, params = rango_fecha_sql(start or "0000-01-01", end or "9999-12-30")
+        where += " AND " + rango_sql
+    return where, params
+
+
+VENTAS_COLS = ["fecha", "dia", "monto", "motivo", "metodo", "referencia"]
+INVENTARIO_COLS = ["tipo", "sku", "nombre", "categoria", "unidad", "precio", "stock_actual", "stock_min", "activo"]
+
+INVENTARIO_SQL = """
+    SELECT COALESCE(tipo,''), COALESCE(sku,''), COALESCE(nombre,''), COALESCE(categoria,''),
+           COALESCE(unidad,''), COALESCE(precio,0), COALESCE(stock_actual,0),
+           COALESCE(stock_min,0), COALESCE(activo,0)
+    FROM productos
+    ORDER BY tipo, COALESCE(categoria,''), nombre
+"""
+
+
+@app.route("/reportes/ventas.csv")
+@login_required
+def reporte_ventas_csv():
+    where, params = _ventas_sql()
+    return stream_csv(f"""
+        SELECT COALESCE(fecha,''), COALESCE(dia,''), COALESCE(monto,0),
+               COALESCE(motivo,''), COALESCE(metodo,''), COALESCE(referencia,'')
+        FROM caja_movimientos
+        WHERE {where}
+        ORDER BY fecha DESC, id DESC
+    """, params, VENTAS_COLS, "reporte_ventas.csv")
 
 
 @app.route("/reportes/inventario.csv")
 @login_required
 def reporte_inventario_csv():
+    return stream_csv(INVENTARIO_SQL, (), INVENTARIO_COLS, "reporte_inventario.csv")
+
+
+def _venta_xlsx(r):
+    # fecha/dia como fechas de Excel y monto como número
+    try:
+        fecha = datetime.strptime(r["fecha"], "%Y-%m-%d %H:%M:%S")
+    except (TypeError, ValueError):
+        fecha = r["fecha"]
+    try:
+        dia = datetime.strptime(r["dia"], "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        dia = r["dia"]
+    return [fecha, dia, float(r["monto"] or 0), r["motivo"] or "", r["metodo"] or "", r["referencia"] or ""]
+
+
+@app.route("/reportes/ventas.xlsx")
+@login_required
+def reporte_ventas_xlsx():
+    where, params = _ventas_sql()
+    return send_xlsx("Ventas", f"""
+        SELECT fecha, dia, monto, motivo, metodo, referencia
+        FROM caja_movimientos
+        WHERE {where}
+        ORDER BY fecha DESC, id DESC
+    """, params, VENTAS_COLS, "reporte_ventas.xlsx", _venta_xlsx)
+
+
+@app.route("/reportes/inventario.xlsx")
+@login_required
+def reporte_inventario_xlsx():
+    return send_xlsx("Inventario", INVENTARIO_SQL, (), INVENTARIO_COLS, "reporte_inventario.xlsx")
+
+
+PDF_ESPERA = 10  # segundos que el request espera al worker antes de responder 202
+
+
+def send_pdf(reporte: str, start: str, end: str, filename: str):
+    """
+    Entrega un PDF de reportes_pdf: si ya está en cache (misma versión de datos) sale
+    al instante; si no, se encola en el pool y se espera un poco. Si tarda más,
+    responde 202 y la página se recarga sola hasta que esté listo.
+    """
+    spec = reportes_pdf.REPORTES[reporte](start, end)
+    (version,) = data_version(db_conn().cursor(), spec["tabla_version"])
+
+    ruta, fut = reportes_pdf.solicitar(reporte, start, end, version)
+    if ruta is None:
+        try:
+            ruta = fut.result(timeout=PDF_ESPERA)
+        except FutureTimeout:
+            resp = make_response("Generando el reporte PDF… esta página se actualizará sola.", 202)
+            resp.headers["Refresh"] = "3"
+            resp.headers["Retry-After"] = "3"
+            return resp
+
+    return send_file(ruta, mimetype="application/pdf", as_attachment=True, download_name=filename)
+
+
+@app.route("/reportes/inventario.pdf")
+@login_required
+def reporte_inventario_pdf():
+    return send_pdf("inventario", "", "", "reporte_inventario.pdf")
+
+
+@app.route("/reportes/caja/cierres.pdf")
+@login_required
+def reporte_cierres_pdf():
+    today = date.today()
+    end = parse_date_yyyy_mm_dd(request.args.get("end", "").strip(), today.isoformat())
+    start = parse_date_yyyy_mm_dd(request.args.get("start", "").strip(), (today - timedelta(days=30)).isoformat())
+    return send_pdf("cierres", start, end, f"cierres_caja_{start}_{end}.pdf")
+
+
+# Rango por defecto de /reportes/caja/tendencias según el período
+TENDENCIAS_RANGO = {"dia": 90, "semana": 365, "mes": 3 * 365}
+
+
+def inicio_periodo(d: date, periodo: str) -> date:
+    """Día en que empieza el período de `d` (igual que db.CAJA_PERIODO_INICIO)."""
+    if periodo == "semana":
+        return d - timedelta(days=d.weekday())
+    if periodo == "mes":
+        return d.replace(day=1)
+    return d
+
+
+@app.route("/reportes/caja/tendencias")
+@login_required
+@cache_vista("caja_movimientos")
+def reporte_caja_tendencias():
+    # Solo lee caja_resumen (triggers en db.py): 3 años por mes son ~150 filas
+    periodo = request.args.get("periodo", "mes")
+    if periodo not in TENDENCIAS_RANGO:
+        periodo = "mes"
+    metodo = request.args.get("metodo", "todos")
+
+    today = date.today()
+    end = parse_date_yyyy_mm_dd(request.args.get("end", "").strip(), today.isoformat())
+    start = parse_date_yyyy_mm_dd(request.args.get("start", "").strip(),
+                                  (today - timedelta(days=TENDENCIAS_RANGO[periodo])).isoformat())
+    desde = inicio_periodo(datetime.strptime(start, "%Y-%m-%d").date(), periodo).isoformat()
+
+    where = "periodo=? AND inicio >= ? AND inicio <= ?"
+    params = [periodo, desde, end]
+    if metodo in ("efectivo", "banco"):
+        where += " AND metodo=?"
+        params.append(metodo)
+
     conn = db_conn()
     cur = conn.cursor()
-    cur.execute("""
-        SELECT tipo, sku, nombre, categoria, unidad, precio, stock_actual, stock_min, activo
-        FROM productos
-        ORDER BY tipo, COALESCE(categoria,''), nombre
-    """)
-    rows = cur.fetchall()
+    cur.execute(f"""
+        SELECT inicio,
+               COALESCE(SUM(CASE WHEN tipo_mov='ingreso' THEN total END),0) AS ingresos,
+               COALESCE(SUM(CASE WHEN tipo_mov='egreso' THEN total END),0) AS egresos,
+               SUM(movimientos) AS movimientos
+        FROM caja_resumen
+        WHERE {where}
+        GROUP BY inicio
+        HAVING SUM(movimientos) > 0
+        ORDER BY inicio
+    """, tuple(params))
+    series = [dict(r) for r in cur.fetchall()]
     conn.close()
 
-    lines = ["tipo,sku,nombre,categoria,unidad,precio,stock_actual,stock_min,activo"]
-    for r in rows:
-        tipo = (r["tipo"] or "").replace(",", " ")
-        sku = (r["sku"] or "").replace(",", " ")
-        nombre = (r["nombre"] or "").replace(",", " ")
-        categoria = (r["categoria"] or "").replace(",", " ")
-        unidad = (r["unidad"] or "").replace(",", " ")
-        precio = str(r["precio"] if r["precio"] is not None else 0)
-        stock_actual = str(r["stock_actual"] if r["stock_actual"] is not None else 0)
-        stock_min = str(r["stock_min"] if r["stock_min"] is not None else 0)
-        activo = str(r["activo"] if r["activo"] is not None else 0)
-        lines.append(f"{tipo},{sku},{nombre},{categoria},{unidad},{precio},{stock_actual},{stock_min},{activo}")
-
-    csv_data = "\n".join(lines)
-    resp = make_response(csv_data)
-    resp.headers["Content-Type"] = "text/csv; charset=utf-8"
-    resp.headers["Content-Disposition"] = "attachment; filename=reporte_inventario.csv"
-    return resp
+    maximo = max([max(s["ingresos"], s["egresos"]) for s in series] or [0]) or 1
+    for s in series:
+        s["neto"] = s["ingresos"] - s["egresos"]
+        s["pct_ing"] = round(100 * s["ingresos"] / maximo, 1)
+        s["pct_egr"] = round(100 * s["egresos"] / maximo, 1)
+
+    return render_template(
+        "reporte_caja_tendencias.html",
+        series=series,
+        periodo=periodo,
+        metodo=metodo,
+        start=start,
+        end=end,
+        total_ing=sum(s["ingresos"] for s in series),
+        total_egr=sum(s["egresos"] for s in series),
+        title="MIKEN - Tendencias de caja",
+    )
 
 
 # --------------------
@@ -338,42 +879,15 @@ def catalogo_home():
 
 def _listar_catalogo(tipo: str):
     q = request.args.get("q", "").strip()
-    page = request.args.get("page", "1").strip()
-
-    try:
-        page = int(page)
-        if page < 1:
-            page = 1
-    except ValueError:
-        page = 1
+    page = page_number(parse_cursor(request.args.get("after", "")), parse_cursor(request.args.get("before", "")))
 
     per_page = 6
-    offset = (page - 1) * per_page
 
-    conn = db_conn()
-    cur = conn.cursor()
-
-    where = "WHERE tipo = ?"
-    params = [tipo]
-
-    if q:
-        where += " AND (sku LIKE ? OR nombre LIKE ? OR categoria LIKE ?)"
-        params += [f"%{q}%", f"%{q}%", f"%{q}%"]
-
-    # total para paginación
-    cur.execute(f"SELECT COUNT(*) AS c FROM productos {where}", tuple(params))
-    total = cur.fetchone()["c"]
-
-    # filas
-    cur.execute(f"""
-        SELECT id, sku, nombre, categoria, stock_actual, stock_min, imagen_filename, activo
-        FROM productos
-        {where}
-        ORDER BY id DESC
-        LIMIT ? OFFSET ?
-    """, tuple(params + [per_page, offset]))
-    productos = cur.fetchall()
-    conn.close()
+    # orden id DESC (o relevancia si hay búsqueda); el cursor es el propio id
+    productos, total, prev_cursor, next_cursor = paginar_productos(
+        ["id", "sku", "nombre", "categoria", "stock_actual", "stock_min", "imagen_filename", "activo"],
+        "tipo = ?", [tipo], ["id"], True, q, per_page
+    )
 
     total_pages = (total + per_page - 1) // per_page
 
@@ -387,61 +901,41 @@ def _listar_catalogo(tipo: str):
         titulo=titulo,
         page=page,
         total_pages=total_pages,
-        total=total
+        total=total,
+        prev_cursor=prev_cursor,
+        next_cursor=next_cursor
     )
 
 
 
 @app.route("/catalogo/maquinas")
 @login_required
+@cache_vista("productos")
 def catalogo_maquinas():
     return _listar_catalogo("maquina")
 
 
 @app.route("/catalogo/insumos")
 @login_required
+@cache_vista("productos")
 def catalogo_insumos():
     return _listar_catalogo("insumo")
 
 
 @app.route("/inventario/stock-bajo")
 @login_required
+@cache_vista("productos")
 def stock_bajo():
     q = request.args.get("q", "").strip()
-    page = request.args.get("page", "1").strip()
-
-    try:
-        page = int(page)
-        if page < 1:
-            page = 1
-    except ValueError:
-        page = 1
+    page = page_number(parse_cursor(request.args.get("after", "")), parse_cursor(request.args.get("before", "")))
 
     per_page = 6
-    offset = (page - 1) * per_page
-
-    conn = db_conn()
-    cur = conn.cursor()
-
-    where = "WHERE activo=1 AND stock_actual <= stock_min"
-    params = []
 
-    if q:
-        where += " AND (sku LIKE ? OR nombre LIKE ? OR categoria LIKE ?)"
-        params += [f"%{q}%", f"%{q}%", f"%{q}%"]
-
-    cur.execute(f"SELECT COUNT(*) AS c FROM productos {where}", tuple(params))
-    total = cur.fetchone()["c"]
-
-    cur.execute(f"""
-        SELECT id, tipo, sku, nombre, categoria, stock_actual, stock_min, imagen_filename, activo
-        FROM productos
-        {where}
-        ORDER BY tipo, nombre
-        LIMIT ? OFFSET ?
-    """, tuple(params + [per_page, offset]))
-    productos = cur.fetchall()
-    conn.close()
+    # orden tipo, nombre (+ id para desempatar), o relevancia si hay búsqueda
+    productos, total, prev_cursor, next_cursor = paginar_productos(
+        ["id", "tipo", "sku", "nombre", "categoria", "stock_actual", "stock_min", "imagen_filename", "activo"],
+        "activo=1 AND stock_actual <= stock_min", [], ["tipo", "nombre", "id"], False, q, per_page
+    )
 
     total_pages = (total + per_page - 1) // per_page
 
@@ -453,10 +947,58 @@ def stock_bajo():
         titulo="⚠ Productos con Stock Bajo",
         page=page,
         total_pages=total_pages,
-        total=total
+        total=total,
+        prev_cursor=prev_cursor,
+        next_cursor=next_cursor
     )
 
 
+STOCK_EVENTOS_LOTE = 200  # eventos por respuesta como máximo
+
+
+@app.route("/inventario/stock-bajo/eventos")
+@login_required
+def stock_bajo_eventos():
+    """
+    Productos que entraron o salieron de stock bajo después de ?after= (filas de
+    stock_eventos, escritas por triggers) y los contadores actualizados, en JSON.
+
+    El dashboard consulta cada tanto con If-None-Match: el ETag es la versión de
+    productos en data_versions, así que mientras nada cambie la respuesta es un 304
+    de una sola lectura y el hilo queda libre enseguida (nada de conexiones abiertas
+    esperando eventos).
+    """
+    cur = db_conn().cursor()
+    (version,) = data_version(cur, "productos")
+    etag = f'"p{version}"'
+    if etag in request.headers.get("If-None-Match", ""):
+        return Response(status=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+    ultimo = parse_cursor(request.args.get("after", ""))
+    eventos = []
+    if ultimo is None:
+        # primera consulta: solo el punto de partida
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM stock_eventos")
+        ultimo = cur.fetchone()[0]
+    else:
+        cur.execute("""
+            SELECT e.id, e.producto_id, e.tipo, e.bajo, e.stock_actual, e.stock_min, e.fecha, p.nombre
+            FROM stock_eventos e
+            LEFT JOIN productos p ON p.id = e.producto_id
+            WHERE e.id > ?
+            ORDER BY e.id
+            LIMIT ?
+        """, (ultimo, STOCK_EVENTOS_LOTE))
+        eventos = [dict(e) for e in cur.fetchall()]
+        if eventos:
+            ultimo = eventos[-1]["id"]
+
+    resp = jsonify(ultimo=ultimo, eventos=eventos, **DashboardStats(cur).stock_bajo())
+    resp.headers["ETag"] = etag
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
 # --------------------
 # CREAR PRODUCTO
 # --------------------
@@ -492,22 +1034,36 @@ def catalogo_nuevo(tipo):
         imagen = request.files.get("imagen")
         imagen_filename = None
 
+        conn = db_conn()
+        cur = conn.cursor()
+        # SKU repetido: se avisa antes de guardar la imagen (si no, quedaría huérfana)
+        if sku_ocupado(cur, sku):
+            conn.close()
+            flash(f"Ya existe un producto con el SKU {sku}.")
+            return redirect(url_for("catalogo_nuevo", tipo=tipo))
+
         if imagen and imagen.filename:
             if not allowed_file(imagen.filename):
+                conn.close()
                 flash("Formato de imagen no permitido (png/jpg/jpeg/webp).")
                 return redirect(url_for("catalogo_nuevo", tipo=tipo))
 
+            # almacén por contenido: la misma foto se guarda una sola vez
             safe = secure_filename(imagen.filename)
-            imagen_filename = f"{tipo}_{nombre[:20].replace(' ','_')}_{safe}"
-            imagen.save(os.path.join(UPLOAD_FOLDER, imagen_filename))
+            imagen_filename, nuevo = imagenes.guardar_subida(imagen.stream, safe, UPLOAD_FOLDER)
+            if nuevo:
+                imagenes.encolar(UPLOAD_FOLDER, imagen_filename)
 
-        conn = db_conn()
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO productos
-            (tipo, sku, nombre, categoria, unidad, precio, stock_actual, stock_min, imagen_filename, activo)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
-        """, (tipo, sku, nombre, categoria, unidad, precio, stock_actual, stock_min, imagen_filename))
+        try:
+            cur.execute("""
+                INSERT INTO productos
+                (tipo, sku, nombre, categoria, unidad, precio, stock_actual, stock_min, imagen_filename, activo)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+            """, (tipo, sku, nombre, categoria, unidad, precio, stock_actual, stock_min, imagen_filename))
+        except sqlite3.IntegrityError:
+            conn.close()
+            flash(f"Ya existe un producto con el SKU {sku}.")
+            return redirect(url_for("catalogo_nuevo", tipo=tipo))
         conn.commit()
         conn.close()
 
@@ -519,6 +1075,14 @@ def catalogo_nuevo(tipo):
 
 
 
+def sku_ocupado(cur, sku: str, excluir_id: int = None) -> bool:
+    """Otro producto ya tiene este SKU (vacío no cuenta: no está en idx_productos_sku)."""
+    if not sku:
+        return False
+    cur.execute("SELECT 1 FROM productos WHERE sku = ? AND id IS NOT ?", (sku, excluir_id))
+    return cur.fetchone() is not None
+
+
 # --------------------
 # EDITAR PRODUCTO
 # --------------------
@@ -560,6 +1124,7 @@ def catalogo_editar(tipo, pid):
             precio = float(precio_raw) if precio_raw else 0.0
             stock_actual = int(stock_actual_raw) if stock_actual_raw else 0
             stock_min = int(stock_min_raw) if stock_min_raw else 0
+            stock_original = int(request.form.get("stock_original", "").strip() or producto["stock_actual"])
         except ValueError:
             conn.close()
             flash("Precio o stock inválido. Use números.")
@@ -568,31 +1133,53 @@ def catalogo_editar(tipo, pid):
         imagen = request.files.get("imagen")
         imagen_filename = producto["imagen_filename"]
 
+        if sku_ocupado(cur, sku, pid):
+            conn.close()
+            flash(f"Ya existe otro producto con el SKU {sku}.")
+            return redirect(url_for("catalogo_editar", tipo=tipo, pid=pid))
+
         if imagen and imagen.filename:
             if not allowed_file(imagen.filename):
                 conn.close()
                 flash("Formato de imagen no permitido (png/jpg/jpeg/webp).")
                 return redirect(url_for("catalogo_editar", tipo=tipo, pid=pid))
 
+            # almacén por contenido: la misma foto se guarda una sola vez
             safe = secure_filename(imagen.filename)
-            imagen_filename = f"{tipo}_{nombre[:20].replace(' ','_')}_{safe}"
-            imagen.save(os.path.join(UPLOAD_FOLDER, imagen_filename))
+            imagen_filename, nuevo = imagenes.guardar_subida(imagen.stream, safe, UPLOAD_FOLDER)
+            if nuevo:
+                imagenes.encolar(UPLOAD_FOLDER, imagen_filename)
 
-        cur.execute("""
-            UPDATE productos SET
-                sku=?,
-                nombre=?,
-                categoria=?,
-                unidad=?,
-                precio=?,
-                stock_actual=?,
-                stock_min=?,
-                imagen_filename=?,
-                activo=?
-            WHERE id=? AND tipo=?
-        """, (sku, nombre, categoria, unidad, precio, stock_actual, stock_min, imagen_filename, activo, pid, tipo))
+        try:
+            cur.execute("""
+                UPDATE productos SET
+                    sku=?,
+                    nombre=?,
+                    categoria=?,
+                    unidad=?,
+                    precio=?,
+                    stock_min=?,
+                    imagen_filename=?,
+                    activo=?
+                WHERE id=? AND tipo=?
+            """, (sku, nombre, categoria, unidad, precio, stock_min, imagen_filename, activo, pid, tipo))
+        except sqlite3.IntegrityError:
+            conn.close()
+            flash(f"Ya existe otro producto con el SKU {sku}.")
+            return redirect(url_for("catalogo_editar", tipo=tipo, pid=pid))
 
         conn.commit()
+
+        # El stock no se sobrescribe: la diferencia contra lo que vio el usuario
+        # se registra como ajuste, sin perder movimientos hechos mientras editaba.
+        ajuste = stock_actual - stock_original
+        if ajuste:
+            try:
+                inventario.registrar(conn, pid, "ingreso" if ajuste > 0 else "egreso", abs(ajuste), "Ajuste desde catálogo")
+            except inventario.StockError as e:
+                flash(f"Stock no ajustado: {e}")
+
+        # la imagen anterior, si quedó sin uso, la borra `python imagenes.py gc`
         conn.close()
 
         flash("Producto actualizado ✅")
@@ -629,55 +1216,234 @@ def catalogo_toggle(tipo, pid):
     return redirect(url_for("catalogo_maquinas" if tipo == "maquina" else "catalogo_insumos"))
 
 
+# --------------------
+# IMPORTAR PRODUCTOS (CSV / Excel, importar.py)
+# --------------------
+@app.route("/catalogo/importar", methods=["GET", "POST"])
+@login_required
+def catalogo_importar():
+    resultado = None
+    tipo = request.form.get("tipo", "insumo")
+
+    if request.method == "POST":
+        archivo = request.files.get("archivo")
+        if not archivo or not archivo.filename:
+            flash("Seleccione un archivo .csv o .xlsx.")
+            return redirect(url_for("catalogo_importar"))
+
+        try:
+            resultado = importar.importar(
+                db_conn(),
+                importar.leer(archivo.stream, archivo.filename),
+                tipo if tipo in ("maquina", "insumo") else "insumo",
+                {"maquina": CATEGORIAS_MAQUINAS, "insumo": CATEGORIAS_INSUMOS},
+                UNIDADES
+            )
+        except importar.ImportacionError as e:
+            flash(str(e))
+            return redirect(url_for("catalogo_importar"))
+
+        flash(f"Importación terminada ✅ {resultado['nuevos']} nuevo(s), {resultado['actualizados']} actualizado(s).")
+
+    return render_template("catalogo_importar.html", resultado=resultado, tipo=tipo)
+
+
+# --------------------
+# MOVIMIENTOS DE INVENTARIO (libro en inventario.py)
+# --------------------
+@app.route("/inventario/movimiento/nuevo", methods=["GET", "POST"])
+@login_required
+def inventario_movimiento_nuevo():
+    conn = db_conn()
+
+    if request.method == "POST":
+        try:
+            stock = inventario.registrar(
+                conn,
+                request.form.get("producto_id", "").strip(),
+                request.form.get("tipo_mov", "").strip(),
+                request.form.get("cantidad", "").strip(),
+                request.form.get("motivo", "")
+            )
+        except inventario.StockError as e:
+            flash(str(e))
+            return redirect(url_for("inventario_movimiento_nuevo"))
+
+        flash(f"Movimiento registrado ✅ (stock actual: {stock})")
+        return redirect(url_for("inventario_movimientos"))
+
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT id, tipo, nombre, stock_actual
+        FROM productos
+        WHERE activo=1
+        ORDER BY tipo, nombre
+    """)
+    productos = cur.fetchall()
+    conn.close()
+    return render_template("movimiento_form.html", productos=productos)
+
+
+@app.route("/inventario/movimientos")
+@login_required
+def inventario_movimientos():
+    today = date.today()
+    end = parse_date_yyyy_mm_dd(request.args.get("hasta", "").strip(), today.isoformat())
+    start = parse_date_yyyy_mm_dd(request.args.get("desde", "").strip(), (today - timedelta(days=30)).isoformat())
+    tipo_mov = request.args.get("tipo_mov", "").strip()
+    q = request.args.get("q", "").strip()
+
+    after_id = parse_cursor(request.args.get("after", "").strip())
+    before_id = parse_cursor(request.args.get("before", "").strip())
+    page = page_number(after_id, before_id)
+    per_page = 50
+
+    conn = db_conn()
+    cur = conn.cursor()
+
+    where, params = rango_fecha_sql(start, end)
+    if tipo_mov in inventario.TIPOS:
+        where += " AND tipo_mov=?"
+        params.append(tipo_mov)
+    if q:
+        where += " AND motivo LIKE ?"
+        params.append(f"%{q}%")
+
+    # nombre por subconsulta (no JOIN): así fecha/id no son ambiguos para keyset_page
+    orden = ["fecha", "id"]
+    movimientos, hay_anterior, hay_siguiente = keyset_page(
+        cur, """
+        SELECT m.*,
+               (SELECT p.nombre FROM productos p WHERE p.id = m.producto_id) AS producto
+        FROM movimientos m
+        """,
+        where, params, orden, True,
+        cursor_key(cur, "movimientos", orden, after_id),
+        cursor_key(cur, "movimientos", orden, before_id),
+        per_page
+    )
+    prev_cursor, next_cursor = page_cursors(movimientos, hay_anterior, hay_siguiente)
+    conn.close()
+
+    return render_template(
+        "movimientos_list.html",
+        movimientos=movimientos,
+        desde=start,
+        hasta=end,
+        page=page,
+        prev_cursor=prev_cursor,
+        next_cursor=next_cursor
+    )
+
+
+@app.route("/inventario/movimientos/lote", methods=["POST"])
+@login_required
+def inventario_movimientos_lote():
+    """
+    Carga masiva: JSON {"movimientos": [{"producto_id", "tipo_mov", "cantidad", "motivo"}, ...]}
+    Todo en una transacción; si una fila falla no se aplica ninguna.
+    """
+    data = request.get_json(silent=True)
+    movimientos = data.get("movimientos") if isinstance(data, dict) else data
+    if not isinstance(movimientos, list) or not movimientos:
+        return jsonify(ok=False, error="Envíe {\"movimientos\": [...]} en JSON."), 400
+
+    try:
+        aplicados = inventario.registrar_lote(db_conn(), movimientos)
+    except inventario.StockError as e:
+        return jsonify(ok=False, error=str(e), fila=e.fila), 400
+
+    return jsonify(ok=True, aplicados=aplicados)
+
+
 # ============================================================
 # MÓDULO CAJA (Sprint 3): FUNCIONAL
 # ============================================================
+# Días con fila en caja_estado ya confirmada (por proceso): para esos, ensure_caja_estado
+# solo lee. Las filas se crean por adelantado (db.crear_dias_caja / caja_dias.py).
+_dias_caja = set()
+DIAS_CAJA_MAX = 1000
+# UNIQUE(dia) en caja_estado: una base vieja con días repetidos no lo tiene (migrate
+# avisa y sigue) y ahí ON CONFLICT(dia) es un error; se revisa hasta encontrarlo
+_caja_estado_unico = False
+# RETURNING necesita SQLite 3.35+ (igual que el DROP COLUMN de db.unify_caja_metodo)
+SQLITE_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+def caja_estado(cur, dia: str):
+    """Fila de caja_estado del día, o None si todavía no existe. Nunca escribe (para GET)."""
+    cur.execute("SELECT * FROM caja_estado WHERE dia=?", (dia,))
+    row = cur.fetchone()
+    if row is not None and len(_dias_caja) < DIAS_CAJA_MAX:
+        _dias_caja.add(dia)
+    return row
+
+
 def ensure_caja_estado(cur, dia: str):
     """
-    Garantiza que exista un registro en caja_estado para el día dado.
+    Garantiza que exista un registro en caja_estado para el día dado (para POST).
     Además normaliza 'dia' para evitar inserts inválidos.
+    Día conocido: un SELECT. Si no: un solo INSERT ... ON CONFLICT(dia) DO NOTHING
+    RETURNING * (y el SELECT solo si otro lo creó antes). Sin UNIQUE(dia), el
+    INSERT ... WHERE NOT EXISTS de caja_escritor. Sin RETURNING (SQLite < 3.35),
+    el INSERT y después el SELECT.
     """
+    global _caja_estado_unico
     # normaliza dia a YYYY-MM-DD sí o sí
     dia = parse_date_yyyy_mm_dd(dia, today_str())
 
-    cur.execute("SELECT * FROM caja_estado WHERE dia=?", (dia,))
-    row = cur.fetchone()
-    if row:
-        return row
+    if dia in _dias_caja:
+        row = caja_estado(cur, dia)
+        if row is not None:
+            return row
+        _dias_caja.discard(dia)  # la borró un script: se vuelve a crear
 
-    # Inserta con valores válidos (abierta 0/1, efectivo_inicial numérico)
-    cur.execute("""
-        INSERT INTO caja_estado (dia, abierta, efectivo_inicial, created_at)
-        VALUES (?, 0, 0, ?)
-    """, (dia, now_str()))
+    if not _caja_estado_unico:
+        _caja_estado_unico = caja_estado_dia_unico(cur)
 
-    cur.execute("SELECT * FROM caja_estado WHERE dia=?", (dia,))
-    return cur.fetchone()
+    # Inserta con valores válidos (abierta 0/1, efectivo_inicial numérico)
+    if _caja_estado_unico:
+        sql = """
+            INSERT INTO caja_estado (dia, abierta, efectivo_inicial, created_at)
+            VALUES (?, 0, 0, ?)
+            ON CONFLICT(dia) DO NOTHING
+        """
+        params = (dia, now_str())
+    else:
+        sql = caja_escritor.ESTADO_SQL
+        params = (dia, now_str(), dia)
+
+    if not SQLITE_RETURNING:
+        cur.execute(sql, params)
+        return caja_estado(cur, dia)
+
+    cur.execute(sql + " RETURNING *", params)
+    filas = cur.fetchall()  # RETURNING: leer todo antes del commit
+    if filas:
+        if len(_dias_caja) < DIAS_CAJA_MAX:
+            _dias_caja.add(dia)
+        return filas[0]
+    return caja_estado(cur, dia)
 
 
 
 def caja_totales(cur, dia: str):
-    # Totales efectivo
-    cur.execute("""
-        SELECT
-          COALESCE(SUM(CASE WHEN tipo_mov='ingreso' THEN monto ELSE 0 END),0) AS ing,
-          COALESCE(SUM(CASE WHEN tipo_mov='egreso' THEN monto ELSE 0 END),0) AS egr
-        FROM caja_movimientos
-        WHERE dia=? AND medio='efectivo'
-    """, (dia,))
-    r1 = cur.fetchone()
-
-    # Totales banco
+    # Totales acumulados por (dia, metodo) en caja_saldos (los mantienen triggers en db.py)
     cur.execute("""
-        SELECT
-          COALESCE(SUM(CASE WHEN tipo_mov='ingreso' THEN monto ELSE 0 END),0) AS ing,
-          COALESCE(SUM(CASE WHEN tipo_mov='egreso' THEN monto ELSE 0 END),0) AS egr
-        FROM caja_movimientos
-        WHERE dia=? AND medio='banco'
+        SELECT metodo, ingresos, egresos
+        FROM caja_saldos
+        WHERE dia=?
     """, (dia,))
-    r2 = cur.fetchone()
-
-    return (r1["ing"], r1["egr"], r2["ing"], r2["egr"])
+    t = {r["metodo"]: r for r in cur.fetchall()}
+    efectivo = t.get("efectivo")
+    banco = t.get("banco")
+
+    return (
+        efectivo["ingresos"] if efectivo else 0,
+        efectivo["egresos"] if efectivo else 0,
+        banco["ingresos"] if banco else 0,
+        banco["egresos"] if banco else 0,
+    )
 
 
 @app.route("/caja")
@@ -688,7 +1454,8 @@ def caja_home():
     try:
         cur = conn.cursor()
 
-        estado = ensure_caja_estado(cur, dia)
+        # solo lectura: sin fila todavía se muestra como caja cerrada
+        estado = caja_estado(cur, dia)
 
         efectivo_ing, efectivo_egr, banco_ing, banco_egr = caja_totales(cur, dia)
 
@@ -700,16 +1467,15 @@ def caja_home():
         start_s = start.isoformat()
         end_s = end.isoformat()
 
-        cur.execute("""
+        rango_sql, rango_params = rango_fecha_sql(start_s, end_s)
+        cur.execute(f"""
             SELECT * FROM caja_movimientos
-            WHERE date(fecha) BETWEEN ? AND ?
-            ORDER BY datetime(fecha) DESC, id DESC
+            WHERE {rango_sql}
+            ORDER BY fecha DESC, id DESC
             LIMIT 50
-        """, (start_s, end_s))
+        """, tuple(rango_params))
         ultimos = cur.fetchall()
 
-        conn.commit()  # por si ensure_caja_estado insertó
-
         return render_template(
             "caja_home.html",
             dia=dia,
@@ -726,23 +1492,6 @@ def caja_home():
         )
     finally:
         conn.close()
-def table_has_column(table: str, column: str) -> bool:
-    conn = db_conn()
-    try:
-        cur = conn.cursor()
-        cur.execute(f"PRAGMA table_info({table})")
-        cols = [r[1] for r in cur.fetchall()]  # r[1] = name
-        return column in cols
-    finally:
-        conn.close()
-
-
-def caja_col_medio() -> str:
-    # Tu BD puede tener 'medio' o 'metodo'
-    if table_has_column("caja_movimientos", "medio"):
-        return "medio"
-    return "metodo"
-
 
 
 @app.route("/caja/abrir", methods=["GET", "POST"])
@@ -752,8 +1501,6 @@ def caja_abrir():
     conn = db_conn()
     cur = conn.cursor()
 
-    estado = ensure_caja_estado(cur, dia)
-
     if request.method == "POST":
         efectivo_inicial_raw = request.form.get("efectivo_inicial", "0").strip()
         nota = request.form.get("nota", "").strip()
@@ -765,6 +1512,7 @@ def caja_abrir():
             conn.close()
             return redirect(url_for("caja_abrir"))
 
+        ensure_caja_estado(cur, dia)
         cur.execute("""
             UPDATE caja_estado
             SET abierta=1, efectivo_inicial=?
@@ -782,6 +1530,7 @@ def caja_abrir():
         flash("Caja abierta ✅")
         return redirect(url_for("caja_home"))
 
+    estado = caja_estado(cur, dia)
     conn.close()
     return render_template("caja_mov_form.html", modo="abrir", dia=dia, estado=estado)
 
@@ -794,7 +1543,8 @@ def caja_mov_nuevo():
     if request.method == "POST":
         # --------- leer + normalizar inputs ---------
         tipo_mov = (request.form.get("tipo_mov", "ingreso") or "ingreso").strip().lower()
-        metodo = (request.form.get("metodo", "efectivo") or "efectivo").strip().lower()
+        # el formulario viejo enviaba "medio"
+        metodo = (request.form.get("metodo") or request.form.get("medio") or "efectivo").strip().lower()
 
         monto_raw = (request.form.get("monto", "0") or "0").strip()
         motivo = (request.form.get("motivo", "") or "").strip()
@@ -807,9 +1557,8 @@ def caja_mov_nuevo():
         if not fecha_full:
             fecha_full = now_str()
         else:
-            # si solo viene YYYY-MM-DD -> agrega hora
-            if len(fecha_full) == 10:
-                fecha_full = fecha_full + " 00:00:00"
+            # siempre ISO 'YYYY-MM-DD HH:MM:SS' (si solo viene YYYY-MM-DD -> 00:00:00)
+            fecha_full = normalize_fecha(fecha_full, now_str())
 
         enviado_matriz = 1 if request.form.get("enviado_matriz") == "1" else 0
 
@@ -835,45 +1584,32 @@ def caja_mov_nuevo():
             return redirect(url_for("caja_mov_nuevo"))
 
         # --------- DB con manejo seguro ---------
-        conn = db_conn()
+        # El hilo escritor (caja_escritor.py) lo inserta junto con los de otros cajeros
+        # en una sola transacción, crea el estado del día si falta, y responde al confirmar
         try:
-            cur = conn.cursor()
-
-            # asegura estado del día (y evita dia vacío)
-            ensure_caja_estado(cur, fecha_dia)
-
-            cur.execute("""
-                INSERT INTO caja_movimientos
-                (fecha, dia, monto, motivo, referencia, tipo_mov, medio, enviado_matriz)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (fecha_full, fecha_dia, monto, motivo, referencia, tipo_mov, metodo, enviado_matriz))
-
-
- 
-
-            conn.commit()
+            caja_escritor.registrar({
+                "fecha": fecha_full, "dia": fecha_dia, "monto": monto, "motivo": motivo,
+                "referencia": referencia, "tipo_mov": tipo_mov, "metodo": metodo,
+                "enviado_matriz": enviado_matriz,
+            })
             flash("Movimiento registrado ✅")
             return redirect(url_for("caja_home"))
 
         except sqlite3.IntegrityError as e:
-            conn.rollback()
             # Esto captura el CHECK/UNIQUE/FK y te muestra mensaje útil
             flash(f"Error de integridad al guardar el movimiento: {e}")
             return redirect(url_for("caja_mov_nuevo"))
 
         except sqlite3.OperationalError as e:
-            conn.rollback()
+            if es_bloqueo(e):
+                metricas.sumar("miken_db_bloqueos_total")
             flash(f"Error operativo de base de datos: {e}")
             return redirect(url_for("caja_mov_nuevo"))
 
         except Exception as e:
-            conn.rollback()
             flash(f"Error inesperado: {e}")
             return redirect(url_for("caja_mov_nuevo"))
 
-        finally:
-            conn.close()
-
     # GET
     return render_template("caja_mov_form.html", modo="mov", dia=dia_default, estado=None)
 
@@ -895,30 +1631,38 @@ def caja_movimientos_list():
         start = (today - timedelta(days=5)).isoformat()
     start = parse_date_yyyy_mm_dd(start, (today - timedelta(days=5)).isoformat())
 
+    after_id = parse_cursor(request.args.get("after", "").strip())
+    before_id = parse_cursor(request.args.get("before", "").strip())
+    page = page_number(after_id, before_id)
+    per_page = 50
+
     conn = db_conn()
     cur = conn.cursor()
 
-    params = [start, end]
+    rango_sql, params = rango_fecha_sql(start, end)
     where_extra = ""
 
     if metodo in ("efectivo", "banco"):
         where_extra = " AND metodo=? "
         params.append(metodo)
 
-    cur.execute(f"""
-        SELECT * FROM caja_movimientos
-        WHERE date(fecha) BETWEEN ? AND ?
-        {where_extra}
-        ORDER BY datetime(fecha) DESC, id DESC
-    """, tuple(params))
-    rows = cur.fetchall()
+    # orden (fecha, id) DESC; el cursor es el id y su fecha sale por PK
+    orden = ["fecha", "id"]
+    rows, hay_anterior, hay_siguiente = keyset_page(
+        cur, "SELECT * FROM caja_movimientos",
+        rango_sql + where_extra, params, orden, True,
+        cursor_key(cur, "caja_movimientos", orden, after_id),
+        cursor_key(cur, "caja_movimientos", orden, before_id),
+        per_page
+    )
+    prev_cursor, next_cursor = page_cursors(rows, hay_anterior, hay_siguiente)
 
     cur.execute(f"""
         SELECT
           COALESCE(SUM(CASE WHEN tipo_mov='ingreso' THEN monto ELSE 0 END),0) AS ing,
           COALESCE(SUM(CASE WHEN tipo_mov='egreso' THEN monto ELSE 0 END),0) AS egr
         FROM caja_movimientos
-        WHERE date(fecha) BETWEEN ? AND ?
+        WHERE {rango_sql}
         {where_extra}
     """, tuple(params))
     t = cur.fetchone()
@@ -932,7 +1676,10 @@ def caja_movimientos_list():
         end=end,
         metodo=metodo,
         total_ing=float(t["ing"]),
-        total_egr=float(t["egr"])
+        total_egr=float(t["egr"]),
+        page=page,
+        prev_cursor=prev_cursor,
+        next_cursor=next_cursor
     )
 
 
@@ -957,9 +1704,10 @@ def caja_cerrar():
     conn = db_conn()
     cur = conn.cursor()
 
-    estado = ensure_caja_estado(cur, dia)
+    # sin fila del día la caja nunca se abrió: no hace falta crearla
+    estado = caja_estado(cur, dia)
 
-    if estado and int(estado["abierta"]) != 1:
+    if estado is None or int(estado["abierta"]) != 1:
         conn.close()
         flash("La caja no está abierta hoy.")
         return redirect(url_for("caja_home"))
@@ -1026,5 +1774,6 @@ def forgot_password():
 # MAIN
 # --------------------
 if __name__ == "__main__":
+    # Solo para desarrollo. En producción: python servidor.py (ver wsgi.py)
     app.run(debug=True, use_reloader=False)
 
@@ -0,0 +1,112 @@
+"""
+Movimientos de caja con muchos cajeros a la vez: cada hilo registra movimientos
+como lo hacía /caja/movimiento/nuevo (una transacción por movimiento) y con el
+escritor agrupado (caja_escritor.registrar: un commit por lote).
+
+    python -m benchmarks.bench_caja 1 8 32
+
+Al final comprueba que se guardaron todos los movimientos confirmados y que
+caja_saldos cuadra con caja_movimientos.
+"""
+import random
+import sqlite3
+import sys
+import threading
+import time
+from datetime import date, datetime
+
+import caja_escritor
+import db
+from benchmarks import datos
+
+MOVIMIENTOS_POR_HILO = 200
+
+
+def _movimiento(rnd):
+    tipo_mov = "ingreso" if rnd.random() < 0.8 else "egreso"
+    metodo = "efectivo" if rnd.random() < 0.7 else "banco"
+    return {
+        "fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "dia": date.today().isoformat(),
+        "monto": round(rnd.uniform(1, 80), 2),
+        "motivo": "bench",
+        "referencia": "R" if metodo == "banco" else "",
+        "tipo_mov": tipo_mov,
+        "metodo": metodo,
+        "enviado_matriz": 0,
+    }
+
+
+def registrar_directo(mov):
+    """El camino anterior: estado del día + INSERT + commit en la conexión del hilo."""
+    conn = db.pooled_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM caja_estado WHERE dia=?", (mov["dia"],))
+        if cur.fetchone() is None:
+            cur.execute("INSERT INTO caja_estado (dia, abierta, efectivo_inicial, created_at) VALUES (?, 0, 0, ?)",
+                        (mov["dia"], mov["fecha"]))
+            cur.execute("SELECT * FROM caja_estado WHERE dia=?", (mov["dia"],))
+        cur.execute(caja_escritor.INSERT_SQL, tuple(mov[c] for c in caja_escritor.COLUMNAS))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _trabajador(semilla, registrar, resultado):
+    rnd = random.Random(semilla)
+    ok = errores = 0
+    try:
+        for _ in range(MOVIMIENTOS_POR_HILO):
+            try:
+                registrar(_movimiento(rnd))
+                ok += 1
+            except sqlite3.Error:
+                # directo: 'database is locked' o UNIQUE(caja_estado.dia) si dos
+                # cajeros crean el estado del día a la vez
+                errores += 1
+    finally:
+        db.close_pool()
+    resultado.append((ok, errores))
+
+
+def correr(hilos, registrar):
+    resultado = []
+    ts = [threading.Thread(target=_trabajador, args=(i, registrar, resultado)) for i in range(hilos)]
+    t0 = time.perf_counter()
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    segundos = time.perf_counter() - t0
+    return sum(r[0] for r in resultado), sum(r[1] for r in resultado), segundos
+
+
+def verificar(conn, esperados):
+    """Mensajes de error (vacío si todo cuadra)."""
+    problemas = []
+    guardados = conn.execute("SELECT COUNT(*) FROM caja_movimientos").fetchone()[0]
+    if guardados != esperados:
+        problemas.append(f"{guardados} guardados, {esperados} confirmados")
+    if db.verify_caja_saldos(conn.cursor()):
+        problemas.append("caja_saldos no cuadra")
+    return problemas
+
+
+def main(hilos_lista):
+    print(f"{'hilos':>5} {'modo':>9} | {'confirmados':>11} {'errores':>7} | {'mov/s':>9}")
+    for hilos in hilos_lista:
+        for nombre, registrar in (("directo", registrar_directo), ("agrupado", caja_escritor.registrar)):
+            datos.nueva_db(f"caja_{hilos}.db")
+            ok, errores, segundos = correr(hilos, registrar)
+            caja_escritor.detener()
+
+            conn = db.pooled_conn()
+            problemas = verificar(conn, ok)
+            print(f"{hilos:>5} {nombre:>9} | {ok:>11} {errores:>7} | {ok / segundos:>9.0f}"
+                  f"{'' if not problemas else '  ❌ ' + '; '.join(problemas)}")
+            db.close_pool()
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [1, 8, 32])
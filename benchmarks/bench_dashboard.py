@@ -0,0 +1,72 @@
+"""
+Benchmark del dashboard: consultas antiguas (7 por vista) vs DashboardStats (2).
+
+    python -m benchmarks.bench_dashboard 1000 100000 1000000
+"""
+import sys
+import time
+
+import db
+from app import DashboardStats
+from benchmarks import datos
+
+# Las 7 consultas que hacía dashboard() antes de DashboardStats
+CONSULTAS_ANTIGUAS = [
+    ("SELECT COUNT(*) AS c FROM productos WHERE activo=1", ()),
+    ("SELECT COUNT(*) AS c FROM productos WHERE activo=1 AND tipo='insumo' AND stock_actual <= stock_min", ()),
+    ("SELECT COUNT(*) AS c FROM productos WHERE activo=1 AND tipo='maquina' AND stock_actual <= stock_min", ()),
+    ("SELECT * FROM caja_estado WHERE dia=?", ("DIA",)),
+    ("""SELECT COALESCE(SUM(CASE WHEN tipo_mov='ingreso' THEN monto ELSE 0 END),0) AS ing,
+              COALESCE(SUM(CASE WHEN tipo_mov='egreso' THEN monto ELSE 0 END),0) AS egr
+       FROM caja_movimientos WHERE dia=? AND metodo='efectivo'""", ("DIA",)),
+    ("SELECT COUNT(*) AS c FROM productos WHERE activo=1 AND tipo='maquina'", ()),
+    ("""SELECT COUNT(*) AS c FROM productos WHERE activo=1 AND tipo='maquina'
+       AND LOWER(COALESCE(categoria,'')) LIKE '%revision%'""", ()),
+]
+
+
+def medir(fn, repeticiones=5):
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        fn()
+        tiempos.append(time.perf_counter() - t0)
+    return min(tiempos) * 1000
+
+
+def contar_consultas(conn, fn):
+    n = [0]
+    conn.set_trace_callback(lambda sql: n.__setitem__(0, n[0] + 1))
+    try:
+        fn()
+    finally:
+        conn.set_trace_callback(None)
+    return n[0]
+
+
+def main(tamanos):
+    dia = datos.date.today().isoformat()
+    print(f"{'productos':>10} | {'antiguo ms':>10} {'consultas':>9} | {'nuevo ms':>9} {'consultas':>9}")
+    for n in tamanos:
+        datos.nueva_db(f"dashboard_{n}.db")
+        conn = db.pooled_conn()
+        datos.generar_productos(conn, n)
+        datos.generar_caja(conn, 10_000, dias=30)
+        cur = conn.cursor()
+
+        def antiguo():
+            for sql, params in CONSULTAS_ANTIGUAS:
+                cur.execute(sql, tuple(dia if p == "DIA" else p for p in params)).fetchall()
+
+        def nuevo():
+            stats = DashboardStats(cur)
+            stats.productos()
+            stats.caja(dia)
+
+        print(f"{n:>10} | {medir(antiguo):>10.2f} {contar_consultas(conn, antiguo):>9} | "
+              f"{medir(nuevo):>9.2f} {contar_consultas(conn, nuevo):>9}")
+        db.close_pool()
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [1_000, 100_000, 1_000_000])
@@ -0,0 +1,82 @@
+"""
+Exportaciones en streaming: RSS del proceso mientras se descargan los reportes de ventas
+(CSV, CSV gzip y Excel write-only).
+
+    python -m benchmarks.bench_export 2000000
+
+La memoria debe quedar acotada aunque crezca el número de filas.
+"""
+import os
+import sys
+import threading
+import time
+
+import db
+from app import app
+from benchmarks import datos
+
+
+def rss_mb() -> float:
+    # RSS actual (Linux). En otros sistemas se usa el pico de getrusage.
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class MuestreoRSS:
+    """Toma el RSS cada pocos ms en otro hilo (el Excel se arma antes del primer byte)."""
+
+    def __init__(self, intervalo=0.05):
+        self.intervalo = intervalo
+        self.maximo = 0.0
+        self._parar = threading.Event()
+
+    def __enter__(self):
+        self._hilo = threading.Thread(target=self._correr, daemon=True)
+        self._hilo.start()
+        return self
+
+    def _correr(self):
+        while not self._parar.is_set():
+            self.maximo = max(self.maximo, rss_mb())
+            time.sleep(self.intervalo)
+
+    def __exit__(self, *exc):
+        self._parar.set()
+        self._hilo.join()
+
+
+def main(n: int):
+    datos.nueva_db("export.db")
+    conn = db.pooled_conn()
+    print(f"Generando {n:,} movimientos de caja...")
+    datos.generar_caja(conn, n)
+    db.close_pool()
+
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s["username"] = "admin"
+
+    casos = [
+        ("csv", "/reportes/ventas.csv", {}),
+        ("csv+gzip", "/reportes/ventas.csv", {"Accept-Encoding": "gzip"}),
+        ("xlsx", "/reportes/ventas.xlsx", {}),
+    ]
+    for nombre, url, headers in casos:
+        base = rss_mb()
+        t0 = time.perf_counter()
+        with MuestreoRSS() as m:
+            resp = client.get(url, headers=headers, buffered=False)
+            total = sum(len(chunk) for chunk in resp.response)
+            resp.close()
+        dt = time.perf_counter() - t0
+
+        print(f"{nombre:9} bytes={total:>12,} tiempo={dt:6.2f}s "
+              f"RSS base={base:6.1f}MB max={m.maximo:6.1f}MB (+{m.maximo - base:.1f}MB)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000)
@@ -0,0 +1,104 @@
+"""
+Libro de inventario bajo carga: N hilos registrando movimientos a la vez sobre pocos
+productos (máxima contención), uno por transacción y en lotes.
+
+    python -m benchmarks.bench_stock 1 4 8 16
+
+Al final comprueba que stock_actual = stock inicial + ingresos - egresos para cada
+producto (ningún movimiento perdido) y que ninguno quedó negativo.
+"""
+import random
+import sys
+import threading
+import time
+
+import db
+import inventario
+from benchmarks import datos
+
+PRODUCTOS = 20
+MOVIMIENTOS_POR_HILO = 500
+LOTE = 100
+
+
+def _movimiento(rnd):
+    return {
+        "producto_id": rnd.randint(1, PRODUCTOS),
+        "tipo_mov": "ingreso" if rnd.random() < 0.5 else "egreso",
+        "cantidad": rnd.randint(1, 5),
+        "motivo": "bench",
+    }
+
+
+def _trabajador(semilla, por_lote, resultado):
+    rnd = random.Random(semilla)
+    conn = db.pooled_conn()
+    ok = rechazados = 0
+    try:
+        if por_lote:
+            for _ in range(MOVIMIENTOS_POR_HILO // LOTE):
+                try:
+                    ok += inventario.registrar_lote(conn, [_movimiento(rnd) for _ in range(LOTE)])
+                except inventario.StockError:
+                    rechazados += LOTE
+        else:
+            for _ in range(MOVIMIENTOS_POR_HILO):
+                m = _movimiento(rnd)
+                try:
+                    inventario.registrar(conn, m["producto_id"], m["tipo_mov"], m["cantidad"], m["motivo"])
+                    ok += 1
+                except inventario.StockError:
+                    rechazados += 1
+    finally:
+        db.close_pool()
+    resultado.append((ok, rechazados))
+
+
+def verificar(conn):
+    """Productos cuyo stock no cuadra con inicial + movimientos (debe ser vacío)."""
+    return conn.execute("""
+        SELECT p.id, p.stock_actual, i.stock AS inicial,
+               COALESCE(SUM(CASE WHEN m.tipo_mov='ingreso' THEN m.cantidad ELSE -m.cantidad END), 0) AS neto
+        FROM productos p
+        JOIN bench_stock_inicial i ON i.id = p.id
+        LEFT JOIN movimientos m ON m.producto_id = p.id
+        GROUP BY p.id
+        HAVING p.stock_actual <> i.stock + neto OR p.stock_actual < 0
+    """).fetchall()
+
+
+def correr(hilos, por_lote):
+    resultado = []
+    ts = [threading.Thread(target=_trabajador, args=(i, por_lote, resultado)) for i in range(hilos)]
+    t0 = time.perf_counter()
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    segundos = time.perf_counter() - t0
+    ok = sum(r[0] for r in resultado)
+    rechazados = sum(r[1] for r in resultado)
+    return ok, rechazados, segundos
+
+
+def main(hilos_lista):
+    print(f"{'hilos':>5} {'modo':>6} | {'aplicados':>9} {'rechazados':>10} | {'mov/s':>9}")
+    for hilos in hilos_lista:
+        for por_lote in (False, True):
+            datos.nueva_db(f"stock_{hilos}.db")
+            conn = db.pooled_conn()
+            datos.generar_productos(conn, PRODUCTOS)
+            # stock holgado: los lotes son todo o nada y casi no deben rechazarse
+            conn.execute("UPDATE productos SET stock_actual = stock_actual + 1000")
+            conn.execute("CREATE TABLE bench_stock_inicial AS SELECT id, stock_actual AS stock FROM productos")
+            conn.commit()
+
+            ok, rechazados, segundos = correr(hilos, por_lote)
+            malos = verificar(conn)
+            print(f"{hilos:>5} {'lote' if por_lote else 'uno':>6} | {ok:>9} {rechazados:>10} | "
+                  f"{ok / segundos:>9.0f}{'' if not malos else f'  ❌ {len(malos)} producto(s) no cuadran'}")
+            db.close_pool()
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [1, 4, 8, 16])
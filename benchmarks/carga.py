@@ -0,0 +1,151 @@
+"""
+Prueba de carga del servidor de producción: requests/segundo en /catalogo/insumos y
+/dashboard con 1, 2, ... N workers (por defecto hasta el número de núcleos).
+
+    python -m benchmarks.carga --productos 100000 --segundos 10 --clientes 32
+
+Arranca servidor.py sobre una base sintética, inicia sesión y golpea cada ruta desde
+varios procesos cliente con conexiones keep-alive (http.client). Los clientes son
+procesos para que el GIL del generador de carga no limite la medición.
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.parse
+
+import db
+from benchmarks import datos
+
+RUTAS = ["/catalogo/insumos", "/dashboard"]
+PUERTO = 8765
+SERVIDOR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "servidor.py")
+
+
+def _login(host, port):
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    cuerpo = urllib.parse.urlencode({"username": "admin", "password": "Admin123*"})
+    conn.request("POST", "/login", cuerpo, {"Content-Type": "application/x-www-form-urlencoded"})
+    resp = conn.getresponse()
+    resp.read()
+    cookie = resp.getheader("Set-Cookie", "").split(";", 1)[0]
+    conn.close()
+    return cookie
+
+
+def _cliente(args):
+    host, port, ruta, cookie, hasta = args
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    ok = errores = 0
+    latencias = []
+    reusada = False
+    while time.monotonic() < hasta:
+        try:
+            t0 = time.perf_counter()
+            conn.request("GET", ruta, headers={"Cookie": cookie})
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status == 200:
+                ok += 1
+                latencias.append((time.perf_counter() - t0) * 1000)
+            else:
+                errores += 1
+            reusada = True
+            if resp.getheader("Connection", "").lower() == "close":
+                conn.close()
+                reusada = False
+        except (OSError, http.client.HTTPException):
+            # un worker reciclado (max_requests) cierra sus conexiones keep-alive: se reconecta
+            if not reusada:
+                errores += 1
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+            reusada = False
+    conn.close()
+    return ok, errores, latencias
+
+
+def percentiles(valores) -> dict:
+    """p50/p95/p99 en ms (0 si no hay datos)."""
+    if len(valores) < 2:
+        v = valores[0] if valores else 0.0
+        return {"p50_ms": v, "p95_ms": v, "p99_ms": v}
+    q = statistics.quantiles(valores, n=100, method="inclusive")
+    return {"p50_ms": round(q[49], 2), "p95_ms": round(q[94], 2), "p99_ms": round(q[98], 2)}
+
+
+def _esperar_puerto(port, limite=30):
+    fin = time.monotonic() + limite
+    while time.monotonic() < fin:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def medir(workers, threads, clientes, segundos, rutas=RUTAS):
+    """{ruta: {"req_s", "errores", "p50_ms", "p95_ms", "p99_ms"}} con `workers` procesos."""
+    env = dict(os.environ, MIKEN_DB=db.DB_NAME)
+    proc = subprocess.Popen(
+        [sys.executable, SERVIDOR, "--bind", f"127.0.0.1:{PUERTO}", "--workers", str(workers),
+         "--threads", str(threads), "--pidfile", os.path.join(os.path.dirname(db.DB_NAME), "carga.pid")],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        if not _esperar_puerto(PUERTO):
+            raise RuntimeError("El servidor no arrancó")
+        cookie = _login("127.0.0.1", PUERTO)
+        resultados = {}
+        with multiprocessing.Pool(clientes) as pool:
+            for ruta in rutas:
+                # calentamiento: caches de páginas y de SQLite en todos los workers
+                pool.map(_cliente, [("127.0.0.1", PUERTO, ruta, cookie, time.monotonic() + 1)] * clientes)
+                hasta = time.monotonic() + segundos
+                partes = pool.map(_cliente, [("127.0.0.1", PUERTO, ruta, cookie, hasta)] * clientes)
+                resultados[ruta] = {
+                    "req_s": round(sum(p[0] for p in partes) / segundos, 1),
+                    "errores": sum(p[1] for p in partes),
+                    **percentiles([ms for p in partes for ms in p[2]]),
+                }
+        return resultados
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--productos", type=int, default=100_000)
+    parser.add_argument("--segundos", type=float, default=10)
+    parser.add_argument("--clientes", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--workers", type=int, nargs="*",
+                        default=sorted({1, 2, max(1, (os.cpu_count() or 1) // 2), os.cpu_count() or 1}))
+    args = parser.parse_args()
+
+    datos.nueva_db("carga.db")
+    conn = db.pooled_conn()
+    datos.generar_productos(conn, args.productos)
+    datos.generar_caja(conn, 50_000, dias=60)
+    db.close_pool()
+
+    print(f"núcleos: {os.cpu_count()}  clientes: {args.clientes}  hilos/worker: {args.threads}")
+    print(f"{'workers':>7} | " + " | ".join(f"{r:>22}" for r in RUTAS))
+    for w in args.workers:
+        res = medir(w, args.threads, args.clientes, args.segundos)
+        celdas = []
+        for r in RUTAS:
+            err = f" ({res[r]['errores']} err)" if res[r]["errores"] else ""
+            celdas.append(f"{res[r]['req_s']:>14.0f} req/s{err:>3}")
+        print(f"{w:>7} | " + " | ".join(celdas))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Bases de datos sintéticas para los benchmarks.
+Usan el mismo esquema que db.migrate() sobre un archivo temporal.
+"""
+import os
+import random
+import tempfile
+from datetime import date, timedelta
+
+import db
+
+CATEGORIAS = ["Bases", "Conos", "Tarrinas", "Vasos", "Toppings", "Repuestos", "Helado soft", "En revisión"]
+
+
+def nueva_db(nombre: str = "bench.db") -> str:
+    """Crea una base vacía con el esquema actual y apunta db.DB_NAME a ella."""
+    carpeta = tempfile.mkdtemp(prefix="miken_bench_")
+    path = os.path.join(carpeta, nombre)
+    db.close_pool()
+    db.DB_NAME = path
+    db.migrate()
+    return path
+
+
+def generar_productos(conn, n: int, lote: int = 50_000):
+    rnd = random.Random(1)
+    filas = (
+        (
+            "maquina" if i % 10 == 0 else "insumo",
+            f"SKU-{i:07d}",
+            f"Producto {i} {rnd.choice(CATEGORIAS)}",
+            rnd.choice(CATEGORIAS),
+            "unidad",
+            round(rnd.uniform(0.5, 500), 2),
+            rnd.randint(0, 50),
+            rnd.randint(0, 10),
+            1 if i % 20 else 0,
+        )
+        for i in range(n)
+    )
+    _insertar_por_lotes(conn, """
+        INSERT INTO productos
+        (tipo, sku, nombre, categoria, unidad, precio, stock_actual, stock_min, activo)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, filas, lote)
+
+
+def generar_caja(conn, n: int, dias: int = 3 * 365, lote: int = 50_000):
+    rnd = random.Random(2)
+    hoy = date.today()
+
+    def filas():
+        for i in range(n):
+            d = hoy - timedelta(days=rnd.randrange(dias))
+            fecha = f"{d.isoformat()} {rnd.randrange(8, 21):02d}:{rnd.randrange(60):02d}:{rnd.randrange(60):02d}"
+            tipo_mov = "ingreso" if rnd.random() < 0.8 else "egreso"
+            metodo = "efectivo" if rnd.random() < 0.7 else "banco"
+            motivo = "venta helado" if tipo_mov == "ingreso" else "compra insumos"
+            yield (fecha, d.isoformat(), round(rnd.uniform(1, 80), 2), motivo, f"R{i}", tipo_mov, metodo)
+
+    _insertar_por_lotes(conn, """
+        INSERT INTO caja_movimientos
+        (fecha, dia, monto, motivo, referencia, tipo_mov, metodo)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, filas(), lote)
+
+
+def generar_movimientos(conn, n: int, productos: int, dias: int = 365, lote: int = 50_000):
+    """Historial de inventario (directo a movimientos, sin pasar por el libro de inventario.py)."""
+    rnd = random.Random(3)
+    hoy = date.today()
+
+    def filas():
+        for _ in range(n):
+            d = hoy - timedelta(days=rnd.randrange(dias))
+            tipo_mov = "ingreso" if rnd.random() < 0.4 else "egreso"
+            yield (
+                rnd.randint(1, productos), tipo_mov, rnd.randint(1, 10),
+                "compra" if tipo_mov == "ingreso" else "venta",
+                f"{d.isoformat()} {rnd.randrange(8, 21):02d}:{rnd.randrange(60):02d}:00",
+            )
+
+    _insertar_por_lotes(conn, """
+        INSERT INTO movimientos (producto_id, tipo_mov, cantidad, motivo, fecha)
+        VALUES (?, ?, ?, ?, ?)
+    """, filas(), lote)
+
+
+def _insertar_por_lotes(conn, sql, filas, lote):
+    buf = []
+    for f in filas:
+        buf.append(f)
+        if len(buf) >= lote:
+            conn.executemany(sql, buf)
+            conn.commit()
+            buf = []
+    if buf:
+        conn.executemany(sql, buf)
+        conn.commit()
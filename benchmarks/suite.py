@@ -0,0 +1,253 @@
+"""
+Suite de rendimiento: todas las rutas de app.py contra una base sintética grande.
+
+    python -m benchmarks.suite                                  # 1M productos, 10M movimientos de caja
+    python -m benchmarks.suite --productos 100000 --caja 1000000 --db /tmp/miken_100k.db
+    python -m benchmarks.suite --db /tmp/miken_100k.db --comparar bench_<commit>.json
+
+Por ruta (Flask test client, un hilo): p50/p95/p99, consultas SQL por request y RSS.
+Con --http además levanta servidor.py y mide req/s y latencias con clientes concurrentes
+(benchmarks/carga.py). El resultado se guarda en JSON (bench_<commit>.json) para comparar
+contra otro commit con --comparar.
+
+--db reutiliza la base si ya existe (generar 10M filas lleva su tiempo).
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import date, timedelta
+
+import db
+from benchmarks import carga, datos
+from benchmarks.bench_export import MuestreoRSS, rss_mb
+
+REPETICIONES = 20
+REPETICIONES_PESADAS = 2  # exportaciones completas
+# logout: cierra la sesión de la suite
+OMITIDAS = {"logout": "cierra la sesión", "static": "ver static_assets",
+            "perf": "solo con app.debug"}
+
+
+def rutas(conn):
+    """(endpoint, método, url, datos, pesada). Las escrituras van al final."""
+    cur = conn.cursor()
+    insumo = cur.execute("SELECT id FROM productos WHERE tipo='insumo' AND activo=1 ORDER BY id LIMIT 1").fetchone()[0]
+    mov = cur.execute("SELECT MAX(id) FROM caja_movimientos").fetchone()[0] or 1
+    hoy = date.today()
+    mes = f"start={(hoy - timedelta(days=30)).isoformat()}&end={hoy.isoformat()}"
+
+    lecturas = [
+        ("home", "GET", "/", None, False),
+        ("login", "GET", "/login", None, False),
+        ("forgot_password", "GET", "/forgot-password", None, False),
+        ("dashboard", "GET", "/dashboard", None, False),
+        ("cache_stats", "GET", "/__cache", None, False),
+        ("metrics", "GET", "/metrics", None, False),
+        ("catalogo_home", "GET", "/catalogo", None, False),
+        ("catalogo_maquinas", "GET", "/catalogo/maquinas", None, False),
+        ("catalogo_insumos", "GET", "/catalogo/insumos", None, False),
+        ("catalogo_insumos_busqueda", "GET", "/catalogo/insumos?q=bases", None, False),
+        ("catalogo_insumos_pagina", "GET", f"/catalogo/insumos?after={insumo + 5000}&page=2", None, False),
+        ("stock_bajo", "GET", "/inventario/stock-bajo", None, False),
+        ("catalogo_nuevo", "GET", "/catalogo/insumo/nuevo", None, False),
+        ("catalogo_editar", "GET", f"/catalogo/insumo/{insumo}/editar", None, False),
+        ("catalogo_importar", "GET", "/catalogo/importar", None, False),
+        ("inventario_movimiento_nuevo", "GET", "/inventario/movimiento/nuevo", None, True),
+        ("inventario_movimientos", "GET", "/inventario/movimientos", None, False),
+        ("caja_home", "GET", "/caja", None, False),
+        ("caja_movimientos_list", "GET", f"/caja/movimientos?{mes}", None, False),
+        ("caja_mov_nuevo", "GET", "/caja/movimiento/nuevo", None, False),
+        ("caja_abrir", "GET", "/caja/abrir", None, False),
+        ("caja_cerrar", "GET", "/caja/cerrar", None, False),
+        ("reporte_ventas_csv", "GET", f"/reportes/ventas.csv?{mes}", None, True),
+        ("reporte_ventas_xlsx", "GET", f"/reportes/ventas.xlsx?{mes}", None, True),
+        ("reporte_inventario_csv", "GET", "/reportes/inventario.csv", None, True),
+        ("reporte_inventario_xlsx", "GET", "/reportes/inventario.xlsx", None, True),
+        ("reporte_cierres_pdf", "GET", f"/reportes/caja/cierres.pdf?{mes}", None, True),
+        ("reporte_inventario_pdf", "GET", "/reportes/inventario.pdf", None, True),
+        ("stock_bajo_eventos", "GET", "/inventario/stock-bajo/eventos?after=0", None, False),
+        ("reporte_caja_tendencias", "GET", "/reportes/caja/tendencias", None, False),
+        ("reporte_caja_tendencias_dia", "GET", "/reportes/caja/tendencias?periodo=dia", None, False),
+    ]
+    escrituras = [
+        ("login_post", "POST", "/login", {"username": "admin", "password": "Admin123*"}, False),
+        ("caja_mov_nuevo_post", "POST", "/caja/movimiento/nuevo",
+         {"dia": hoy.isoformat(), "tipo_mov": "ingreso", "metodo": "efectivo", "monto": "5", "motivo": "venta bench"}, False),
+        ("caja_marcar_enviado_matriz", "POST", f"/caja/movimiento/{mov}/enviar-matriz", {}, False),
+        ("inventario_movimiento_nuevo_post", "POST", "/inventario/movimiento/nuevo",
+         {"producto_id": str(insumo), "tipo_mov": "ingreso", "cantidad": "1", "motivo": "bench"}, False),
+        ("inventario_movimientos_lote", "POST", "/inventario/movimientos/lote",
+         {"movimientos": [{"producto_id": insumo, "tipo_mov": "ingreso", "cantidad": 1}] * 100}, False),
+        ("catalogo_toggle", "POST", f"/catalogo/insumo/{insumo}/toggle", {}, False),
+        ("catalogo_editar_post", "POST", f"/catalogo/insumo/{insumo}/editar",
+         {"nombre": "Producto bench", "sku": "BENCH-1", "stock_actual": "10", "stock_original": "10"}, False),
+    ]
+    return lecturas + escrituras
+
+
+def _contador_sql(conn):
+    n = [0]
+    conn.set_trace_callback(lambda sql: n.__setitem__(0, n[0] + 1))
+    return n
+
+
+def medir_ruta(cliente, conn, metodo, url, datos_post, repeticiones):
+    tiempos, consultas, estados = [], [], set()
+    contador = _contador_sql(conn)
+    with MuestreoRSS() as rss:
+        for _ in range(repeticiones):
+            contador[0] = 0
+            t0 = time.perf_counter()
+            if metodo == "GET":
+                r = cliente.get(url)
+            elif isinstance(datos_post, dict) and "movimientos" in datos_post:
+                r = cliente.post(url, json=datos_post)
+            else:
+                r = cliente.post(url, data=datos_post)
+            r.get_data()  # consume las respuestas en streaming (CSV)
+            tiempos.append((time.perf_counter() - t0) * 1000)
+            consultas.append(contador[0])
+            estados.add(r.status_code)
+    conn.set_trace_callback(None)
+
+    return {
+        "metodo": metodo,
+        "url": url,
+        "repeticiones": repeticiones,
+        "estados": sorted(estados),
+        "primera_ms": round(tiempos[0], 2),
+        **carga.percentiles(tiempos),
+        "consultas": max(consultas),
+        "rss_pico_mb": round(rss.maximo, 1),
+    }
+
+
+def generar(args):
+    print(f"Generando {args.productos:,} productos, {args.caja:,} movimientos de caja, "
+          f"{args.movimientos:,} de inventario...")
+    t0 = time.perf_counter()
+    conn = db.pooled_conn()
+    datos.generar_productos(conn, args.productos)
+    datos.generar_caja(conn, args.caja, dias=args.dias)
+    datos.generar_movimientos(conn, args.movimientos, args.productos)
+    conn.execute("ANALYZE")
+    conn.commit()
+    print(f"✅ Base generada en {time.perf_counter() - t0:.0f}s: {db.DB_NAME}")
+
+
+def _commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "sin-git"
+
+
+def comparar(actual, anterior_path):
+    with open(anterior_path, encoding="utf-8") as f:
+        anterior = json.load(f)
+    print(f"\nComparación contra {anterior.get('commit')} ({anterior_path}):")
+    print(f"{'ruta':<36} {'p95 antes':>10} {'p95 ahora':>10} {'Δ%':>7} {'consultas':>10}")
+    for nombre, r in actual["rutas"].items():
+        a = anterior.get("rutas", {}).get(nombre)
+        if not a or not a["p95_ms"]:
+            continue
+        delta = (r["p95_ms"] - a["p95_ms"]) / a["p95_ms"] * 100
+        marca = " ⚠" if delta > 20 else ""
+        print(f"{nombre:<36} {a['p95_ms']:>10.2f} {r['p95_ms']:>10.2f} {delta:>6.0f}%"
+              f" {a['consultas']:>4} → {r['consultas']:<4}{marca}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de todas las rutas sobre una base sintética.")
+    parser.add_argument("--productos", type=int, default=1_000_000)
+    parser.add_argument("--caja", type=int, default=10_000_000)
+    parser.add_argument("--movimientos", type=int, default=1_000_000)
+    parser.add_argument("--dias", type=int, default=3 * 365)
+    parser.add_argument("--db", help="ruta de la base sintética (se reutiliza si existe)")
+    parser.add_argument("--repeticiones", type=int, default=REPETICIONES)
+    parser.add_argument("--http", action="store_true", help="también carga concurrente con servidor.py")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--clientes", type=int, default=16)
+    parser.add_argument("--segundos", type=float, default=10)
+    parser.add_argument("--salida", help="archivo JSON (por defecto bench_<commit>.json)")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior")
+    args = parser.parse_args()
+
+    if args.db and os.path.exists(args.db):
+        db.close_pool()
+        db.DB_NAME = args.db
+        db.migrate()
+        print(f"Usando base existente: {args.db}")
+    else:
+        if args.db:
+            db.close_pool()
+            db.DB_NAME = args.db
+            db.migrate()
+        else:
+            datos.nueva_db("suite.db")
+        generar(args)
+
+    from app import app
+    app.config["TESTING"] = True
+    cliente = app.test_client()
+    with cliente.session_transaction() as s:
+        s["username"] = "admin"
+
+    conn = db.pooled_conn()
+    lista = rutas(conn)
+    cubiertas = {r[0].removesuffix("_post").removesuffix("_busqueda").removesuffix("_pagina") for r in lista}
+    faltan = sorted(e for e in app.view_functions if e not in cubiertas and e not in OMITIDAS)
+    if faltan:
+        print(f"⚠ Rutas sin medir: {', '.join(faltan)}")
+
+    resultado = {
+        "commit": _commit(),
+        "fecha": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "cpu": os.cpu_count(),
+        "db": {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+               for t in ("productos", "caja_movimientos", "movimientos")},
+        "rss_inicial_mb": round(rss_mb(), 1),
+        "rutas": {},
+        "omitidas": OMITIDAS,
+    }
+
+    print(f"{'ruta':<36} {'p50':>8} {'p95':>8} {'p99':>8} {'sql':>5} {'RSS MB':>7}")
+    for nombre, metodo, url, datos_post, pesada in lista:
+        reps = REPETICIONES_PESADAS if pesada else args.repeticiones
+        r = medir_ruta(cliente, conn, metodo, url, datos_post, reps)
+        resultado["rutas"][nombre] = r
+        print(f"{nombre:<36} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} "
+              f"{r['consultas']:>5} {r['rss_pico_mb']:>7.0f}  {r['estados']}")
+    db.close_pool()
+
+    if args.http:
+        print(f"\nCarga HTTP: {args.workers} worker(s), {args.clientes} clientes, {args.segundos:.0f}s por ruta")
+        rutas_http = ["/catalogo/insumos", "/inventario/stock-bajo", "/dashboard", "/caja/movimientos"]
+        resultado["http"] = {
+            "workers": args.workers,
+            "clientes": args.clientes,
+            "rutas": carga.medir(args.workers, 8, args.clientes, args.segundos, rutas_http),
+        }
+        for ruta, h in resultado["http"]["rutas"].items():
+            print(f"{ruta:<36} {h['req_s']:>8.0f} req/s  p50 {h['p50_ms']:.1f}  p95 {h['p95_ms']:.1f}  "
+                  f"p99 {h['p99_ms']:.1f}  errores {h['errores']}")
+
+    salida = args.salida or f"bench_{resultado['commit']}.json"
+    with open(salida, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ Resultados en {salida}")
+
+    if args.comparar:
+        comparar(resultado, args.comparar)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
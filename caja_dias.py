@@ -0,0 +1,38 @@
+"""
+Crea por adelantado las filas de caja_estado de los próximos días, para que el
+primer request de cada día no tenga que escribir (ver ensure_caja_estado en app.py).
+
+    python caja_dias.py [dias]
+
+Programarlo una vez al día, p. ej. en cron:
+    5 0 * * * cd /srv/miken && python caja_dias.py
+"""
+import sys
+
+from db import CAJA_DIAS_ADELANTE, crear_dias_caja, db_conn, ensure_caja_estado_unico
+
+USO = "Uso: python caja_dias.py [dias]"
+
+
+def main():
+    try:
+        dias = int(sys.argv[1]) if len(sys.argv) > 1 else CAJA_DIAS_ADELANTE
+    except ValueError:
+        print(USO)
+        sys.exit(2)
+
+    conn = db_conn()
+    cur = conn.cursor()
+    try:
+        if not ensure_caja_estado_unico(cur):
+            print("❌ Corrija los días repetidos en caja_estado y vuelva a ejecutar.")
+            sys.exit(1)
+        creados = crear_dias_caja(cur, dias=dias)
+        conn.commit()
+        print(f"✅ caja_estado: {creados} día(s) creado(s) de los próximos {dias}.")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
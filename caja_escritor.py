@@ -0,0 +1,214 @@
+"""
+Escritura agrupada (group commit) de movimientos de caja.
+
+En horas pico varios cajeros registran a la vez y cada request hacía su propia
+transacción: todas peleaban por el lock de escritura de SQLite (busy_timeout
+reintenta durmiendo) y hacían un commit cada una.
+
+Ahora el request encola el movimiento y espera. Un único hilo escritor toma todo
+lo pendiente (hasta LOTE_MAX), lo inserta en una sola transacción BEGIN IMMEDIATE y
+recién después del COMMIT responde a cada request. Su conexión usa
+synchronous=FULL: cuando registrar() vuelve, el movimiento ya está en disco (un
+fsync por lote, no por movimiento).
+
+Si un movimiento falla (CHECK, FK...) el lote se rehace con un SAVEPOINT por
+movimiento: ese recibe su error y el resto se confirma igual.
+
+Si la confirmación tarda más de ESPERA y el escritor todavía no tomó el
+movimiento, se descarta (el cajero puede reintentar sin duplicarlo); si ya está
+en un lote, se espera a que ese lote termine.
+
+    mid = registrar({"fecha": ..., "dia": ..., "monto": 10.5, "tipo_mov": "ingreso", ...})
+"""
+import queue
+import sqlite3
+import threading
+from datetime import datetime
+
+import db
+import metricas
+
+LOTE_MAX = 500   # movimientos por transacción
+ESPERA = 60      # s que un request espera la confirmación
+
+COLUMNAS = ("fecha", "dia", "monto", "motivo", "referencia", "tipo_mov", "metodo", "enviado_matriz")
+INSERT_SQL = f"""
+    INSERT INTO caja_movimientos ({", ".join(COLUMNAS)})
+    VALUES ({", ".join("?" * len(COLUMNAS))})
+"""
+# estado del día (caja_estado) en la misma transacción; sin depender de UNIQUE(dia),
+# que las bases migradas con ALTER pueden no tener
+ESTADO_SQL = """
+    INSERT INTO caja_estado (dia, abierta, efectivo_inicial, created_at)
+    SELECT ?, 0, 0, ?
+    WHERE NOT EXISTS (SELECT 1 FROM caja_estado WHERE dia = ?)
+"""
+
+
+class _Pendiente:
+    __slots__ = ("valores", "listo", "id", "error", "tomado", "abandonado")
+
+    def __init__(self, valores):
+        self.valores = valores
+        self.listo = threading.Event()
+        self.id = None
+        self.error = None
+        self.tomado = False      # ya está en un lote (se va a confirmar o fallar)
+        self.abandonado = False  # el request dejó de esperar antes: no se inserta
+
+
+_cola = queue.Queue()
+_hilo = None
+_lock = threading.Lock()
+_lock_pendientes = threading.Lock()  # tomado / abandonado
+
+
+def _tomar(lote):
+    """Deja en el lote solo lo que nadie abandonó y lo marca como tomado."""
+    with _lock_pendientes:
+        vigentes = [p for p in lote if not p.abandonado]
+        for p in vigentes:
+            p.tomado = True
+    return vigentes
+
+
+def _insertar(cur, lote, creado, aislado):
+    """
+    INSERT de cada movimiento (y el estado de cada día, una vez). Con aislado=True
+    cada uno va en su SAVEPOINT y un error queda en ese movimiento; sin aislar, el
+    primer error se propaga y corta el lote.
+    """
+    for dia in {p.valores[1] for p in lote}:
+        cur.execute(ESTADO_SQL, (dia, creado, dia))
+    for p in lote:
+        if not aislado:
+            cur.execute(INSERT_SQL, p.valores)
+            p.id = cur.lastrowid
+            continue
+        cur.execute("SAVEPOINT mov")
+        try:
+            cur.execute(INSERT_SQL, p.valores)
+            p.id = cur.lastrowid
+            cur.execute("RELEASE mov")
+        except sqlite3.Error as e:
+            cur.execute("ROLLBACK TO mov")
+            cur.execute("RELEASE mov")
+            p.error = e
+
+
+def _aplicar(conn, lote, creado):
+    cur = conn.cursor()
+    try:
+        db.begin_immediate(cur)
+        try:
+            _insertar(cur, lote, creado, aislado=False)
+        except sqlite3.IntegrityError:
+            # algún movimiento inválido: se rehace el lote aislando cada uno
+            conn.rollback()
+            db.begin_immediate(cur)
+            _insertar(cur, lote, creado, aislado=True)
+        conn.commit()
+    except BaseException as e:
+        conn.rollback()
+        for p in lote:
+            if p.error is None:
+                p.id, p.error = None, e
+        if not isinstance(e, Exception):
+            raise
+    finally:
+        for p in lote:
+            p.listo.set()
+    metricas.sumar("miken_caja_lotes_total")
+    metricas.sumar("miken_caja_movimientos_total", len(lote))
+
+
+def _escritor():
+    global _hilo
+    error = None
+    try:
+        conn = db.pooled_conn()
+        conn.execute("PRAGMA synchronous=FULL;")
+        while True:
+            p = _cola.get()
+            if p is None:
+                return
+            # lo que se acumuló mientras se confirmaba el lote anterior va todo junto
+            lote = [p]
+            while len(lote) < LOTE_MAX:
+                try:
+                    p = _cola.get_nowait()
+                except queue.Empty:
+                    break
+                if p is None:
+                    _cola.put(None)  # detener() después de este lote
+                    break
+                lote.append(p)
+            lote = _tomar(lote)
+            if lote:
+                _aplicar(conn, lote, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        db.close_pool()
+        # primero se desregistra: lo que se encole de aquí en más arranca otro hilo
+        with _lock:
+            if _hilo is threading.current_thread():
+                _hilo = None
+        _vaciar_cola(error)
+
+
+def _vaciar_cola(error):
+    """El hilo termina: lo que quedó en cola recibe error ya (no espera ESPERA)."""
+    while True:
+        try:
+            p = _cola.get_nowait()
+        except queue.Empty:
+            return
+        if p is None:
+            continue
+        p.error = sqlite3.OperationalError(f"El escritor de caja se detuvo: {error}" if error
+                                           else "El escritor de caja se detuvo.")
+        p.listo.set()
+
+
+def _iniciar():
+    # el hilo se crea con el primer movimiento: así nace dentro del worker (después del fork)
+    global _hilo
+    with _lock:
+        if _hilo is None or not _hilo.is_alive():
+            _hilo = threading.Thread(target=_escritor, name="caja-escritor", daemon=True)
+            _hilo.start()
+
+
+def registrar(mov: dict) -> int:
+    """
+    Encola el movimiento y espera a que su lote quede confirmado. Devuelve el id.
+    Los errores de SQLite del movimiento (IntegrityError, OperationalError) se
+    relanzan aquí, como si el INSERT se hubiera hecho en el request.
+    """
+    p = _Pendiente(tuple(mov.get(c) for c in COLUMNAS))
+    _cola.put(p)
+    _iniciar()  # después del put: si el hilo murió, el nuevo lo encuentra en la cola
+    if not p.listo.wait(ESPERA):
+        with _lock_pendientes:
+            if not p.tomado:
+                p.abandonado = True
+        if p.abandonado:
+            raise sqlite3.OperationalError("El escritor de caja no confirmó el movimiento a tiempo (no se registró).")
+        p.listo.wait()  # ya está en un lote: se confirma o falla, pero no hay que reintentar
+    if p.error is not None:
+        # el error puede ser el mismo objeto para todo el lote: cada request lanza el suyo
+        tipo = type(p.error) if isinstance(p.error, sqlite3.Error) else sqlite3.OperationalError
+        raise tipo(str(p.error)) from p.error
+    return p.id
+
+
+def detener(espera: float = 10):
+    """Confirma lo pendiente y termina el hilo escritor (al cerrar el worker)."""
+    global _hilo
+    with _lock:
+        hilo, _hilo = _hilo, None
+    if hilo is not None and hilo.is_alive():
+        _cola.put(None)
+        hilo.join(espera)
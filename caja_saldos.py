@@ -0,0 +1,62 @@
+"""
+Totales materializados de caja_movimientos (los mantienen triggers, ver db.py):
+- caja_saldos: ingresos/egresos por (dia, metodo)
+- caja_resumen: total y cantidad por período (día/semana/mes) × metodo × tipo_mov
+
+    python caja_saldos.py verify     # compara con la suma real de los movimientos
+    python caja_saldos.py rebuild    # recalcula ambos desde cero (backfill)
+"""
+import sys
+
+from db import (
+    db_conn, rebuild_caja_resumen, rebuild_caja_saldos, verify_caja_resumen, verify_caja_saldos
+)
+
+USO = "Uso: python caja_saldos.py verify | rebuild"
+
+
+def main():
+    accion = sys.argv[1] if len(sys.argv) > 1 else "verify"
+    if accion not in ("verify", "rebuild"):
+        print(USO)
+        sys.exit(2)
+
+    conn = db_conn()
+    cur = conn.cursor()
+    try:
+        if accion == "rebuild":
+            cur.execute("BEGIN IMMEDIATE;")
+            rebuild_caja_saldos(cur)
+            rebuild_caja_resumen(cur)
+            cur.execute("COMMIT;")
+            print("✅ caja_saldos y caja_resumen recalculados desde caja_movimientos.")
+            return
+
+        malos = verify_caja_saldos(cur)
+        if not malos:
+            print("✅ caja_saldos cuadra con caja_movimientos.")
+        else:
+            print(f"❌ {len(malos)} fila(s) de caja_saldos no cuadran:")
+            for r in malos:
+                print(f" - {r['dia']} {r['metodo']}: ingresos {r['ingresos_saldo']} (real {r['ingresos_real']}), "
+                      f"egresos {r['egresos_saldo']} (real {r['egresos_real']})")
+
+        malos_resumen = verify_caja_resumen(cur)
+        if not malos_resumen:
+            print("✅ caja_resumen cuadra con caja_movimientos.")
+        else:
+            print(f"❌ {len(malos_resumen)} fila(s) de caja_resumen no cuadran:")
+            for r in malos_resumen[:50]:
+                print(f" - {r['periodo']} {r['inicio']} {r['metodo']} {r['tipo_mov']}: "
+                      f"total {r['total_resumen']} (real {r['total_real']}), "
+                      f"movimientos {r['movimientos_resumen']} (real {r['movimientos_real']})")
+
+        if malos or malos_resumen:
+            print("Ejecute: python caja_saldos.py rebuild")
+            sys.exit(1)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,14 @@
+import os
 import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
 
-DB_NAME = "miken.db"
+import metricas
+import perfil
+
+# MIKEN_DB permite apuntar el servidor (o los benchmarks) a otra base
+DB_NAME = os.environ.get("MIKEN_DB", "miken.db")
 
 
 def db_conn():
@@ -10,9 +18,159 @@ def db_conn():
     return conn
 
 
-def column_exists(cur, table: str, column: str) -> bool:
+# --------------------
+# POOL DE CONEXIONES (una por hilo)
+# --------------------
+class PooledConnection(sqlite3.Connection):
+    """
+    Conexión que vive todo lo que vive su hilo.
+    close() no la cierra: solo deshace lo que haya quedado pendiente, así las
+    rutas pueden seguir llamando conn.close() como siempre.
+    Dentro de un request los cursores son perfil.CursorPerfilado (SQL, tiempo y filas).
+    """
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or perfil.cursor_factory())
+
+    # Connection.execute* de sqlite3 no pasa por self.cursor(): se redirigen aquí
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def close_real(self):
+        super().close()
+
+
+_pool = threading.local()
+
+
+def _open_pooled_conn():
+    conn = sqlite3.connect(
+        DB_NAME,
+        timeout=30,
+        check_same_thread=False,
+        factory=PooledConnection
+    )
+    conn.row_factory = sqlite3.Row
+
+    # Los PRAGMA se aplican una sola vez por conexión
+    conn.execute("PRAGMA foreign_keys=ON;")
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA busy_timeout=30000;")
+    return conn
+
+
+def pooled_conn():
+    """Devuelve la conexión del hilo actual (la abre la primera vez)."""
+    conn = getattr(_pool, "conn", None)
+    if conn is None:
+        conn = _open_pooled_conn()
+        _pool.conn = conn
+        metricas.sumar("miken_db_conexiones_total", evento="abierta")
+    else:
+        metricas.sumar("miken_db_conexiones_total", evento="reusada")
+    return conn
+
+
+def release_conn(conn):
+    """Devuelve la conexión al pool: deja la transacción limpia para el siguiente uso."""
+    if conn is not None:
+        conn.close()
+
+
+def close_pool():
+    """Cierra de verdad la conexión del hilo actual (p. ej. al terminar un worker)."""
+    conn = getattr(_pool, "conn", None)
+    if conn is not None:
+        _pool.conn = None
+        conn.close_real()
+        metricas.sumar("miken_db_conexiones_total", evento="cerrada")
+
+
+def pool_stats() -> dict:
+    # contadores por hilo de metricas.py (sin lock en pooled_conn)
+    return {
+        clave: metricas.valor("miken_db_conexiones_total", evento=evento)
+        for clave, evento in (("abiertas", "abierta"), ("reusadas", "reusada"), ("cerradas", "cerrada"))
+    }
+
+
+@metricas.colector
+def _conexiones_abiertas():
+    s = pool_stats()
+    return [("miken_db_conexiones_abiertas", {}, s["abiertas"] - s["cerradas"])]
+
+
+# --------------------
+# TRANSACCIONES DE ESCRITURA
+# --------------------
+def es_bloqueo(e: Exception) -> bool:
+    """sqlite3.OperationalError por lock (busy_timeout agotado)."""
+    msg = str(e).lower()
+    return isinstance(e, sqlite3.OperationalError) and ("locked" in msg or "busy" in msg)
+
+
+def begin_immediate(cur):
+    """
+    BEGIN IMMEDIATE midiendo cuánto esperó por el lock de escritura. SQLite reintenta
+    solo dentro de busy_timeout y no avisa: esta espera es lo que se ve desde afuera.
+    """
+    t0 = time.perf_counter()
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+    except sqlite3.OperationalError as e:
+        if es_bloqueo(e):
+            metricas.sumar("miken_db_bloqueos_total")
+        raise
+    metricas.observar("miken_db_espera_lock_segundos", time.perf_counter() - t0)
+
+
+# --------------------
+# CACHE DE ESQUEMA (columnas por tabla)
+# --------------------
+_schema_cache = {}
+_schema_lock = threading.Lock()
+
+
+def table_columns(cur, table: str) -> frozenset:
+    """
+    Columnas de una tabla. El PRAGMA table_info se ejecuta una sola vez por tabla;
+    las siguientes consultas salen del cache (compartido por app.py y db.py).
+    """
+    key = (DB_NAME, table)
+    cols = _schema_cache.get(key)
+    if cols is not None:
+        return cols
+
     cur.execute(f"PRAGMA table_info({table})")
-    return column in [r[1] for r in cur.fetchall()]
+    cols = frozenset(r[1] for r in cur.fetchall())
+    # Tabla inexistente: no se cachea, puede crearse después
+    if cols:
+        with _schema_lock:
+            _schema_cache[key] = cols
+    return cols
+
+
+def invalidate_schema(table: str = None):
+    with _schema_lock:
+        if table is None:
+            _schema_cache.clear()
+        else:
+            _schema_cache.pop((DB_NAME, table), None)
+
+
+def column_exists(cur, table: str, column: str) -> bool:
+    return column in table_columns(cur, table)
 
 
 def add_column_if_missing(cur, table: str, column: str, ddl: str):
@@ -22,18 +180,550 @@ def add_column_if_missing(cur, table: str, column: str, ddl: str):
     """
     if not column_exists(cur, table, column):
         cur.execute(f"ALTER TABLE {table} ADD COLUMN {ddl}")
+        invalidate_schema(table)
         print(f"✅ Columna agregada: {table}.{column}")
 
 
 def ensure_indexes(cur):
+    # Listados del catálogo (tipo + id DESC) y stock bajo (tipo, nombre, id)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_productos_tipo ON productos(tipo)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_productos_tipo_nombre ON productos(tipo, nombre)")
+    # referencias del almacén de imágenes por contenido (imagenes.referencias)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_productos_imagen ON productos(imagen_filename)")
+
     cur.execute("CREATE INDEX IF NOT EXISTS idx_movimientos_producto_id ON movimientos(producto_id)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_movimientos_fecha ON movimientos(fecha)")
 
     cur.execute("CREATE INDEX IF NOT EXISTS idx_caja_mov_dia ON caja_movimientos(dia)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_caja_mov_fecha ON caja_movimientos(fecha)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_caja_mov_dia_fecha ON caja_movimientos(dia, fecha, id)")
+    # Cubriente: los totales por día/método se responden solo con el índice
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_caja_mov_dia_metodo
+        ON caja_movimientos(dia, metodo, tipo_mov, monto)
+    """)
     cur.execute("CREATE INDEX IF NOT EXISTS idx_caja_estado_dia ON caja_estado(dia)")
 
 
+SKU_UNICO_WHERE = "sku IS NOT NULL AND sku <> ''"
+
+
+def ensure_sku_unico(cur) -> bool:
+    """
+    Índice único parcial por sku (los productos sin sku quedan fuera): lo necesita el
+    upsert de importar.py (ON CONFLICT(sku)). Si ya hay skus repetidos no se crea;
+    se listan para corregirlos a mano. Devuelve si el índice existe.
+    """
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_productos_sku'")
+    if cur.fetchone():
+        return True
+
+    cur.execute(f"""
+        SELECT sku, COUNT(*) AS n FROM productos
+        WHERE {SKU_UNICO_WHERE}
+        GROUP BY sku HAVING COUNT(*) > 1
+    """)
+    repetidos = cur.fetchall()
+    if repetidos:
+        print(f"⚠ No se creó idx_productos_sku: {len(repetidos)} sku repetido(s)")
+        for r in repetidos[:20]:
+            print(f" - {r[0]} ({r[1]} productos)")
+        return False
+
+    cur.execute(f"CREATE UNIQUE INDEX idx_productos_sku ON productos(sku) WHERE {SKU_UNICO_WHERE}")
+    print("✅ Índice único creado: productos.sku")
+    return True
+
+
+def _indice_unico(cur, tabla: str, columna: str) -> bool:
+    """Hay un índice UNIQUE (o UNIQUE de la tabla) exactamente sobre `columna`."""
+    cur.execute(f"PRAGMA index_list({tabla})")
+    for idx in cur.fetchall():
+        if idx["unique"] and idx["partial"] == 0:
+            cur.execute(f"PRAGMA index_info({idx['name']})")
+            if [r["name"] for r in cur.fetchall()] == [columna]:
+                return True
+    return False
+
+
+def caja_estado_dia_unico(cur) -> bool:
+    """caja_estado tiene UNIQUE(dia): se puede usar ON CONFLICT(dia)."""
+    return _indice_unico(cur, "caja_estado", "dia")
+
+
+def ensure_caja_estado_unico(cur) -> bool:
+    """
+    UNIQUE(dia) en caja_estado: lo necesita el upsert de ensure_caja_estado
+    (ON CONFLICT(dia)). Las tablas creadas con el esquema actual ya lo traen; las
+    migradas con ALTER no. Si hay días repetidos no se crea y se listan.
+    """
+    if caja_estado_dia_unico(cur):
+        return True
+
+    cur.execute("SELECT dia, COUNT(*) FROM caja_estado GROUP BY dia HAVING COUNT(*) > 1")
+    repetidos = cur.fetchall()
+    if repetidos:
+        print(f"⚠ No se creó idx_caja_estado_dia_unico: {len(repetidos)} día(s) repetido(s)")
+        for r in repetidos[:20]:
+            print(f" - {r[0]} ({r[1]} filas)")
+        return False
+
+    cur.execute("CREATE UNIQUE INDEX idx_caja_estado_dia_unico ON caja_estado(dia)")
+    print("✅ Índice único creado: caja_estado.dia")
+    return True
+
+
+CAJA_DIAS_ADELANTE = 7  # días de caja_estado que se crean por adelantado
+
+
+def crear_dias_caja(cur, desde: date = None, dias: int = CAJA_DIAS_ADELANTE) -> int:
+    """
+    Crea (cerradas, efectivo inicial 0) las filas de caja_estado de `dias` días desde
+    `desde` (hoy por defecto) que todavía no existan. Así el primer request del día
+    ya encuentra su fila y no tiene que escribir. Devuelve cuántas creó.
+    """
+    desde = desde or date.today()
+    creado = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    cur.executemany("""
+        INSERT INTO caja_estado (dia, abierta, efectivo_inicial, created_at)
+        VALUES (?, 0, 0, ?)
+        ON CONFLICT(dia) DO NOTHING
+    """, [((desde + timedelta(days=i)).isoformat(), creado) for i in range(dias)])
+    return cur.rowcount
+
+
+STOCK_BAJO_WHERE = "activo=1 AND stock_actual <= stock_min"
+STOCK_EVENTOS_DIAS = 30     # historial de eventos que se conserva (poda de migrate)
+STOCK_EVENTOS_MAX = 10000   # eventos que se conservan entre migraciones (poda al insertar)
+
+
+def _stock_bajo(fila: str) -> str:
+    return f"({fila}.activo=1 AND {fila}.stock_actual <= {fila}.stock_min)"
+
+
+def ensure_stock_bajo(cur):
+    """
+    Stock bajo sin recorrer productos:
+    - idx_productos_stock_bajo: índice parcial que solo contiene los productos activos con
+      stock_actual <= stock_min (una comparación entre columnas no usa un índice normal).
+      La página de stock bajo y los contadores del dashboard leen de aquí.
+    - stock_eventos: los triggers agregan una fila cada vez que un producto entra (bajo=1)
+      o sale (bajo=0) de stock bajo; el dashboard los consulta por /inventario/stock-bajo/eventos.
+      Cada INSERT borra los que quedaron más de STOCK_EVENTOS_MAX ids atrás (rango de la
+      PK, casi siempre una fila), así la tabla no crece aunque no se migre nunca.
+    """
+    cur.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_productos_stock_bajo
+        ON productos(tipo, nombre, id) WHERE {STOCK_BAJO_WHERE}
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS stock_eventos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            producto_id INTEGER NOT NULL,
+            tipo TEXT,
+            bajo INTEGER NOT NULL,
+            stock_actual INTEGER,
+            stock_min INTEGER,
+            fecha TEXT NOT NULL DEFAULT (datetime('now', 'localtime'))
+        )
+    """)
+
+    insertar = """
+        INSERT INTO stock_eventos (producto_id, tipo, bajo, stock_actual, stock_min)
+        VALUES (NEW.id, NEW.tipo, {bajo}, NEW.stock_actual, NEW.stock_min);
+    """
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS stock_eventos_ai AFTER INSERT ON productos
+        WHEN {_stock_bajo("NEW")} BEGIN
+            {insertar.format(bajo=1)}
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS stock_eventos_au
+        AFTER UPDATE OF stock_actual, stock_min, activo ON productos
+        WHEN {_stock_bajo("OLD")} IS NOT {_stock_bajo("NEW")} BEGIN
+            {insertar.format(bajo=_stock_bajo("NEW"))}
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS stock_eventos_podar AFTER INSERT ON stock_eventos BEGIN
+            DELETE FROM stock_eventos WHERE id <= NEW.id - {STOCK_EVENTOS_MAX};
+        END
+    """)
+
+    cur.execute(
+        "DELETE FROM stock_eventos WHERE fecha < datetime('now', 'localtime', ?)",
+        (f"-{STOCK_EVENTOS_DIAS} days",)
+    )
+
+
+def ensure_productos_fts(cur):
+    """
+    Índice de texto completo (FTS5) para buscar productos por sku, nombre y categoría.
+    - unicode61 + remove_diacritics: 'maquina' encuentra 'Máquina'
+    - prefix='2 3': búsquedas por prefijo rápidas mientras se escribe
+    Tabla de contenido externo (no duplica datos); los triggers la mantienen al día.
+    """
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='productos_fts'")
+    existia = cur.fetchone() is not None
+
+    cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS productos_fts USING fts5(
+            sku, nombre, categoria,
+            content='productos', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    """)
+
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS productos_fts_ai AFTER INSERT ON productos BEGIN
+            INSERT INTO productos_fts(rowid, sku, nombre, categoria)
+            VALUES (new.id, new.sku, new.nombre, new.categoria);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS productos_fts_ad AFTER DELETE ON productos BEGIN
+            INSERT INTO productos_fts(productos_fts, rowid, sku, nombre, categoria)
+            VALUES ('delete', old.id, old.sku, old.nombre, old.categoria);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS productos_fts_au AFTER UPDATE OF sku, nombre, categoria ON productos BEGIN
+            INSERT INTO productos_fts(productos_fts, rowid, sku, nombre, categoria)
+            VALUES ('delete', old.id, old.sku, old.nombre, old.categoria);
+            INSERT INTO productos_fts(rowid, sku, nombre, categoria)
+            VALUES (new.id, new.sku, new.nombre, new.categoria);
+        END
+    """)
+
+    # Primera vez: indexa los productos que ya existían
+    if not existia:
+        cur.execute("INSERT INTO productos_fts(productos_fts) VALUES ('rebuild')")
+        print("✅ Índice de búsqueda creado: productos_fts")
+
+    ensure_productos_sku_fts(cur)
+
+
+SQLITE_TRIGRAM = sqlite3.sqlite_version_info >= (3, 34, 0)
+
+
+def ensure_productos_sku_fts(cur):
+    """
+    productos_fts busca palabras por prefijo: 'INS-00123' son las palabras 'ins' y
+    '00123', y un fragmento como '0123' no las encuentra. Para el sku (se busca por
+    pedazos del código) va aparte un índice trigram: encuentra cualquier fragmento de
+    3+ caracteres, como el LIKE '%q%' de antes. Necesita SQLite 3.34+; sin él se
+    busca solo por productos_fts.
+    """
+    if not SQLITE_TRIGRAM:
+        return
+
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='productos_sku_fts'")
+    existia = cur.fetchone() is not None
+
+    cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS productos_sku_fts USING fts5(
+            sku, content='productos', content_rowid='id', tokenize='trigram'
+        )
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS productos_sku_fts_ai AFTER INSERT ON productos BEGIN
+            INSERT INTO productos_sku_fts(rowid, sku) VALUES (new.id, new.sku);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS productos_sku_fts_ad AFTER DELETE ON productos BEGIN
+            INSERT INTO productos_sku_fts(productos_sku_fts, rowid, sku) VALUES ('delete', old.id, old.sku);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS productos_sku_fts_au AFTER UPDATE OF sku ON productos BEGIN
+            INSERT INTO productos_sku_fts(productos_sku_fts, rowid, sku) VALUES ('delete', old.id, old.sku);
+            INSERT INTO productos_sku_fts(rowid, sku) VALUES (new.id, new.sku);
+        END
+    """)
+
+    if not existia:
+        cur.execute("INSERT INTO productos_sku_fts(productos_sku_fts) VALUES ('rebuild')")
+        print("✅ Índice de búsqueda creado: productos_sku_fts (trigram)")
+
+
+def _saldo_sumar(fila: str, signo: str) -> str:
+    return f"""
+        INSERT INTO caja_saldos (dia, metodo, ingresos, egresos)
+        SELECT {fila}.dia, {fila}.metodo,
+               {signo} CASE WHEN {fila}.tipo_mov='ingreso' THEN {fila}.monto ELSE 0 END,
+               {signo} CASE WHEN {fila}.tipo_mov='egreso' THEN {fila}.monto ELSE 0 END
+        WHERE {fila}.dia IS NOT NULL AND {fila}.metodo IS NOT NULL
+        ON CONFLICT(dia, metodo) DO UPDATE SET
+            ingresos = ingresos + excluded.ingresos,
+            egresos = egresos + excluded.egresos;
+    """
+
+
+def ensure_caja_saldos(cur):
+    """
+    Totales acumulados de caja por (dia, metodo): caja_totales() lee 1-2 filas por PK
+    en lugar de sumar todos los movimientos del día.
+    Los triggers los ajustan en la misma transacción del INSERT/UPDATE/DELETE
+    de caja_movimientos (así también cubren correcciones hechas a mano o por scripts).
+    """
+    # Versión anterior (por 'medio'): se descarta y se reconstruye por 'metodo'
+    if column_exists(cur, "caja_saldos", "medio"):
+        drop_caja_saldos_triggers(cur)
+        cur.execute("DROP TABLE caja_saldos")
+        invalidate_schema("caja_saldos")
+
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='caja_saldos'")
+    existia = cur.fetchone() is not None
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS caja_saldos (
+            dia TEXT NOT NULL,
+            metodo TEXT NOT NULL,
+            ingresos REAL NOT NULL DEFAULT 0,
+            egresos REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (dia, metodo)
+        ) WITHOUT ROWID
+    """)
+
+    # Triggers anteriores (sin filtrar metodo NULL, que choca con la PK): se recrean
+    cur.execute("SELECT sql FROM sqlite_master WHERE type='trigger' AND name='caja_saldos_ai'")
+    previo = cur.fetchone()
+    if previo is not None and "metodo IS NOT NULL" not in previo[0]:
+        drop_caja_saldos_triggers(cur)
+
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS caja_saldos_ai AFTER INSERT ON caja_movimientos BEGIN
+            {_saldo_sumar("new", "+")}
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS caja_saldos_ad AFTER DELETE ON caja_movimientos BEGIN
+            {_saldo_sumar("old", "-")}
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS caja_saldos_au
+        AFTER UPDATE OF dia, monto, tipo_mov, metodo ON caja_movimientos BEGIN
+            {_saldo_sumar("old", "-")}
+            {_saldo_sumar("new", "+")}
+        END
+    """)
+
+    if not existia:
+        rebuild_caja_saldos(cur)
+        print("✅ Totales de caja materializados: caja_saldos")
+
+
+def drop_caja_saldos_triggers(cur):
+    for trg in ("caja_saldos_ai", "caja_saldos_ad", "caja_saldos_au"):
+        cur.execute(f"DROP TRIGGER IF EXISTS {trg}")
+
+
+def _caja_saldos_desde_movimientos_sql() -> str:
+    # Se resuelve desde idx_caja_mov_dia_metodo (índice cubriente), sin leer la tabla
+    return """
+        SELECT dia, metodo,
+               COALESCE(SUM(CASE WHEN tipo_mov='ingreso' THEN monto ELSE 0 END),0) AS ingresos,
+               COALESCE(SUM(CASE WHEN tipo_mov='egreso' THEN monto ELSE 0 END),0) AS egresos
+        FROM caja_movimientos
+        WHERE dia IS NOT NULL AND metodo IS NOT NULL
+        GROUP BY dia, metodo
+    """
+
+
+def rebuild_caja_saldos(cur):
+    """Recalcula caja_saldos desde cero a partir de caja_movimientos."""
+    cur.execute("DELETE FROM caja_saldos")
+    cur.execute(f"""
+        INSERT INTO caja_saldos (dia, metodo, ingresos, egresos)
+        {_caja_saldos_desde_movimientos_sql()}
+    """)
+
+
+def verify_caja_saldos(cur) -> list:
+    """Compara caja_saldos con la suma real; devuelve las filas (dia, metodo, ...) que no cuadran."""
+    cur.execute(f"""
+        WITH real AS ({_caja_saldos_desde_movimientos_sql()}),
+        claves AS (SELECT dia, metodo FROM real UNION SELECT dia, metodo FROM caja_saldos)
+        SELECT k.dia, k.metodo,
+               COALESCE(r.ingresos, 0) AS ingresos_real, COALESCE(s.ingresos, 0) AS ingresos_saldo,
+               COALESCE(r.egresos, 0) AS egresos_real, COALESCE(s.egresos, 0) AS egresos_saldo
+        FROM claves k
+        LEFT JOIN real r ON r.dia = k.dia AND r.metodo = k.metodo
+        LEFT JOIN caja_saldos s ON s.dia = k.dia AND s.metodo = k.metodo
+        WHERE ABS(COALESCE(r.ingresos, 0) - COALESCE(s.ingresos, 0)) > 0.005
+           OR ABS(COALESCE(r.egresos, 0) - COALESCE(s.egresos, 0)) > 0.005
+        ORDER BY k.dia, k.metodo
+    """)
+    return cur.fetchall()
+
+
+# --------------------
+# RESUMEN DE CAJA (día / semana / mes × metodo × tipo_mov)
+# --------------------
+CAJA_PERIODOS = ("dia", "semana", "mes")
+# inicio del período para un día 'YYYY-MM-DD' (semana = lunes); NULL si el día no es una fecha
+CAJA_PERIODO_INICIO = {
+    "dia": "{dia}",
+    "semana": "date({dia}, '-6 days', 'weekday 1')",
+    "mes": "date({dia}, 'start of month')",
+}
+
+
+def _resumen_sumar(fila: str, signo: str) -> str:
+    periodos = " UNION ALL ".join(
+        f"SELECT '{p}' AS periodo, {CAJA_PERIODO_INICIO[p].format(dia=f'{fila}.dia')} AS inicio"
+        for p in CAJA_PERIODOS
+    )
+    return f"""
+        INSERT INTO caja_resumen (periodo, inicio, metodo, tipo_mov, total, movimientos)
+        SELECT p.periodo, p.inicio, {fila}.metodo, {fila}.tipo_mov, {signo} {fila}.monto, {signo} 1
+        FROM ({periodos}) p
+        WHERE date({fila}.dia) IS NOT NULL AND p.inicio IS NOT NULL
+          AND {fila}.metodo IS NOT NULL AND {fila}.tipo_mov IS NOT NULL
+        ON CONFLICT(periodo, inicio, metodo, tipo_mov) DO UPDATE SET
+            total = total + excluded.total,
+            movimientos = movimientos + excluded.movimientos;
+    """
+
+
+def ensure_caja_resumen(cur):
+    """
+    Totales de caja por período (día, semana, mes) × metodo × tipo_mov, con la
+    cantidad de movimientos. Igual que caja_saldos, los triggers los ajustan en la
+    misma transacción que el cambio en caja_movimientos. Un reporte de tendencias
+    de 3 años lee ~36 meses × 2 × 2 filas en lugar de millones de movimientos.
+    """
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='caja_resumen'")
+    existia = cur.fetchone() is not None
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS caja_resumen (
+            periodo TEXT NOT NULL CHECK (periodo IN ('dia','semana','mes')),
+            inicio TEXT NOT NULL,
+            metodo TEXT NOT NULL,
+            tipo_mov TEXT NOT NULL,
+            total REAL NOT NULL DEFAULT 0,
+            movimientos INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (periodo, inicio, metodo, tipo_mov)
+        ) WITHOUT ROWID
+    """)
+
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS caja_resumen_ai AFTER INSERT ON caja_movimientos BEGIN
+            {_resumen_sumar("new", "+")}
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS caja_resumen_ad AFTER DELETE ON caja_movimientos BEGIN
+            {_resumen_sumar("old", "-")}
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS caja_resumen_au
+        AFTER UPDATE OF dia, monto, tipo_mov, metodo ON caja_movimientos BEGIN
+            {_resumen_sumar("old", "-")}
+            {_resumen_sumar("new", "+")}
+        END
+    """)
+
+    if not existia:
+        rebuild_caja_resumen(cur)
+        print("✅ Resumen de caja materializado: caja_resumen (día/semana/mes)")
+
+
+def _caja_resumen_desde_movimientos_sql() -> str:
+    # días desde idx_caja_mov_dia_metodo (cubriente); semanas y meses desde los días
+    semanas_meses = " UNION ALL ".join(
+        f"""SELECT '{p}', {CAJA_PERIODO_INICIO[p].format(dia="inicio")}, metodo, tipo_mov,
+                   SUM(total), SUM(movimientos)
+            FROM dias WHERE {CAJA_PERIODO_INICIO[p].format(dia="inicio")} IS NOT NULL
+            GROUP BY 2, 3, 4"""
+        for p in CAJA_PERIODOS if p != "dia"
+    )
+    return f"""
+        WITH dias AS (
+            SELECT dia AS inicio, metodo, tipo_mov, SUM(monto) AS total, COUNT(*) AS movimientos
+            FROM caja_movimientos
+            WHERE dia IS NOT NULL AND date(dia) IS NOT NULL
+              AND metodo IS NOT NULL AND tipo_mov IS NOT NULL
+            GROUP BY dia, metodo, tipo_mov
+        )
+        SELECT 'dia' AS periodo, inicio, metodo, tipo_mov, total, movimientos FROM dias
+        UNION ALL {semanas_meses}
+    """
+
+
+def rebuild_caja_resumen(cur):
+    """Recalcula caja_resumen desde cero a partir de caja_movimientos."""
+    cur.execute("DELETE FROM caja_resumen")
+    cur.execute(f"""
+        INSERT INTO caja_resumen (periodo, inicio, metodo, tipo_mov, total, movimientos)
+        {_caja_resumen_desde_movimientos_sql()}
+    """)
+
+
+def verify_caja_resumen(cur) -> list:
+    """Filas de caja_resumen que no cuadran con los movimientos (período, inicio, metodo, tipo_mov, ...)."""
+    cur.execute(f"""
+        WITH real AS ({_caja_resumen_desde_movimientos_sql()}),
+        claves AS (
+            SELECT periodo, inicio, metodo, tipo_mov FROM real
+            UNION SELECT periodo, inicio, metodo, tipo_mov FROM caja_resumen WHERE movimientos <> 0
+        )
+        SELECT k.periodo, k.inicio, k.metodo, k.tipo_mov,
+               COALESCE(r.total, 0) AS total_real, COALESCE(s.total, 0) AS total_resumen,
+               COALESCE(r.movimientos, 0) AS movimientos_real, COALESCE(s.movimientos, 0) AS movimientos_resumen
+        FROM claves k
+        LEFT JOIN real r ON r.periodo = k.periodo AND r.inicio = k.inicio
+                        AND r.metodo = k.metodo AND r.tipo_mov = k.tipo_mov
+        LEFT JOIN caja_resumen s ON s.periodo = k.periodo AND s.inicio = k.inicio
+                                AND s.metodo = k.metodo AND s.tipo_mov = k.tipo_mov
+        WHERE ABS(COALESCE(r.total, 0) - COALESCE(s.total, 0)) > 0.005
+           OR COALESCE(r.movimientos, 0) <> COALESCE(s.movimientos, 0)
+        ORDER BY k.periodo, k.inicio, k.metodo, k.tipo_mov
+    """)
+    return cur.fetchall()
+
+
+VERSIONED_TABLES = ("productos", "caja_movimientos", "caja_cierres", "caja_estado")
+
+
+def ensure_data_versions(cur):
+    """
+    Contador de versión por tabla: cualquier INSERT/UPDATE/DELETE lo incrementa (triggers),
+    venga de la app, de otro proceso o de un script. Sirve como clave de cache:
+    si la versión no cambió, el resultado cacheado sigue siendo válido.
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS data_versions (
+            tabla TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+    for tabla in VERSIONED_TABLES:
+        cur.execute("INSERT OR IGNORE INTO data_versions (tabla, version) VALUES (?, 0)", (tabla,))
+        for evento in ("INSERT", "UPDATE", "DELETE"):
+            cur.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {tabla}_version_{evento.lower()}
+                AFTER {evento} ON {tabla} BEGIN
+                    UPDATE data_versions SET version = version + 1 WHERE tabla = '{tabla}';
+                END
+            """)
+
+
+def data_version(cur, *tablas) -> tuple:
+    """Versiones actuales de las tablas pedidas, en el mismo orden."""
+    marcas = ", ".join("?" * len(tablas))
+    cur.execute(f"SELECT tabla, version FROM data_versions WHERE tabla IN ({marcas})", tablas)
+    versiones = {r[0]: r[1] for r in cur.fetchall()}
+    return tuple(versiones.get(t, 0) for t in tablas)
+
+
 def backfill_timestamps(cur):
     # Rellenar timestamps vacíos si existen
     for table, col in [
@@ -54,13 +744,88 @@ def backfill_timestamps(cur):
             )
 
 
+DATOS_VERSION = 1  # PRAGMA user_version; subirla al agregar un paso a normalizar_datos
+
+
+def normalizar_datos(cur):
+    """
+    Normalización de datos viejos (timestamps vacíos, valores fuera de los CHECK,
+    fechas no ISO). Son UPDATE sobre tablas completas: corren una sola vez por base y
+    quedan marcados en PRAGMA user_version. Después los datos los mantienen los CHECK
+    del esquema y la app, sin volver a recorrer caja_movimientos en cada migrate().
+    """
+    cur.execute("PRAGMA user_version")
+    if cur.fetchone()[0] >= DATOS_VERSION:
+        return
+
+    backfill_timestamps(cur)
+    normalize_caja_movimientos(cur)
+    normalize_caja_fechas(cur)
+    cur.execute(f"PRAGMA user_version = {DATOS_VERSION}")
+    print(f"✅ Datos normalizados (versión {DATOS_VERSION})")
+
+
+def normalize_caja_fechas(cur):
+    """
+    Deja 'fecha' en formato ISO 'YYYY-MM-DD HH:MM:SS' y 'dia' = date(fecha) cuando falta.
+    Con eso las consultas por rango comparan el texto directo (fecha >= ? AND fecha < ?)
+    y SQLite puede usar los índices en vez de evaluar date()/datetime() fila por fila.
+    """
+    cur.execute("""
+        UPDATE caja_movimientos
+        SET fecha = datetime(fecha)
+        WHERE datetime(fecha) IS NOT NULL AND fecha <> datetime(fecha)
+    """)
+    cur.execute("""
+        UPDATE caja_movimientos
+        SET dia = date(fecha)
+        WHERE (dia IS NULL OR TRIM(dia) = '') AND date(fecha) IS NOT NULL
+    """)
+
+
+def unify_caja_metodo(cur):
+    """
+    Paso único: 'metodo' queda como la única columna del método de pago.
+    La app antes escribía en 'medio' (y 'metodo' quedaba en su DEFAULT 'efectivo'),
+    así que donde 'medio' tiene un valor válido, ese manda. Luego 'medio' se elimina;
+    los lectores viejos tienen la vista caja_movimientos_compat.
+    """
+    if not column_exists(cur, "caja_movimientos", "medio"):
+        return
+
+    cur.execute("""
+        UPDATE caja_movimientos
+        SET metodo = LOWER(TRIM(medio))
+        WHERE LOWER(TRIM(medio)) IN ('efectivo','banco') AND metodo IS NOT LOWER(TRIM(medio))
+    """)
+
+    # DROP COLUMN necesita SQLite 3.35+; en versiones viejas la columna queda sin uso
+    if sqlite3.sqlite_version_info >= (3, 35, 0):
+        # Los triggers/vistas que nombran 'medio' impedirían el DROP
+        drop_caja_saldos_triggers(cur)
+        cur.execute("DROP VIEW IF EXISTS caja_movimientos_compat")
+        cur.execute("ALTER TABLE caja_movimientos DROP COLUMN medio")
+        invalidate_schema("caja_movimientos")
+        print("✅ Columna unificada: caja_movimientos.medio -> metodo")
+
+
+def ensure_caja_compat_view(cur):
+    # Para código viejo que todavía lee 'medio'
+    cur.execute("""
+        CREATE VIEW IF NOT EXISTS caja_movimientos_compat AS
+        SELECT m.*, m.metodo AS medio
+        FROM caja_movimientos m
+    """)
+
+
 def normalize_caja_movimientos(cur):
     """
     Evita errores por CHECK:
       - tipo_mov debe ser 'ingreso' o 'egreso'
       - metodo debe ser 'efectivo' o 'banco'
       - enviado_matriz debe ser 0 o 1
-    Además, soporta compatibilidad: si existe 'medio'/'tipo', los alinea con 'metodo'/'tipo_mov'.
+    Además, soporta compatibilidad: si existe 'tipo', lo alinea con 'tipo_mov'
+    ('medio' ya no existe: ver unify_caja_metodo).
     """
     # Asegura valores válidos donde existan columnas
     if column_exists(cur, "caja_movimientos", "tipo_mov"):
@@ -84,33 +849,6 @@ def normalize_caja_movimientos(cur):
             WHERE enviado_matriz IS NULL OR enviado_matriz NOT IN (0,1)
         """)
 
-    # Compatibilidad: 'medio' <-> 'metodo'
-    has_medio = column_exists(cur, "caja_movimientos", "medio")
-    has_metodo = column_exists(cur, "caja_movimientos", "metodo")
-    if has_medio and has_metodo:
-        # Si metodo vacío, toma medio; si medio vacío, toma metodo
-        cur.execute("""
-            UPDATE caja_movimientos
-            SET metodo = COALESCE(NULLIF(TRIM(metodo), ''), medio)
-            WHERE metodo IS NULL OR TRIM(metodo) = ''
-        """)
-        cur.execute("""
-            UPDATE caja_movimientos
-            SET medio = COALESCE(NULLIF(TRIM(medio), ''), metodo)
-            WHERE medio IS NULL OR TRIM(medio) = ''
-        """)
-        # Asegura valores válidos
-        cur.execute("""
-            UPDATE caja_movimientos
-            SET medio = 'efectivo'
-            WHERE medio IS NULL OR TRIM(medio) = '' OR medio NOT IN ('efectivo','banco')
-        """)
-        cur.execute("""
-            UPDATE caja_movimientos
-            SET metodo = 'efectivo'
-            WHERE metodo IS NULL OR TRIM(metodo) = '' OR metodo NOT IN ('efectivo','banco')
-        """)
-
     # Compatibilidad: 'tipo' <-> 'tipo_mov'
     has_tipo = column_exists(cur, "caja_movimientos", "tipo")
     has_tipo_mov = column_exists(cur, "caja_movimientos", "tipo_mov")
@@ -268,8 +1006,7 @@ def migrate():
             -- Campos opcionales para banco (si luego los usas)
             comprobante TEXT,
             banco_nombre TEXT,
-            -- Compatibilidad por si tu app aún usa estos nombres:
-            medio TEXT,
+            -- Compatibilidad por si tu app aún usa este nombre:
             tipo TEXT
         )
         """)
@@ -288,24 +1025,32 @@ def migrate():
         add_column_if_missing(cur, "caja_movimientos", "comprobante", "comprobante TEXT")
         add_column_if_missing(cur, "caja_movimientos", "banco_nombre", "banco_nombre TEXT")
 
-        # Compatibilidad con código viejo que use "medio" o "tipo"
-        add_column_if_missing(cur, "caja_movimientos", "medio", "medio TEXT")
+        # Compatibilidad con código viejo que use "tipo" ("medio" se unificó en "metodo")
         add_column_if_missing(cur, "caja_movimientos", "tipo", "tipo TEXT")
 
-        # Backfill fechas vacías
-        backfill_timestamps(cur)
-
-        # Normaliza para no chocar con CHECK en runtime
-        normalize_caja_movimientos(cur)
+        # 'medio' -> 'metodo' y normalización de datos viejos (una sola vez cada uno)
+        unify_caja_metodo(cur)
+        normalizar_datos(cur)
 
         # Índices
         ensure_indexes(cur)
+        ensure_sku_unico(cur)
+        if ensure_caja_estado_unico(cur):
+            crear_dias_caja(cur)
+        ensure_stock_bajo(cur)
+        ensure_productos_fts(cur)
+        ensure_caja_saldos(cur)
+        ensure_caja_resumen(cur)
+        ensure_caja_compat_view(cur)
+        ensure_data_versions(cur)
 
         cur.execute("COMMIT;")
         print("✅ Migración completa (productos, movimientos, caja) con normalización y compatibilidad.")
 
     except Exception:
         cur.execute("ROLLBACK;")
+        # Lo cacheado dentro de la transacción ya no es confiable
+        invalidate_schema()
         raise
     finally:
         conn.close()
@@ -0,0 +1,296 @@
+"""
+Imágenes de productos (Pillow).
+
+Almacén por contenido:
+    Cada archivo subido se guarda por su hash SHA-256 en carpetas repartidas
+    (static/uploads/ab/cd/<hash>.<ext>). La misma foto subida dos veces ocupa un solo
+    archivo, y dos productos con el mismo nombre de archivo ya no se pisan la imagen.
+    productos.imagen_filename guarda esa ruta relativa; las referencias se cuentan
+    contra esa columna y los archivos sin referencias los elimina gc, nunca el request
+    (otro request puede estar reusando ese mismo archivo antes de su commit).
+
+Renditions:
+    Al subir una imagen se encola su procesamiento en un hilo aparte, que genera
+    versiones reducidas en WebP y JPEG dentro de static/uploads/r/:
+        thumb (listados), form (vista previa del formulario), full (vista completa)
+    Las plantillas eligen con srcset; mientras no existan, se usa el original.
+
+    python imagenes.py backfill   # renditions de las imágenes ya subidas
+    python imagenes.py migrar     # pasa las subidas viejas al almacén por contenido
+    python imagenes.py gc         # elimina archivos sin referencias
+"""
+import hashlib
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from PIL import Image, ImageOps
+
+RENDICIONES = {"thumb": 160, "form": 480, "full": 1280}  # ancho/alto máximo en px
+FORMATOS = {"webp": ("WEBP", {"quality": 80, "method": 4}),
+            "jpg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True})}
+CARPETA_R = "r"
+EXTENSIONES = ("png", "jpg", "jpeg", "webp")
+
+CHUNK = 64 * 1024
+GC_GRACIA = 3600  # s: no se borra lo recién subido (el producto puede no estar guardado aún)
+_RUTA_CONTENIDO = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.\w+$")
+
+_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="imagenes")
+
+
+# --------------------
+# ALMACÉN POR CONTENIDO
+# --------------------
+def es_de_contenido(filename: str) -> bool:
+    return bool(filename) and bool(_RUTA_CONTENIDO.match(filename))
+
+
+def _buscar_hash(uploads: str, digest: str):
+    carpeta = os.path.join(uploads, digest[:2], digest[2:4])
+    if os.path.isdir(carpeta):
+        for nombre in os.listdir(carpeta):
+            if nombre.startswith(digest + "."):
+                return f"{digest[:2]}/{digest[2:4]}/{nombre}"
+    return None
+
+
+def guardar_subida(stream, filename_original: str, uploads: str):
+    """
+    Guarda el archivo leyendo el stream por bloques (nunca completo en memoria)
+    mientras calcula el hash. Devuelve (ruta_relativa, es_nuevo).
+    """
+    ext = filename_original.rsplit(".", 1)[-1].lower()
+    sha = hashlib.sha256()
+    fd, tmp = tempfile.mkstemp(dir=uploads, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for bloque in iter(lambda: stream.read(CHUNK), b""):
+                sha.update(bloque)
+                out.write(bloque)
+
+        digest = sha.hexdigest()
+        existente = _buscar_hash(uploads, digest)
+        if existente:
+            os.remove(tmp)
+            # reusado recién: gc lo respeta GC_GRACIA más (el producto aún no se guardó)
+            os.utime(os.path.join(uploads, existente))
+            return existente, False
+
+        rel = f"{digest[:2]}/{digest[2:4]}/{digest}.{ext}"
+        destino = os.path.join(uploads, rel)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        os.replace(tmp, destino)
+        return rel, True
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def referencias(cur, filename: str) -> int:
+    cur.execute("SELECT COUNT(*) FROM productos WHERE imagen_filename=?", (filename,))
+    return cur.fetchone()[0]
+
+
+def borrar(uploads: str, filename: str):
+    """Elimina el archivo y sus renditions."""
+    rutas = [os.path.join(uploads, filename)]
+    rutas += [os.path.join(uploads, nombre_rendicion(filename, r, f)) for r in RENDICIONES for f in FORMATOS]
+    for ruta in rutas:
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+
+
+def gc(cur, uploads: str) -> int:
+    """Borra archivos del almacén sin ningún producto que los use. Devuelve cuántos."""
+    limite = time.time() - GC_GRACIA
+    borrados = 0
+    for rel in _archivos_de_contenido(uploads):
+        path = os.path.join(uploads, rel)
+        if os.path.getmtime(path) > limite or referencias(cur, rel):
+            continue
+        # una subida pudo reusarlo mientras se contaban las referencias
+        if os.path.getmtime(path) > limite:
+            continue
+        borrar(uploads, rel)
+        borrados += 1
+    return borrados
+
+
+def migrar(conn, uploads: str) -> int:
+    """
+    Pasa las imágenes con nombre viejo ({tipo}_{nombre}_{archivo}) al almacén por
+    contenido y reescribe productos.imagen_filename. Los duplicados quedan en un solo archivo.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT DISTINCT imagen_filename FROM productos WHERE imagen_filename IS NOT NULL AND imagen_filename <> ''")
+    viejos = [r[0] for r in cur.fetchall() if not es_de_contenido(r[0])]
+
+    movidos = 0
+    for viejo in viejos:
+        path = os.path.join(uploads, viejo)
+        if not os.path.isfile(path):
+            print(f"⚠ {viejo}: el archivo no existe, se deja igual")
+            continue
+        with open(path, "rb") as f:
+            rel, nuevo = guardar_subida(f, viejo, uploads)
+
+        cur.execute("UPDATE productos SET imagen_filename=? WHERE imagen_filename=?", (rel, viejo))
+        conn.commit()
+        borrar(uploads, viejo)
+        if nuevo:
+            _generar_seguro(uploads, rel)
+        movidos += 1
+        print(f" - {viejo} -> {rel}{'' if nuevo else ' (duplicado)'}")
+    return movidos
+
+
+def _archivos_de_contenido(uploads: str):
+    for a in os.listdir(uploads):
+        pa = os.path.join(uploads, a)
+        if len(a) != 2 or not os.path.isdir(pa):
+            continue
+        for b in os.listdir(pa):
+            pb = os.path.join(pa, b)
+            if not os.path.isdir(pb):
+                continue
+            for nombre in os.listdir(pb):
+                rel = f"{a}/{b}/{nombre}"
+                if es_de_contenido(rel):
+                    yield rel
+
+
+# --------------------
+# RENDITIONS
+# --------------------
+def nombre_rendicion(filename: str, rendicion: str, formato: str) -> str:
+    return f"{CARPETA_R}/{filename}_{rendicion}.{formato}"
+
+
+def generar(uploads: str, filename: str) -> int:
+    """Genera todas las renditions de un archivo. Devuelve cuántas escribió."""
+    path = os.path.join(uploads, filename)
+    mtime = os.stat(path).st_mtime_ns
+
+    escritas = 0
+    with Image.open(path) as img:
+        # JPEG: decodifica directo a menor escala (mucho más rápido que abrir a tamaño completo)
+        img.draft("RGB", (max(RENDICIONES.values()),) * 2)
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            fondo = Image.new("RGB", img.size, "white")
+            fondo.paste(img, mask=img.convert("RGBA").getchannel("A"))
+            img = fondo
+
+        # de mayor a menor: cada reducción parte de la anterior
+        actual = img
+        for rendicion, lado in sorted(RENDICIONES.items(), key=lambda kv: -kv[1]):
+            actual = actual.copy()
+            actual.thumbnail((lado, lado), Image.LANCZOS)
+            for formato, (pil_fmt, opciones) in FORMATOS.items():
+                destino = os.path.join(uploads, nombre_rendicion(filename, rendicion, formato))
+                if os.path.exists(destino) and os.stat(destino).st_mtime_ns >= mtime:
+                    continue
+                os.makedirs(os.path.dirname(destino), exist_ok=True)
+                tmp = destino + ".tmp"
+                actual.convert("RGB").save(tmp, pil_fmt, **opciones)
+                os.replace(tmp, destino)
+                escritas += 1
+    return escritas
+
+
+def _generar_seguro(uploads: str, filename: str):
+    try:
+        generar(uploads, filename)
+    except Exception as e:
+        # imagen corrupta o formato raro: se sigue usando el original
+        print(f"⚠ No se pudieron generar renditions de {filename}: {e}")
+
+
+def encolar(uploads: str, filename: str):
+    """Procesa la imagen en segundo plano (no bloquea el request del formulario)."""
+    _pool.submit(_generar_seguro, uploads, filename)
+
+
+# --------------------
+# HELPERS DE PLANTILLA
+# --------------------
+def _existe(filename: str, rendicion: str, formato: str) -> bool:
+    uploads = os.path.join(current_app.static_folder, "uploads")
+    return os.path.exists(os.path.join(uploads, nombre_rendicion(filename, rendicion, formato)))
+
+
+def imagen_url(filename: str, rendicion: str = "thumb", formato: str = "jpg") -> str:
+    """URL de la rendition si ya existe; si no, la del original."""
+    static_url = current_app.jinja_env.globals["static_url"]
+    if filename and _existe(filename, rendicion, formato):
+        return static_url("uploads/" + nombre_rendicion(filename, rendicion, formato))
+    return static_url("uploads/" + filename)
+
+
+def imagen_srcset(filename: str, formato: str = "jpg", rendiciones=("thumb", "form")) -> str:
+    """'url 160w, url 480w' con las renditions disponibles ('' si aún no hay)."""
+    static_url = current_app.jinja_env.globals["static_url"]
+    partes = [
+        f"{static_url('uploads/' + nombre_rendicion(filename, r, formato))} {RENDICIONES[r]}w"
+        for r in rendiciones
+        if filename and _existe(filename, r, formato)
+    ]
+    return ", ".join(partes)
+
+
+def init_app(app):
+    app.jinja_env.globals["imagen_url"] = imagen_url
+    app.jinja_env.globals["imagen_srcset"] = imagen_srcset
+
+
+def backfill(uploads: str) -> int:
+    total = 0
+    for raiz, dirs, archivos in os.walk(uploads):
+        if raiz == uploads and CARPETA_R in dirs:
+            dirs.remove(CARPETA_R)
+        for nombre in sorted(archivos):
+            if nombre.rsplit(".", 1)[-1].lower() not in EXTENSIONES:
+                continue
+            rel = os.path.relpath(os.path.join(raiz, nombre), uploads).replace(os.sep, "/")
+            try:
+                n = generar(uploads, rel)
+            except Exception as e:
+                print(f"⚠ {rel}: {e}")
+                continue
+            total += n
+            print(f" - {rel}: {n} rendition(s)")
+    return total
+
+
+if __name__ == "__main__":
+    import db
+
+    USO = "Uso: python imagenes.py backfill | migrar | gc"
+    accion = sys.argv[1] if len(sys.argv) > 1 else "backfill"
+    carpeta = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "uploads")
+
+    if accion == "backfill":
+        print(f"✅ {backfill(carpeta)} rendition(s) generadas en {carpeta}/{CARPETA_R}")
+    elif accion == "migrar":
+        conn = db.db_conn()
+        try:
+            print(f"✅ {migrar(conn, carpeta)} imagen(es) pasadas al almacén por contenido")
+        finally:
+            conn.close()
+    elif accion == "gc":
+        conn = db.db_conn()
+        try:
+            print(f"✅ {gc(conn.cursor(), carpeta)} archivo(s) huérfano(s) eliminados")
+        finally:
+            conn.close()
+    else:
+        print(USO)
+        sys.exit(2)
@@ -0,0 +1,343 @@
+"""
+Importación masiva de productos desde CSV o Excel (.xlsx).
+
+El archivo se lee fila por fila (csv.reader / openpyxl read_only, nunca completo en
+memoria), se valida contra las categorías y unidades del catálogo y se hace upsert por
+sku en lotes de executemany: un lote = una transacción.
+- sku nuevo: se inserta (con stock_actual si viene en el archivo)
+- sku existente: se actualizan solo las columnas presentes en el archivo; el stock no
+  se toca (se mueve con el libro de inventario.py)
+Las filas con errores (también las que rechaza la base: CHECK, UNIQUE...) se saltan y
+se informan con su número de fila.
+
+    python importar.py proveedor.xlsx --tipo insumo [--errores errores.csv]
+
+Columnas reconocidas (encabezado en la primera fila, sin importar mayúsculas/tildes):
+tipo, sku, nombre, categoria, unidad, precio, stock_actual, stock_min, activo
+"""
+import csv
+import io
+import json
+import sqlite3
+import sys
+import unicodedata
+import zipfile
+from functools import lru_cache
+
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+
+from db import SKU_UNICO_WHERE, begin_immediate
+
+COLUMNAS = ("tipo", "sku", "nombre", "categoria", "unidad", "precio", "stock_actual", "stock_min", "activo")
+# columnas que un sku existente no cambia al reimportar
+NO_ACTUALIZABLES = ("sku", "stock_actual")
+ALIAS = {
+    "codigo": "sku", "cod": "sku",
+    "producto": "nombre", "descripcion": "nombre",
+    "stock": "stock_actual", "existencia": "stock_actual",
+    "minimo": "stock_min", "stock minimo": "stock_min",
+    "precio unitario": "precio",
+}
+TIPOS = ("maquina", "insumo")
+LOTE = 10_000
+ERRORES_MAX = 1000  # detalle guardado (el conteo sigue aunque se pase)
+
+
+class ImportacionError(ValueError):
+    """El archivo no se puede importar (formato, encabezado o índice de sku)."""
+
+
+@lru_cache(maxsize=4096)  # categorías/unidades/tipos se repiten en casi todas las filas
+def _plano(s) -> str:
+    s = unicodedata.normalize("NFKD", str(s or "")).encode("ascii", "ignore").decode()
+    return " ".join(s.lower().replace("_", " ").split())
+
+
+def _columna(encabezado) -> str:
+    h = _plano(encabezado)
+    return ALIAS.get(h, h.replace(" ", "_"))
+
+
+# --------------------
+# LECTURA (streaming)
+# --------------------
+def leer_csv(stream, encoding="utf-8-sig"):
+    texto = io.TextIOWrapper(stream, encoding=encoding, newline="")
+    try:
+        primera = texto.readline()
+        # Excel en español guarda el CSV con ';'
+        delimitador = ";" if primera.count(";") > primera.count(",") else ","
+        yield next(csv.reader([primera], delimiter=delimitador))
+        yield from csv.reader(texto, delimiter=delimitador)
+    except UnicodeDecodeError:
+        raise ImportacionError(f"El CSV no está en {encoding}: guárdelo como 'CSV UTF-8'.")
+
+
+def leer_xlsx(stream):
+    try:
+        wb = load_workbook(stream, read_only=True, data_only=True)
+    except (zipfile.BadZipFile, InvalidFileException, KeyError):
+        raise ImportacionError("El archivo no es un .xlsx válido (¿dañado o renombrado?).")
+    try:
+        for fila in wb.active.iter_rows(values_only=True):
+            yield ["" if v is None else v for v in fila]
+    except zipfile.BadZipFile:
+        raise ImportacionError("El .xlsx está dañado.")
+    finally:
+        wb.close()
+
+
+def leer(stream, filename: str):
+    ext = filename.rsplit(".", 1)[-1].lower()
+    if ext == "csv":
+        return leer_csv(stream)
+    if ext == "xlsx":
+        return leer_xlsx(stream)
+    raise ImportacionError("Formato no soportado (use .csv o .xlsx).")
+
+
+# --------------------
+# VALIDACIÓN
+# --------------------
+def _numero(v, tipo, campo):
+    if v == "" or v is None:
+        return None
+    if isinstance(v, (int, float)):
+        n = v
+    else:
+        s = str(v).strip().replace(" ", "")
+        if "," in s and "." not in s:
+            s = s.replace(",", ".")  # 12,50
+        try:
+            n = float(s)
+        except ValueError:
+            raise ValueError(f"{campo} inválido: {v!r}")
+    if tipo is int:
+        if n != int(n):
+            raise ValueError(f"{campo} debe ser entero: {v!r}")
+        n = int(n)
+    if n < 0:
+        raise ValueError(f"{campo} no puede ser negativo")
+    return n
+
+
+def _activo(v):
+    s = _plano(v)
+    if s in ("", "1", "si", "s", "true", "activo", "x"):
+        return 1
+    if s in ("0", "no", "n", "false", "inactivo"):
+        return 0
+    raise ValueError(f"activo inválido: {v!r}")
+
+
+def _validos(categorias: dict, unidades):
+    """Tablas de búsqueda (texto normalizado -> valor del catálogo), armadas una vez por archivo."""
+    return (
+        {tipo: {_plano(c): c for c in cats} for tipo, cats in categorias.items()},
+        {_plano(u): u for u in unidades},
+    )
+
+
+def validar_fila(d: dict, tipo_defecto, validos) -> dict:
+    """Fila cruda (columna -> valor) a valores listos para el upsert. Lanza ValueError."""
+    categorias, unidades = validos
+    sku = str(d.get("sku", "")).strip()
+    if sku.endswith(".0") and isinstance(d.get("sku"), float):
+        sku = sku[:-2]  # Excel guarda los códigos numéricos como float
+    nombre = str(d.get("nombre", "")).strip()
+    if not sku:
+        raise ValueError("sku obligatorio")
+    if not nombre:
+        raise ValueError("nombre obligatorio")
+
+    tipo = _plano(d.get("tipo", "")) or tipo_defecto
+    if tipo not in TIPOS:
+        raise ValueError(f"tipo inválido: {d.get('tipo')!r} (maquina/insumo)")
+
+    fila = {"tipo": tipo, "sku": sku, "nombre": nombre}
+
+    if "categoria" in d:
+        validas = categorias[tipo]
+        cat = _plano(d["categoria"])
+        if cat and cat not in validas:
+            raise ValueError(f"categoría {d['categoria']!r} no existe para {tipo}")
+        fila["categoria"] = validas.get(cat, "")
+
+    if "unidad" in d:
+        validas = unidades
+        un = _plano(d["unidad"])
+        if un and un not in validas:
+            raise ValueError(f"unidad {d['unidad']!r} no válida")
+        fila["unidad"] = validas.get(un, "unidad")
+
+    for campo, tipo_num in (("precio", float), ("stock_actual", int), ("stock_min", int)):
+        if campo in d:
+            fila[campo] = _numero(d[campo], tipo_num, campo) or 0
+    if "activo" in d:
+        fila["activo"] = _activo(d["activo"])
+    return fila
+
+
+# --------------------
+# UPSERT
+# --------------------
+def _sql_upsert(en_archivo):
+    """INSERT ... ON CONFLICT(sku) DO UPDATE solo de las columnas que trae el archivo."""
+    cols = [c for c in COLUMNAS if c in en_archivo or c == "tipo"]  # tipo: el del archivo o el por defecto
+    actualizar = [c for c in cols if c in en_archivo and c not in NO_ACTUALIZABLES]
+    sql = f"""
+        INSERT INTO productos ({", ".join(cols)})
+        VALUES ({", ".join("?" * len(cols))})
+        ON CONFLICT(sku) WHERE {SKU_UNICO_WHERE}
+    """
+    if actualizar:
+        # sin cambios reales no se escribe (ni se disparan triggers de FTS/versiones)
+        sql += f"""
+        DO UPDATE SET {", ".join(f"{c}=excluded.{c}" for c in actualizar)}
+        WHERE {" OR ".join(f"productos.{c} IS NOT excluded.{c}" for c in actualizar)}
+        """
+    else:
+        sql += " DO NOTHING"
+    return sql, cols
+
+
+def _error(resultado, numero, sku, mensaje):
+    resultado["total_errores"] += 1
+    if len(resultado["errores"]) < ERRORES_MAX:
+        resultado["errores"].append((numero, sku, mensaje))
+
+
+def _aplicar_lote(conn, sql, cols, lote, resultado):
+    """
+    `lote`: [(numero_fila, fila), ...]. Todo en un executemany; si alguna fila viola
+    una restricción (CHECK, UNIQUE...), el lote se rehace fila por fila con un
+    SAVEPOINT cada una: esa queda como error y el resto se importa igual.
+    """
+    skus = list({f["sku"] for _, f in lote})
+    cur = conn.cursor()
+    begin_immediate(cur)
+    try:
+        cur.execute("SELECT sku FROM productos WHERE sku IN (SELECT value FROM json_each(?))",
+                    (json.dumps(skus),))
+        existentes = {r[0] for r in cur.fetchall()}
+        try:
+            cur.executemany(sql, [tuple(f[c] for c in cols) for _, f in lote])
+        except sqlite3.IntegrityError:
+            conn.rollback()
+            begin_immediate(cur)
+            _aplicar_filas(cur, sql, cols, lote, existentes, resultado)
+        else:
+            cambios = cur.rowcount
+            nuevos = len(skus) - len(existentes)
+            resultado["nuevos"] += nuevos
+            resultado["actualizados"] += cambios - nuevos
+            resultado["sin_cambios"] += len(lote) - cambios
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def _aplicar_filas(cur, sql, cols, lote, existentes, resultado):
+    for numero, f in lote:
+        cur.execute("SAVEPOINT fila")
+        try:
+            cur.execute(sql, tuple(f[c] for c in cols))
+            cambio = cur.rowcount
+        except sqlite3.IntegrityError as e:
+            cur.execute("ROLLBACK TO fila")
+            cur.execute("RELEASE fila")
+            _error(resultado, numero, f["sku"], f"rechazada por la base: {e}")
+            continue
+        cur.execute("RELEASE fila")
+        if cambio == 0:
+            resultado["sin_cambios"] += 1
+        elif f["sku"] in existentes:
+            resultado["actualizados"] += 1
+        else:
+            resultado["nuevos"] += 1
+            existentes.add(f["sku"])
+
+
+def importar(conn, filas, tipo_defecto, categorias: dict, unidades) -> dict:
+    """
+    `filas`: iterable de listas (la primera es el encabezado), p. ej. leer(...).
+    `categorias`: {"maquina": [...], "insumo": [...]}.
+    Devuelve {"filas", "nuevos", "actualizados", "sin_cambios", "total_errores", "errores"}
+    con errores = [(numero_fila, sku, mensaje), ...].
+    """
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_productos_sku'").fetchone() is None:
+        raise ImportacionError("Falta el índice único de sku (hay skus repetidos): corríjalos y ejecute db.py.")
+
+    filas = iter(filas)
+    try:
+        encabezado = [_columna(h) for h in next(filas)]
+    except StopIteration:
+        raise ImportacionError("El archivo está vacío.")
+    if "sku" not in encabezado or "nombre" not in encabezado:
+        raise ImportacionError("El encabezado debe tener al menos las columnas sku y nombre.")
+
+    sql, cols = _sql_upsert(set(encabezado) & set(COLUMNAS))
+    validos = _validos(categorias, unidades)
+
+    resultado = {"filas": 0, "nuevos": 0, "actualizados": 0, "sin_cambios": 0, "total_errores": 0, "errores": []}
+    lote = []
+    for numero, valores in enumerate(filas, start=2):
+        if not any(str(v).strip() for v in valores):
+            continue  # fila vacía
+        resultado["filas"] += 1
+        d = {c: v for c, v in zip(encabezado, valores) if c in COLUMNAS}
+        try:
+            fila = validar_fila(d, tipo_defecto, validos)
+        except ValueError as e:
+            _error(resultado, numero, str(d.get("sku", "")), str(e))
+            continue
+
+        lote.append((numero, {c: fila.get(c) for c in cols}))
+        if len(lote) >= LOTE:
+            _aplicar_lote(conn, sql, cols, lote, resultado)
+            lote = []
+
+    if lote:
+        _aplicar_lote(conn, sql, cols, lote, resultado)
+    return resultado
+
+
+def escribir_errores(resultado, path):
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        w = csv.writer(f)
+        w.writerow(["fila", "sku", "error"])
+        w.writerows(resultado["errores"])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import db
+    from app import CATEGORIAS_MAQUINAS, CATEGORIAS_INSUMOS, UNIDADES
+
+    parser = argparse.ArgumentParser(description="Importa productos desde CSV/XLSX (upsert por sku).")
+    parser.add_argument("archivo")
+    parser.add_argument("--tipo", choices=TIPOS, default="insumo", help="tipo para filas sin columna tipo")
+    parser.add_argument("--errores", help="guardar el detalle de errores en este CSV")
+    args = parser.parse_args()
+
+    conn = db.db_conn()
+    try:
+        with open(args.archivo, "rb") as f:
+            r = importar(conn, leer(f, args.archivo), args.tipo,
+                         {"maquina": CATEGORIAS_MAQUINAS, "insumo": CATEGORIAS_INSUMOS}, UNIDADES)
+    except ImportacionError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+    print(f"✅ {r['filas']} fila(s): {r['nuevos']} nuevo(s), {r['actualizados']} actualizado(s), "
+          f"{r['sin_cambios']} sin cambios, {r['total_errores']} con error")
+    for numero, sku, error in r["errores"][:20]:
+        print(f" - fila {numero} ({sku}): {error}")
+    if args.errores and r["errores"]:
+        escribir_errores(r, args.errores)
+        print(f"Detalle de errores en {args.errores}")
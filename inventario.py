@@ -0,0 +1,130 @@
+"""
+Libro de movimientos de inventario.
+
+El stock nunca se sobrescribe: cada ingreso/egreso es un INSERT en `movimientos`
+más un UPDATE relativo (stock_actual = stock_actual ± cantidad) en la misma
+transacción BEGIN IMMEDIATE. Dos usuarios que mueven el mismo producto a la vez
+ya no se pisan, y el UPDATE lleva la guarda de stock negativo en el WHERE.
+
+    registrar(conn, producto_id, "egreso", 3, "Venta")      # un movimiento
+    registrar_lote(conn, [{"producto_id": 1, ...}, ...])    # cientos en una transacción
+"""
+from datetime import datetime
+
+from db import begin_immediate
+
+TIPOS = ("ingreso", "egreso")
+LOTE_MAX = 1000  # movimientos por llamada a registrar_lote
+
+
+class StockError(ValueError):
+    """Movimiento rechazado (producto inexistente, datos inválidos o stock insuficiente)."""
+
+    def __init__(self, mensaje: str, fila: int = None):
+        super().__init__(mensaje)
+        self.fila = fila
+
+
+def validar(producto_id, tipo_mov, cantidad, motivo=None):
+    """Normaliza un movimiento; lanza StockError si no es válido."""
+    try:
+        producto_id = int(producto_id)
+        cantidad = int(cantidad)
+    except (TypeError, ValueError):
+        raise StockError("Producto o cantidad inválidos.")
+
+    tipo_mov = (tipo_mov or "").strip().lower()
+    if tipo_mov not in TIPOS:
+        raise StockError("Tipo de movimiento inválido (ingreso/egreso).")
+    if cantidad <= 0:
+        raise StockError("La cantidad debe ser mayor que cero.")
+
+    motivo = (motivo or "").strip() or None
+    return producto_id, tipo_mov, cantidad, motivo
+
+
+def _aplicar(cur, producto_id, tipo_mov, cantidad):
+    """UPDATE relativo con guarda de stock negativo. Devuelve el stock resultante."""
+    delta = cantidad if tipo_mov == "ingreso" else -cantidad
+    cur.execute("""
+        UPDATE productos
+        SET stock_actual = stock_actual + ?
+        WHERE id = ? AND stock_actual + ? >= 0
+    """, (delta, producto_id, delta))
+    aplicado = cur.rowcount == 1
+
+    cur.execute("SELECT nombre, stock_actual FROM productos WHERE id=?", (producto_id,))
+    p = cur.fetchone()
+    if p is None:
+        raise StockError(f"El producto {producto_id} no existe.")
+    if not aplicado:
+        raise StockError(f"Stock insuficiente para '{p['nombre']}': hay {p['stock_actual']}, se piden {cantidad}.")
+    return p["stock_actual"]
+
+
+def _transaccion(conn, trabajo):
+    """
+    Ejecuta `trabajo(cur)` dentro de BEGIN IMMEDIATE: el lock de escritura se toma al
+    empezar (no a mitad de camino), así no hay 'database is locked' por upgrade de lock.
+    """
+    cur = conn.cursor()
+    begin_immediate(cur)
+    try:
+        resultado = trabajo(cur)
+        conn.commit()
+        return resultado
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def registrar(conn, producto_id, tipo_mov, cantidad, motivo=None) -> int:
+    """Registra un movimiento y devuelve el stock nuevo del producto."""
+    producto_id, tipo_mov, cantidad, motivo = validar(producto_id, tipo_mov, cantidad, motivo)
+    fecha = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def trabajo(cur):
+        stock = _aplicar(cur, producto_id, tipo_mov, cantidad)
+        cur.execute("""
+            INSERT INTO movimientos (producto_id, tipo_mov, cantidad, motivo, fecha)
+            VALUES (?, ?, ?, ?, ?)
+        """, (producto_id, tipo_mov, cantidad, motivo, fecha))
+        return stock
+
+    return _transaccion(conn, trabajo)
+
+
+def registrar_lote(conn, movimientos) -> int:
+    """
+    Aplica una lista de movimientos (dicts con producto_id, tipo_mov, cantidad, motivo)
+    en una sola transacción, en orden. Todo o nada: si uno falla (p. ej. dejaría stock
+    negativo) no se aplica ninguno y StockError.fila indica cuál (desde 1).
+    Devuelve cuántos se aplicaron.
+    """
+    if len(movimientos) > LOTE_MAX:
+        raise StockError(f"Máximo {LOTE_MAX} movimientos por lote.")
+
+    filas = []
+    for i, m in enumerate(movimientos, start=1):
+        try:
+            if not isinstance(m, dict):
+                raise StockError("Formato inválido.")
+            filas.append(validar(m.get("producto_id"), m.get("tipo_mov"), m.get("cantidad"), m.get("motivo")))
+        except StockError as e:
+            raise StockError(f"Fila {i}: {e}", fila=i)
+
+    fecha = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def trabajo(cur):
+        for i, (producto_id, tipo_mov, cantidad, _) in enumerate(filas, start=1):
+            try:
+                _aplicar(cur, producto_id, tipo_mov, cantidad)
+            except StockError as e:
+                raise StockError(f"Fila {i}: {e}", fila=i)
+        cur.executemany("""
+            INSERT INTO movimientos (producto_id, tipo_mov, cantidad, motivo, fecha)
+            VALUES (?, ?, ?, ?, ?)
+        """, [f + (fecha,) for f in filas])
+        return len(filas)
+
+    return _transaccion(conn, trabajo)
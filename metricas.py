@@ -0,0 +1,166 @@
+"""
+Métricas en formato de texto de Prometheus (GET /metrics), sin servicios externos.
+
+Cada hilo suma en sus propios contadores (un dict que solo escribe ese hilo: sin
+locks en el camino del request). Al hacer scrape se suman los de todos los hilos;
+los de hilos que ya terminaron se acumulan aparte para no perderlos.
+
+    sumar("miken_requests_total", endpoint="dashboard", status="200")
+    observar("miken_request_segundos", 0.042, endpoint="dashboard")
+
+Las métricas son por proceso: con varios workers de gunicorn cada scrape lo responde
+uno de ellos (para series completas, un solo worker con más threads).
+"""
+import threading
+from bisect import bisect_left
+
+# límites superiores (segundos) de los buckets de los histogramas
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+HILOS_MAX = 256  # registros antes de juntar los de hilos terminados
+
+AYUDA = {
+    "miken_requests_total": ("counter", "Requests atendidos por endpoint, método y status."),
+    "miken_request_segundos": ("histogram", "Duración de los requests (sin el cuerpo en streaming)."),
+    "miken_db_consultas_total": ("counter", "Sentencias SQL ejecutadas por endpoint (perfil.py)."),
+    "miken_db_segundos_total": ("counter", "Tiempo en SQLite por endpoint, lecturas incluidas (perfil.py)."),
+    "miken_db_espera_lock_segundos": ("histogram", "Espera del BEGIN IMMEDIATE por el lock de escritura (busy_timeout)."),
+    "miken_db_bloqueos_total": ("counter", "Errores 'database is locked/busy' (se agotó busy_timeout)."),
+    "miken_db_conexiones_total": ("counter", "Conexiones del pool abiertas y reusadas."),
+    "miken_db_conexiones_abiertas": ("gauge", "Conexiones del pool abiertas en este proceso."),
+    "miken_subidas_bytes_total": ("counter", "Bytes recibidos en formularios con archivos."),
+    "miken_caja_lotes_total": ("counter", "Transacciones del escritor de caja (caja_escritor.py)."),
+    "miken_caja_movimientos_total": ("counter", "Movimientos de caja confirmados en lote (movimientos / lotes = tamaño medio)."),
+    "miken_cache_vistas_total": ("counter", "Consultas al cache de páginas por resultado (respuestas_cache.py)."),
+    "miken_cache_vistas_entradas": ("gauge", "Páginas guardadas en el cache."),
+}
+
+
+class _Contadores:
+    __slots__ = ("hilo", "valores", "histogramas")
+
+    def __init__(self, hilo):
+        self.hilo = hilo
+        self.valores = {}      # (nombre, labels) -> número
+        self.histogramas = {}  # (nombre, labels) -> [cuenta por bucket..., +Inf, suma]
+
+
+_local = threading.local()
+_lock = threading.Lock()  # solo para registrar hilos y para el scrape
+_hilos = []
+_terminados = _Contadores(None)
+_colectores = []  # funciones que devuelven [(nombre, labels, valor), ...] al hacer scrape
+
+
+def _propios() -> _Contadores:
+    c = getattr(_local, "contadores", None)
+    if c is None:
+        c = _local.contadores = _Contadores(threading.current_thread())
+        with _lock:
+            if len(_hilos) >= HILOS_MAX:
+                _juntar_terminados()
+            _hilos.append(c)
+    return c
+
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def sumar(nombre: str, valor=1, **labels):
+    v = _propios().valores
+    clave = (nombre, _labels(labels))
+    v[clave] = v.get(clave, 0) + valor
+
+
+def observar(nombre: str, valor: float, **labels):
+    h = _propios().histogramas
+    clave = (nombre, _labels(labels))
+    cuentas = h.get(clave)
+    if cuentas is None:
+        cuentas = h[clave] = [0] * (len(BUCKETS) + 2)
+    cuentas[bisect_left(BUCKETS, valor)] += 1
+    cuentas[-1] += valor
+
+
+def colector(funcion):
+    """Registra una función que da valores calculados al momento del scrape (gauges)."""
+    _colectores.append(funcion)
+    return funcion
+
+
+# --------------------
+# SCRAPE
+# --------------------
+def _sumar_en(destino: _Contadores, origen: _Contadores):
+    # dict(...) copia sin soltar el GIL: el hilo dueño puede seguir escribiendo
+    for clave, valor in dict(origen.valores).items():
+        destino.valores[clave] = destino.valores.get(clave, 0) + valor
+    for clave, cuentas in dict(origen.histogramas).items():
+        acumuladas = destino.histogramas.setdefault(clave, [0] * (len(BUCKETS) + 2))
+        for i, n in enumerate(list(cuentas)):
+            acumuladas[i] += n
+
+
+def _juntar_terminados():
+    """Pasa a _terminados los contadores de hilos que ya no existen (con _lock tomado)."""
+    vivos = []
+    for c in _hilos:
+        if c.hilo.is_alive():
+            vivos.append(c)
+        else:
+            _sumar_en(_terminados, c)
+    _hilos[:] = vivos
+
+
+def valores() -> _Contadores:
+    """Suma de todos los hilos."""
+    total = _Contadores(None)
+    with _lock:
+        _juntar_terminados()
+        _sumar_en(total, _terminados)
+        for c in _hilos:
+            _sumar_en(total, c)
+    return total
+
+
+def valor(nombre: str, **labels):
+    """Valor actual de un contador (suma de todos los hilos)."""
+    return valores().valores.get((nombre, _labels(labels)), 0)
+
+
+def _escapar(v) -> str:
+    return str(v).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+
+def _serie(nombre, labels, valor) -> str:
+    if labels:
+        nombre += "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in labels) + "}"
+    return f"{nombre} {valor}"
+
+
+def exposicion() -> str:
+    """Texto para /metrics (text/plain; version=0.0.4)."""
+    total = valores()
+    for funcion in _colectores:
+        for nombre, labels, valor in funcion():
+            total.valores[(nombre, _labels(labels))] = valor
+
+    series = {}
+    for (nombre, labels), valor in sorted(total.valores.items()):
+        series.setdefault(nombre, []).append(_serie(nombre, labels, valor))
+    for (nombre, labels), cuentas in sorted(total.histogramas.items()):
+        lineas = series.setdefault(nombre, [])
+        acumulado = 0
+        for limite, n in zip(BUCKETS + ("+Inf",), cuentas):
+            acumulado += n
+            lineas.append(_serie(f"{nombre}_bucket", labels + (("le", limite),), acumulado))
+        lineas.append(_serie(f"{nombre}_sum", labels, float(cuentas[-1])))
+        lineas.append(_serie(f"{nombre}_count", labels, acumulado))
+
+    salida = []
+    for nombre in sorted(series):
+        tipo, ayuda = AYUDA.get(nombre, ("untyped", ""))
+        salida.append(f"# HELP {nombre} {ayuda}")
+        salida.append(f"# TYPE {nombre} {tipo}")
+        salida.extend(series[nombre])
+    return "\n".join(salida) + "\n"
@@ -0,0 +1,308 @@
+"""
+Perfil de consultas por request.
+
+Mientras hay un request en curso, las conexiones del pool (db.PooledConnection)
+entregan cursores CursorPerfilado: cada sentencia queda registrada con su SQL, su
+duración (execute + lectura de las filas) y las filas devueltas o modificadas.
+Al terminar el request:
+- cabecera Server-Timing (db / app), visible en las DevTools del navegador
+- las sentencias que pasan de MIKEN_LENTA_MS van al log de consultas lentas con su
+  EXPLAIN QUERY PLAN
+- se suman a los agregados por endpoint y por sentencia que muestra /__perf
+
+Fuera de un request (scripts, benchmarks, hilos de PDF) los cursores son los de
+sqlite3 sin cambios. Los agregados son por proceso (cada worker de gunicorn los suyos).
+MIKEN_PERFIL=0 apaga todo.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import metricas
+
+ACTIVO = os.environ.get("MIKEN_PERFIL", "1") != "0"
+LENTA_MS = float(os.environ.get("MIKEN_LENTA_MS", 200))
+LOG_LENTAS = os.environ.get("MIKEN_LENTAS_LOG", "consultas_lentas.log")
+
+MUESTRAS = 500          # duraciones guardadas por endpoint (para p50/p95)
+SENTENCIAS_MAX = 500    # sentencias distintas en los agregados
+LENTAS_RECIENTES = 50   # las últimas que se muestran en /__perf
+
+_actual = threading.local()
+
+log_lentas = logging.getLogger("miken.lentas")
+log_lentas.propagate = False
+_handler = logging.FileHandler(LOG_LENTAS, encoding="utf-8", delay=True)  # el archivo se crea con la primera
+_handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+log_lentas.addHandler(_handler)
+log_lentas.setLevel(logging.INFO)
+
+
+class Consulta:
+    __slots__ = ("sql", "params", "ms", "filas")
+
+    def __init__(self, sql, params):
+        self.sql = sql
+        self.params = params
+        self.ms = 0.0
+        self.filas = 0
+
+
+class Perfil:
+    """Sentencias de un request."""
+
+    __slots__ = ("endpoint", "t0", "consultas", "diferido")
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.t0 = time.perf_counter()
+        self.consultas = []
+        self.diferido = False  # respuesta en streaming: se cierra al terminar de enviarla
+
+    def db_ms(self) -> float:
+        return sum(c.ms for c in self.consultas)
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.t0) * 1000
+
+
+def actual():
+    """Perfil del request en curso en este hilo (o None)."""
+    return getattr(_actual, "perfil", None)
+
+
+# --------------------
+# CURSOR INSTRUMENTADO
+# --------------------
+class CursorPerfilado(sqlite3.Cursor):
+    """
+    Mide execute y también las lecturas (fetch* / iteración): en SQLite la mayor
+    parte del trabajo de un SELECT ocurre al pedir las filas, no en el execute.
+    """
+
+    _consulta = None
+
+    def _ejecutar(self, metodo, sql, params, explicable=True):
+        c = Consulta(sql, params if explicable else None)
+        perfil = actual()
+        t0 = time.perf_counter()
+        try:
+            metodo(sql, params)
+        finally:
+            c.ms = (time.perf_counter() - t0) * 1000
+            if perfil is not None:
+                perfil.consultas.append(c)
+        if self.description is None:
+            c.filas = max(self.rowcount, 0)  # INSERT/UPDATE/DELETE: filas modificadas
+        self._consulta = c
+        return self
+
+    def execute(self, sql, parameters=()):
+        return self._ejecutar(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._ejecutar(super().executemany, sql, seq_of_parameters, explicable=False)
+
+    def executescript(self, script):
+        c = Consulta(script, None)
+        perfil = actual()
+        t0 = time.perf_counter()
+        try:
+            return super().executescript(script)
+        finally:
+            c.ms = (time.perf_counter() - t0) * 1000
+            if perfil is not None:
+                perfil.consultas.append(c)
+
+    def _leer(self, metodo, *args):
+        t0 = time.perf_counter()
+        try:
+            return metodo(*args)
+        finally:
+            if self._consulta is not None:
+                self._consulta.ms += (time.perf_counter() - t0) * 1000
+
+    def fetchone(self):
+        fila = self._leer(super().fetchone)
+        if fila is not None and self._consulta is not None:
+            self._consulta.filas += 1
+        return fila
+
+    def fetchmany(self, size=None):
+        filas = self._leer(super().fetchmany, self.arraysize if size is None else size)
+        if self._consulta is not None:
+            self._consulta.filas += len(filas)
+        return filas
+
+    def fetchall(self):
+        filas = self._leer(super().fetchall)
+        if self._consulta is not None:
+            self._consulta.filas += len(filas)
+        return filas
+
+    def __next__(self):
+        fila = self._leer(super().__next__)
+        if self._consulta is not None:
+            self._consulta.filas += 1
+        return fila
+
+
+def cursor_factory():
+    """Clase de cursor para una conexión del pool: la instrumentada solo dentro de un request."""
+    return CursorPerfilado if actual() is not None else sqlite3.Cursor
+
+
+# --------------------
+# AGREGADOS (/__perf)
+# --------------------
+_lock = threading.Lock()
+_endpoints = {}   # endpoint -> {"requests", "ms", "db_ms", "consultas", "max_ms", "max_consultas", "muestras"}
+_sentencias = {}  # sql -> {"veces", "ms", "filas", "max_ms"}
+_lentas = deque(maxlen=LENTAS_RECIENTES)
+
+
+def _sql_corto(sql: str) -> str:
+    return " ".join(sql.split())
+
+
+def _percentil(valores, p):
+    if not valores:
+        return 0.0
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+def _sumar(perfil, total_ms, db_ms):
+    with _lock:
+        e = _endpoints.get(perfil.endpoint)
+        if e is None:
+            e = _endpoints[perfil.endpoint] = {
+                "requests": 0, "ms": 0.0, "db_ms": 0.0, "consultas": 0,
+                "max_ms": 0.0, "max_consultas": 0, "muestras": deque(maxlen=MUESTRAS),
+            }
+        e["requests"] += 1
+        e["ms"] += total_ms
+        e["db_ms"] += db_ms
+        e["consultas"] += len(perfil.consultas)
+        e["max_ms"] = max(e["max_ms"], total_ms)
+        e["max_consultas"] = max(e["max_consultas"], len(perfil.consultas))
+        e["muestras"].append(total_ms)
+
+        for c in perfil.consultas:
+            sql = _sql_corto(c.sql)
+            s = _sentencias.get(sql)
+            if s is None:
+                if len(_sentencias) >= SENTENCIAS_MAX:
+                    continue
+                s = _sentencias[sql] = {"veces": 0, "ms": 0.0, "filas": 0, "max_ms": 0.0}
+            s["veces"] += 1
+            s["ms"] += c.ms
+            s["filas"] += c.filas
+            s["max_ms"] = max(s["max_ms"], c.ms)
+
+
+def resumen(top=30) -> dict:
+    """Agregados por endpoint (más lentos primero), sentencias más costosas y lentas recientes."""
+    with _lock:
+        endpoints = []
+        for nombre, e in _endpoints.items():
+            n = e["requests"]
+            endpoints.append({
+                "endpoint": nombre,
+                "requests": n,
+                "prom_ms": round(e["ms"] / n, 1),
+                "p50_ms": round(_percentil(e["muestras"], 0.50), 1),
+                "p95_ms": round(_percentil(e["muestras"], 0.95), 1),
+                "max_ms": round(e["max_ms"], 1),
+                "db_ms": round(e["db_ms"] / n, 1),
+                "consultas": round(e["consultas"] / n, 1),
+                "max_consultas": e["max_consultas"],
+            })
+        sentencias = [
+            {"sql": sql, "veces": s["veces"], "ms": round(s["ms"], 1),
+             "prom_ms": round(s["ms"] / s["veces"], 2), "max_ms": round(s["max_ms"], 1),
+             "filas": round(s["filas"] / s["veces"], 1)}
+            for sql, s in _sentencias.items()
+        ]
+        lentas = list(_lentas)
+
+    endpoints.sort(key=lambda e: e["prom_ms"] * e["requests"], reverse=True)
+    sentencias.sort(key=lambda s: s["ms"], reverse=True)
+    lentas.reverse()
+    return {"endpoints": endpoints, "sentencias": sentencias[:top], "lentas": lentas}
+
+
+def reiniciar():
+    with _lock:
+        _endpoints.clear()
+        _sentencias.clear()
+        _lentas.clear()
+
+
+# --------------------
+# CICLO DEL REQUEST
+# --------------------
+def iniciar(endpoint):
+    if ACTIVO:
+        _actual.perfil = Perfil(endpoint)
+
+
+def server_timing(perfil) -> str:
+    db_ms = perfil.db_ms()
+    app_ms = max(perfil.total_ms() - db_ms, 0.0)
+    return f'db;dur={db_ms:.1f};desc="{len(perfil.consultas)} consultas", app;dur={app_ms:.1f}'
+
+
+def plan(conn, sql, params) -> str:
+    """EXPLAIN QUERY PLAN como árbol indentado (o el error si no se puede explicar)."""
+    try:
+        filas = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params or ()).fetchall()
+    except sqlite3.Error as e:
+        return f"(sin plan: {e})"
+
+    nivel = {0: -1}
+    lineas = []
+    for id_, padre, _, detalle in filas:
+        nivel[id_] = nivel.get(padre, -1) + 1
+        lineas.append("  " * nivel[id_] + detalle)
+    return "\n".join(lineas)
+
+
+def _registrar_lentas(perfil, conexion):
+    conn = None
+    for c in perfil.consultas:
+        if c.ms < LENTA_MS:
+            continue
+        if conn is None:
+            conn = conexion()
+        detalle = plan(conn, c.sql, c.params) if c.params is not None else "(executemany/script: sin plan)"
+        params = repr(c.params)[:200] if c.params else ""
+        log_lentas.info("[%s] %.1f ms, %d fila(s)\n%s\nparams: %s\nplan:\n%s\n",
+                        perfil.endpoint, c.ms, c.filas, c.sql.strip(), params, detalle)
+        with _lock:
+            _lentas.append({
+                "fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "endpoint": perfil.endpoint, "ms": round(c.ms, 1), "filas": c.filas,
+                "sql": c.sql.strip(), "plan": detalle,
+            })
+
+
+def terminar(conexion, al_cerrar=False):
+    """
+    Cierra el perfil del hilo: suma a los agregados y registra las consultas lentas.
+    `conexion()` devuelve la conexión donde correr los EXPLAIN (solo se pide si hay lentas).
+    Un perfil diferido solo se cierra con al_cerrar=True (Response.call_on_close).
+    """
+    perfil = actual()
+    if perfil is None or (perfil.diferido and not al_cerrar):
+        return
+    _actual.perfil = None  # los EXPLAIN no se perfilan
+    db_ms = perfil.db_ms()
+    _sumar(perfil, perfil.total_ms(), db_ms)
+    metricas.sumar("miken_db_consultas_total", len(perfil.consultas), endpoint=perfil.endpoint)
+    metricas.sumar("miken_db_segundos_total", db_ms / 1000, endpoint=perfil.endpoint)
+    _registrar_lentas(perfil, conexion)
@@ -0,0 +1,213 @@
+"""
+Reportes PDF (ReportLab) generados en segundo plano.
+
+- Un pool de hilos arma los PDF fuera del hilo del request.
+- Las filas se leen del cursor por lotes y se agregan como tablas del tamaño de una
+  página (no una sola tabla gigante: platypus la partiría fila por fila).
+- Cada PDF queda en disco con clave (reporte, rango, versión de datos): si los datos
+  no cambiaron, el siguiente pedido se responde directo desde el cache. Quedan los
+  PDF_CACHE_MAX usados más recientemente.
+"""
+import glob
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import cm
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+import db
+
+PDF_CACHE_DIR = os.path.join(tempfile.gettempdir(), "miken_reportes")
+PDF_WORKERS = 2
+FILAS_POR_TABLA = 35  # ~ una página A4 horizontal
+PDF_CACHE_MAX = 50    # PDF guardados por base (cada rango de fechas es un archivo)
+TMP_VIEJO = 3600      # s; .tmp de generaciones interrumpidas
+
+_pool = ThreadPoolExecutor(max_workers=PDF_WORKERS, thread_name_prefix="pdf")
+_en_curso = {}
+_lock = threading.Lock()
+
+ESTILO_TABLA = TableStyle([
+    ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+    ("FONTSIZE", (0, 0), (-1, -1), 8),
+    ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#f1e4d3")),
+    ("GRID", (0, 0), (-1, -1), 0.25, colors.grey),
+    ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.white, colors.HexColor("#faf7f2")]),
+])
+
+
+# --------------------
+# DEFINICIÓN DE REPORTES
+# --------------------
+def _inventario(start, end):
+    return {
+        "titulo": "Reporte de Inventario",
+        "tabla_version": "productos",
+        "encabezado": ["Tipo", "SKU", "Nombre", "Categoría", "Unidad", "Precio", "Stock", "Mín", "Activo"],
+        "anchos": [2 * cm, 3 * cm, 7.5 * cm, 4 * cm, 2.5 * cm, 2 * cm, 1.8 * cm, 1.8 * cm, 1.6 * cm],
+        "numericas": [5, 6, 7],
+        "sql": """
+            SELECT COALESCE(tipo,''), COALESCE(sku,''), COALESCE(nombre,''), COALESCE(categoria,''),
+                   COALESCE(unidad,''), printf('%.2f', COALESCE(precio,0)), COALESCE(stock_actual,0),
+                   COALESCE(stock_min,0), CASE WHEN activo=1 THEN 'Sí' ELSE 'No' END
+            FROM productos
+            ORDER BY tipo, COALESCE(categoria,''), nombre
+        """,
+        "params": (),
+    }
+
+
+def _cierres(start, end):
+    return {
+        "titulo": f"Cierres de caja del {start} al {end}",
+        "tabla_version": "caja_cierres",
+        "encabezado": ["Día", "Fecha cierre", "Nota", "Ingresos", "Egresos", "Efectivo final"],
+        "anchos": [2.6 * cm, 3.8 * cm, 10 * cm, 3 * cm, 3 * cm, 3.2 * cm],
+        "numericas": [3, 4, 5],
+        "sql": """
+            SELECT dia, COALESCE(fecha,''), COALESCE(nota,''),
+                   printf('%.2f', total_ingresos), printf('%.2f', total_egresos),
+                   printf('%.2f', efectivo_final)
+            FROM caja_cierres
+            WHERE dia BETWEEN ? AND ?
+            ORDER BY dia, id
+        """,
+        "params": (start, end),
+    }
+
+
+REPORTES = {
+    "inventario": _inventario,
+    "cierres": _cierres,
+}
+
+
+# --------------------
+# GENERACIÓN
+# --------------------
+def _carpeta() -> str:
+    # Una subcarpeta por base de datos: las versiones de dos bases distintas no se mezclan
+    base = hashlib.sha1(os.path.abspath(db.DB_NAME).encode("utf-8")).hexdigest()[:10]
+    return os.path.join(PDF_CACHE_DIR, base)
+
+
+def _ruta(reporte: str, start: str, end: str, version: int) -> str:
+    return os.path.join(_carpeta(), f"{reporte}_{start or 'todo'}_{end or 'todo'}_v{version}.pdf")
+
+
+def _generar(conn, reporte: str, start: str, end: str, version: int, ruta: str):
+    spec = REPORTES[reporte](start, end)
+    estilos = getSampleStyleSheet()
+    celda = estilos["BodyText"].clone("celda", fontSize=8, leading=9)
+
+    story = [Paragraph(f"MIKEN – {escape(spec['titulo'])}", estilos["Title"]), Spacer(1, 0.3 * cm)]
+    # columnas numéricas a la derecha (cada reporte dice cuáles)
+    estilo = TableStyle(ESTILO_TABLA.getCommands()
+                        + [("ALIGN", (i, 1), (i, -1), "RIGHT") for i in spec["numericas"]])
+
+    cur = conn.cursor()
+    try:
+        cur.execute(spec["sql"], spec["params"])
+        while True:
+            rows = cur.fetchmany(FILAS_POR_TABLA)
+            if not rows:
+                break
+            data = [spec["encabezado"]]
+            # Paragraph interpreta <b>, & ...: el texto del usuario va escapado
+            data += [[Paragraph(escape(v), celda) if isinstance(v, str) and len(v) > 30 else v for v in r]
+                     for r in rows]
+            t = Table(data, colWidths=spec["anchos"], repeatRows=1)
+            t.setStyle(estilo)
+            story.append(t)
+    finally:
+        cur.close()
+
+    if len(story) == 2:
+        story.append(Paragraph("No hay registros.", estilos["BodyText"]))
+
+    carpeta = os.path.dirname(ruta)
+    os.makedirs(carpeta, exist_ok=True)
+    tmp = ruta + f".{threading.get_ident()}.tmp"
+    doc = SimpleDocTemplate(tmp, pagesize=landscape(A4), title=spec["titulo"],
+                            leftMargin=1.2 * cm, rightMargin=1.2 * cm, topMargin=1.2 * cm, bottomMargin=1.2 * cm)
+    doc.build(story)
+    os.replace(tmp, ruta)
+
+    # Versiones viejas del mismo reporte/rango ya no sirven
+    prefijo = os.path.basename(ruta).rsplit("_v", 1)[0]
+    for viejo in glob.glob(os.path.join(carpeta, f"{glob.escape(prefijo)}_v*.pdf")):
+        if viejo != ruta:
+            _borrar(viejo)
+    _limpiar(carpeta, ruta)
+    return ruta
+
+
+def _borrar(ruta: str):
+    try:
+        os.remove(ruta)
+    except OSError:
+        pass
+
+
+def _limpiar(carpeta: str, actual: str):
+    """
+    Acota el cache en disco: quedan los PDF_CACHE_MAX usados más recientemente
+    (cada rango pedido deja su archivo) y se borran los .tmp abandonados.
+    """
+    limite = time.time() - TMP_VIEJO
+    for tmp in glob.glob(os.path.join(carpeta, "*.tmp")):
+        try:
+            if os.path.getmtime(tmp) < limite:
+                _borrar(tmp)
+        except OSError:
+            pass
+
+    pdfs = []
+    for pdf in glob.glob(os.path.join(carpeta, "*.pdf")):
+        try:
+            pdfs.append((os.path.getmtime(pdf), pdf))
+        except OSError:
+            pass
+    pdfs.sort(reverse=True)
+    for _, pdf in pdfs[PDF_CACHE_MAX:]:
+        if pdf != actual:
+            _borrar(pdf)
+
+
+def _generar_en_worker(*args):
+    # Conexión propia del hilo worker; queda abierta para el siguiente PDF
+    conn = db.pooled_conn()
+    try:
+        return _generar(conn, *args)
+    finally:
+        db.release_conn(conn)
+
+
+def solicitar(reporte: str, start: str, end: str, version: int):
+    """
+    Devuelve (ruta, None) si el PDF ya está en cache, o (None, future) si quedó
+    encolado / en generación. Pedidos iguales comparten el mismo trabajo.
+    """
+    ruta = _ruta(reporte, start, end, version)
+    if os.path.exists(ruta):
+        try:
+            os.utime(ruta)  # usado recién: último en salir del cache
+        except OSError:
+            pass
+        return ruta, None
+
+    with _lock:
+        fut = _en_curso.get(ruta)
+        if fut is None:
+            fut = _pool.submit(_generar_en_worker, reporte, start, end, version, ruta)
+            _en_curso[ruta] = fut
+            fut.add_done_callback(lambda _f: _en_curso.pop(ruta, None))
+    return None, fut
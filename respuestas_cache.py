@@ -0,0 +1,66 @@
+"""
+Cache en memoria de páginas renderizadas (catálogo, stock bajo, dashboard).
+
+Clave = ruta + query string + usuario + día. Cada entrada guarda la versión de las
+tablas de las que depende (data_versions, mantenida por triggers en db.py): si alguna
+tabla cambió desde que se guardó, la entrada no sirve y la vista se vuelve a ejecutar.
+Así cualquier escritura (rutas de la app, importar.py, scripts, otro proceso) invalida
+sin que nadie tenga que acordarse de limpiar el cache.
+
+Acotado por cantidad de entradas (LRU) y por antigüedad (TTL).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+MAX_ENTRADAS = 256
+TTL = 300  # s
+
+
+class RespuestaCache:
+    def __init__(self, max_entradas: int = MAX_ENTRADAS, ttl: float = TTL):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._datos = OrderedDict()  # clave -> (expira, versiones, valor)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidadas": 0, "expiradas": 0, "descartadas": 0}
+
+    def get(self, clave, versiones):
+        """Valor cacheado si sigue vigente para estas versiones; si no, None."""
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                self._stats["misses"] += 1
+                return None
+
+            expira, guardadas, valor = entrada
+            if guardadas != versiones or expira < ahora:
+                del self._datos[clave]
+                self._stats["invalidadas" if guardadas != versiones else "expiradas"] += 1
+                self._stats["misses"] += 1
+                return None
+
+            self._datos.move_to_end(clave)
+            self._stats["hits"] += 1
+            return valor
+
+    def set(self, clave, versiones, valor):
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + self.ttl, versiones, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+                self._stats["descartadas"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            s["entradas"] = len(self._datos)
+        consultas = s["hits"] + s["misses"]
+        s["hit_ratio"] = round(s["hits"] / consultas, 3) if consultas else 0.0
+        return s
@@ -0,0 +1,142 @@
+"""
+Servidor de producción.
+
+Linux/macOS: gunicorn con varios procesos (workers) y varios hilos por proceso (gthread).
+    python servidor.py --workers 4 --threads 8 --bind 0.0.0.0:8000
+    kill -HUP $(cat miken.pid)      # reinicio elegante: workers nuevos, los viejos terminan sus requests
+    python servidor.py --reload     # lo mismo, usando el pid guardado
+
+Windows: waitress (un proceso, --threads hilos). --workers se ignora.
+
+SQLite en varios procesos:
+- WAL se activa una sola vez aquí antes de arrancar (queda guardado en el archivo),
+  así los workers no compiten por cambiar el journal_mode.
+- Cada worker arranca sin conexiones heredadas del proceso maestro (post_fork) y abre
+  una por hilo con busy_timeout (db.pooled_conn).
+- Los movimientos de caja los escribe un hilo por worker (caja_escritor.py);
+  worker_exit confirma lo que quede en cola antes de salir.
+- Los caches en memoria (páginas, totales) son por worker; se invalidan con data_versions,
+  que se ve igual desde todos los procesos.
+"""
+import argparse
+import os
+import signal
+import sqlite3
+import sys
+
+import caja_escritor
+import db
+
+PIDFILE = "miken.pid"
+
+
+def preparar_db():
+    conn = sqlite3.connect(db.DB_NAME)
+    conn.row_factory = sqlite3.Row
+    try:
+        modo = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        # filas de caja_estado de los próximos días (además del cron de caja_dias.py)
+        cur = conn.cursor()
+        if db.ensure_caja_estado_unico(cur):
+            db.crear_dias_caja(cur)
+        conn.commit()
+    finally:
+        conn.close()
+    if modo != "wal":
+        print(f"⚠ journal_mode={modo}: con varios workers se recomienda WAL")
+
+
+# --------------------
+# HOOKS DE GUNICORN (también sirven con: gunicorn -c servidor.py wsgi:app)
+# --------------------
+def post_fork(server, worker):
+    # Nada de conexiones SQLite compartidas entre procesos
+    db.close_pool()
+
+
+def worker_exit(server, worker):
+    # confirma los movimientos de caja que queden en cola antes de salir
+    caja_escritor.detener()
+    db.close_pool()
+
+
+def _gunicorn(args):
+    from gunicorn.app.base import BaseApplication
+
+    class Servidor(BaseApplication):
+        def load_config(self):
+            config = {
+                "bind": args.bind,
+                "workers": args.workers,
+                "threads": args.threads,
+                "worker_class": "gthread",
+                "keepalive": args.keepalive,
+                "timeout": args.timeout,
+                "graceful_timeout": args.timeout,
+                # reciclar workers cada tanto (fugas de memoria); el jitter evita que se reinicien todos juntos
+                "max_requests": args.max_requests,
+                "max_requests_jitter": args.max_requests // 10,
+                "pidfile": args.pidfile,
+                "accesslog": "-" if args.access_log else None,
+                "post_fork": post_fork,
+                "worker_exit": worker_exit,
+            }
+            for clave, valor in config.items():
+                self.cfg.set(clave, valor)
+
+        def load(self):
+            from wsgi import application
+            return application
+
+    Servidor().run()
+
+
+def _waitress(args):
+    from waitress import serve
+    from wsgi import application
+
+    host, _, port = args.bind.rpartition(":")
+    print(f"✅ waitress en http://{args.bind} ({args.threads} hilos)")
+    serve(application, host=host or "0.0.0.0", port=int(port), threads=args.threads,
+          channel_timeout=args.keepalive * 12)
+
+
+def recargar(pidfile):
+    try:
+        with open(pidfile) as f:
+            pid = int(f.read().strip())
+    except (OSError, ValueError):
+        print(f"❌ No se encontró el pid en {pidfile} (¿el servidor está corriendo?)")
+        sys.exit(1)
+    os.kill(pid, signal.SIGHUP)
+    print(f"✅ Reinicio elegante enviado al proceso {pid}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor de producción de MIKEN.")
+    parser.add_argument("--bind", default=os.environ.get("MIKEN_BIND", "0.0.0.0:8000"))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("MIKEN_WORKERS", os.cpu_count() or 1)),
+                        help="procesos (por defecto, uno por núcleo)")
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("MIKEN_THREADS", 8)),
+                        help="hilos por proceso")
+    parser.add_argument("--keepalive", type=int, default=5, help="segundos que se mantiene abierta una conexión ociosa")
+    parser.add_argument("--timeout", type=int, default=60, help="segundos máximos por request / para terminar al reiniciar")
+    parser.add_argument("--max-requests", type=int, default=5000, help="requests por worker antes de reciclarlo")
+    parser.add_argument("--pidfile", default=PIDFILE)
+    parser.add_argument("--access-log", action="store_true")
+    parser.add_argument("--reload", action="store_true", help="reinicio elegante del servidor en marcha")
+    args = parser.parse_args()
+
+    if args.reload:
+        recargar(args.pidfile)
+        return
+
+    preparar_db()
+    if os.name == "nt":
+        _waitress(args)
+    else:
+        _gunicorn(args)
+
+
+if __name__ == "__main__":
+    main()
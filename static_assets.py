@@ -0,0 +1,121 @@
+"""
+Archivos estáticos con cache largo:
+- static_url(): URL con huella del contenido (?v=<hash>); si el archivo cambia, cambia la URL,
+  así el navegador puede guardarlo "para siempre" (immutable).
+- servir_static(): reemplaza la vista 'static' de Flask; entrega variantes .br/.gz
+  precomprimidas si el cliente las acepta, con ETag/304 para revalidar.
+- precomprimir(): genera las variantes .gz (y .br si está instalado brotli) de CSS/JS.
+
+    python static_assets.py      # regenera las variantes precomprimidas
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import sys
+
+from flask import current_app, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:  # opcional
+    brotli = None
+
+CACHE_INMUTABLE = "public, max-age=31536000, immutable"
+CACHE_REVALIDAR = "public, max-age=0, must-revalidate"
+PRECOMPRIMIBLES = (".css", ".js", ".svg")
+
+_huellas = {}
+
+
+def huella(path: str) -> str:
+    """Hash corto del contenido; se recalcula solo si cambia el mtime/tamaño."""
+    st = os.stat(path)
+    clave = (path, st.st_mtime_ns, st.st_size)
+    h = _huellas.get(clave)
+    if h is None:
+        sha = hashlib.sha1()
+        with open(path, "rb") as f:
+            for bloque in iter(lambda: f.read(65536), b""):
+                sha.update(bloque)
+        h = sha.hexdigest()[:12]
+        _huellas[clave] = h
+    return h
+
+
+def static_url(filename: str) -> str:
+    """Para plantillas: {{ static_url('css/styles.css') }}."""
+    path = os.path.join(current_app.static_folder, filename)
+    try:
+        return url_for("static", filename=filename, v=huella(path))
+    except OSError:
+        return url_for("static", filename=filename)
+
+
+def servir_static(filename):
+    folder = current_app.static_folder
+    aceptadas = request.headers.get("Accept-Encoding", "")
+
+    resp = None
+    if filename.endswith(PRECOMPRIMIBLES):
+        original = os.path.join(folder, filename)
+        for ext, encoding in ((".br", "br"), (".gz", "gzip")):
+            variante = original + ext
+            if encoding in aceptadas and _vigente(variante, original):
+                resp = send_from_directory(folder, filename + ext, max_age=None)
+                resp.headers["Content-Encoding"] = encoding
+                resp.mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+                break
+
+    if resp is None:
+        resp = send_from_directory(folder, filename, max_age=None)
+
+    resp.vary.add("Accept-Encoding")
+    # Con huella en la URL el contenido nunca cambia; sin huella, revalida con ETag (304)
+    resp.headers["Cache-Control"] = CACHE_INMUTABLE if request.args.get("v") else CACHE_REVALIDAR
+    return resp
+
+
+def _vigente(variante: str, original: str) -> bool:
+    try:
+        return os.stat(variante).st_mtime_ns >= os.stat(original).st_mtime_ns
+    except OSError:
+        return False
+
+
+def precomprimir(folder: str) -> int:
+    """Crea/actualiza .gz (y .br) junto a cada CSS/JS. Devuelve cuántos archivos escribió."""
+    escritos = 0
+    for raiz, _dirs, archivos in os.walk(folder):
+        for nombre in archivos:
+            if not nombre.endswith(PRECOMPRIMIBLES):
+                continue
+            original = os.path.join(raiz, nombre)
+            with open(original, "rb") as f:
+                data = None
+                if not _vigente(original + ".gz", original):
+                    data = f.read()
+                    with open(original + ".gz", "wb") as out:
+                        out.write(gzip.compress(data, 9, mtime=0))
+                    escritos += 1
+                if brotli is not None and not _vigente(original + ".br", original):
+                    data = data if data is not None else f.read()
+                    with open(original + ".br", "wb") as out:
+                        out.write(brotli.compress(data))
+                    escritos += 1
+    return escritos
+
+
+def init_app(app):
+    app.view_functions["static"] = servir_static
+    app.jinja_env.globals["static_url"] = static_url
+    try:
+        precomprimir(app.static_folder)
+    except OSError as e:
+        # carpeta de solo lectura: se sirven los originales
+        print(f"⚠ No se pudieron precomprimir estáticos: {e}")
+
+
+if __name__ == "__main__":
+    carpeta = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+    print(f"✅ {precomprimir(carpeta)} archivo(s) precomprimido(s) en {carpeta}")
@@ -0,0 +1,11 @@
+"""
+Punto de entrada WSGI para producción (sin el servidor de desarrollo ni el debugger).
+
+    python servidor.py --workers 4        # gunicorn (Linux) / waitress (Windows)
+    gunicorn -c servidor.py wsgi:app      # o directo, con la misma configuración
+
+Cada worker abre sus propias conexiones SQLite (una por hilo, db.pooled_conn) con WAL.
+"""
+from app import app
+
+application = app